@@ -728,6 +728,17 @@ The window to use during cHPI coil amplitude estimation and in cHPI filtering.
 Can be "auto" to autodetect a reasonable value or a float (in seconds).
 """
 
+mf_mc_batched_fit: bool = False
+"""
+If True, estimate the cHPI coil amplitudes and SNR of all time windows in
+batches instead of one window at a time. This is considerably faster for long
+recordings. The results are the same up to numerical precision, except that
+the sign of the amplitudes, which has no effect on the estimated coil
+locations, may differ. This relies on internals of MNE-Python; if these are not
+available in the installed version, a warning is emitted and
+`mne.chpi.compute_chpi_amplitudes()` is used instead.
+"""
+
 mf_mc_gof_limit: float = 0.98
 """
 Minimum goodness of fit to accept for each cHPI coil.
@@ -757,6 +768,27 @@ the same value as [`mf_mc`][mne_bids_pipeline._config.mf_mc].
 Only used when [`use_maxwell_filter=True`][mne_bids_pipeline._config.use_maxwell_filter]
 """  # noqa: E501
 
+mf_chunk_duration: Annotated[float, Interval(gt=0)] | None = None
+"""
+If not `None`, each recording is split into chunks of about this many seconds
+that are Maxwell filtered in parallel threads. The number of threads is the
+number of [`n_jobs`][mne_bids_pipeline._config.n_jobs] not needed to process
+the recordings of all subjects in parallel, so this mostly helps when there are
+fewer recordings than jobs, e.g., for long recordings of a single subject.
+
+The chunks start and end at tSSS window boundaries (see
+[`mf_st_duration`][mne_bids_pipeline._config.mf_st_duration]) within the
+contiguous data segments, and they are padded with enough data (at least one
+tSSS window, and with movement compensation the data since the preceding head
+position) that, apart from numerical precision, the result is identical to
+filtering the whole recording at once.
+
+???+ example "Example"
+    ```python
+    mf_chunk_duration = 300.  # five-minute chunks
+    ```
+"""
+
 # ## Filtering & resampling
 
 # ### Filtering
@@ -836,6 +868,18 @@ notch_widths: float | Sequence[float] | None = None
 Specifies the width of each stop band. `None` uses the MNE default.
 """
 
+raw_filter_single_pass: bool = False
+"""
+Whether to apply the notch and band-pass filters in a single pass. The FIR
+filter for all notch frequencies and the band-pass FIR filter are then combined
+into one filter, which is applied to the data in place, instead of filtering
+the data twice, which saves most of the time spent on the notch filter.
+
+Apart from numerical precision, the filtered data only differ near the edges of
+the data (and of the data segments separated by `"edge"` and `"bad_acq_skip"`
+annotations), as the data are padded once instead of before each filter.
+"""
+
 # ### Resampling
 #
 # If you have acquired data with a very high sampling frequency (e.g. 2 kHz)
@@ -857,6 +901,64 @@ If `None`, then no resampling will be done.
     ```
 """
 
+raw_resample_method: Literal["fft", "polyphase"] = "fft"
+"""
+How to resample the raw data. `"fft"` resamples the whole recording in the
+frequency domain. `"polyphase"` uses a polyphase anti-aliasing FIR filter (as
+`scipy.signal.resample_poly`), which is usually faster and only affects the
+data locally, but requires the ratio of
+[`raw_resample_sfreq`][mne_bids_pipeline._config.raw_resample_sfreq] and the
+original sampling frequency to be a fraction with a small denominator
+(e.g., 5000 Hz to 250 Hz or 1100 Hz to 500 Hz).
+"""
+
+raw_resample_before_filter: bool = False
+"""
+Whether to resample the raw data before applying the notch and band-pass
+filters instead of after. When
+[`raw_resample_sfreq`][mne_bids_pipeline._config.raw_resample_sfreq] is much
+lower than the original sampling frequency, this is much faster, as the
+filters are applied to far fewer samples. The anti-aliasing filter of the
+resampling already removes everything above the new Nyquist frequency, so notch
+frequencies above it are skipped.
+
+Apart from the slightly different filters designed for the lower sampling
+frequency, and the filter edge effects, the results are equivalent. Make sure
+that [`h_freq`][mne_bids_pipeline._config.h_freq] is sufficiently below the
+new Nyquist frequency.
+"""
+
+raw_filter_block_duration: Annotated[float, Interval(gt=0)] | None = None
+"""
+If not `None`, the frequency filtering and resampling of the raw data are done
+in blocks of this many seconds (of resampled data) instead of on the whole
+recording at once, so that the memory needed per run only depends on the block
+size and the filter lengths, not on the duration of the recording. The result is
+written to a temporary file next to the output as it is computed.
+
+The filters are the same as those used otherwise, and they are applied to the
+contiguous data segments (separated by `"edge"` and `"bad_acq_skip"`
+annotations) with the same edge handling, so apart from numerical precision the
+filtered data are identical. Resampling is always done using the
+`"polyphase"` [`raw_resample_method`][mne_bids_pipeline._config.raw_resample_method]
+in this case.
+
+Without Maxwell filtering, the raw data are still read into memory as a whole
+when they are imported, so only the memory for the filtered and resampled copy is
+saved.
+
+This option and
+[`raw_filter_single_pass`][mne_bids_pipeline._config.raw_filter_single_pass]
+rely on internals of MNE-Python. If these are not available in the installed
+version, a warning is emitted and the data are filtered using `raw.filter()`
+and resampled using `raw.resample()` instead.
+
+???+ example "Example"
+    ```python
+    raw_filter_block_duration = 60.  # filter one minute at a time
+    ```
+"""
+
 epochs_decim: int = 1
 """
 Says how much to decimate data at the epochs level.
@@ -1125,6 +1227,20 @@ Artifact regression is applied before SSP or ICA.
     ```
 """  # noqa: E501
 
+fuse_raw_processing: bool = False
+"""
+Whether to apply the artifact regression in the same step as the frequency
+filtering and resampling. If `True` and
+[`regress_artifact`][mne_bids_pipeline._config.regress_artifact] is set, each
+run is read only once, filtered, resampled and regressed in memory, and only
+the regressed data are written to disk, instead of first writing the filtered
+data (`proc-filt`) and reading them back for the regression. The continuous data
+cleaned with SSP or ICA are then also based on the regressed data.
+
+If [`regress_artifact`][mne_bids_pipeline._config.regress_artifact] is `None`,
+this setting has no effect.
+"""
+
 spatial_filter: Literal["ssp", "ica"] | None = None
 """
 Whether to use a spatial filter to detect and remove artifacts. The BIDS
@@ -2248,7 +2364,52 @@ The method to use for cache invalidation (i.e., detecting changes). Using the
 "modified time" reported by the filesystem (`'mtime'`, default) is very fast
 but requires that the filesystem supports proper mtime reporting. Using file
 hashes (`'hash'`) is slower and requires reading all input files but should
-work on any filesystem.
+work on any filesystem. To avoid reading unchanged files over and over again,
+the computed hashes are stored in the caching directory and reused as long as
+the size, modification time, and inode of a file remain the same.
+"""
+
+memory_content_store: bool = False
+"""
+If `True`, identical FIF output files (e.g., when re-running a step produces
+byte-identical results, or when a step writes an unchanged copy of its input)
+are only stored once on disk. They are kept in a content-addressed store in
+the caching directory (see
+[`memory_location`][mne_bids_pipeline._config.memory_location]) and
+hard-linked to their locations in the derivatives directory. Blobs that are
+not linked to from the derivatives directory anymore are removed at the end
+of each run. Requires a file system that supports hard links, and the caching
+directory to be on the same file system as the derivatives.
+
+The pipeline removes the linked output files of a processing step before
+running it again (also if the content store or caching are disabled later on),
+and checks the stored files against their hash before linking them again.
+
+???+ warning "Warning"
+    Because files are hard-linked, modifying a derivative file in place outside
+    of the pipeline would also modify all other files with identical contents.
+"""
+
+memory_max_size: str | int | None = None
+"""
+The maximum size of the cache, either in bytes or as a string like `"500M"`
+or `"10G"`. If exceeded, the least recently used cache entries are removed at
+the end of each run (or when running with `--cache-gc`), while always keeping
+the most recently used entry of each processing step. `None` (default) does
+not limit the cache size.
+
+???+ example "Example"
+    ```python
+    memory_max_size = "10G"
+    ```
+"""
+
+memory_max_age: float | None = None
+"""
+The maximum age (in days since last use) of cache entries. Older entries are
+removed at the end of each run (or when running with `--cache-gc`), except
+for the most recently used entry of each processing step. `None` (default)
+does not limit the age of cache entries.
 """
 
 memory_verbose: int = 0
@@ -2276,6 +2437,44 @@ be installed. Ignored if [`n_jobs`][mne_bids_pipeline._config.n_jobs] is set to
 `1`.
 """
 
+parallel_across_steps: bool = False
+"""
+Whether to let each subject proceed through the processing steps independently
+of all other subjects. By default (`False`), each step is completed for all
+subjects before the next step is started, so the slowest subject of a step
+holds back all others. If `True`, the subject-level preprocessing and
+sensor-space steps are instead run subject by subject in a single pool of
+[`n_jobs`][mne_bids_pipeline._config.n_jobs] workers, so a subject can already
+be epoched while another one is still being Maxwell-filtered. Group-level
+steps are only started once all subjects have been processed. Ignored if
+`n_jobs` is set to `1`.
+
+???+ info "Good Practice / Advice"
+    This is most beneficial for studies with many subjects whose recordings
+    differ in length. Note that each subject is processed by a single worker,
+    so it cannot speed up the processing of a single subject.
+"""
+
+parallel_memory_budget: str | int | None = None
+"""
+The total amount of memory that the parallel tasks may use at the same time,
+either in bytes or as a string like `"48G"`. If set, the number of tasks of a
+step that run in parallel is limited such that their peak memory usage, as
+recorded for this step during previous runs, stays within the budget. A new
+task is then only started once a running one has finished. Steps without
+recorded memory usage run with
+[`n_jobs`][mne_bids_pipeline._config.n_jobs] parallel tasks. `None` (default)
+does not limit the number of parallel tasks. Ignored if `n_jobs` is `1`.
+
+???+ example "Example"
+    Use all 16 cores for steps with low memory requirements, but run fewer
+    tasks at once for memory-intensive steps like Maxwell filtering:
+    ```python
+    n_jobs = 16
+    parallel_memory_budget = "56G"
+    ```
+"""
+
 dask_open_dashboard: bool = False
 """
 Whether to open the Dask dashboard in the default webbrowser automatically.
@@ -11,6 +11,7 @@ from types import SimpleNamespace
 import matplotlib
 import mne
 import numpy as np
+from joblib.disk import memstr_to_bytes
 from pydantic import BaseModel, ConfigDict, ValidationError
 
 from ._logging import gen_log_kwargs, logger
@@ -83,6 +84,8 @@ def _import_config(
         # Parallelization
         "n_jobs",
         "parallel_backend",
+        "parallel_across_steps",
+        "parallel_memory_budget",
         "dask_temp_dir",
         "dask_worker_memory_limit",
         "dask_open_dashboard",
@@ -94,6 +97,9 @@ def _import_config(
         "memory_subdir",
         "memory_verbose",
         "memory_file_method",
+        "memory_content_store",
+        "memory_max_size",
+        "memory_max_age",
         # Misc
         "deriv_root",
         "config_path",
@@ -246,6 +252,18 @@ def _check_config(config: SimpleNamespace, config_path: PathLike | None) -> None
     ):
         raise ValueError("Cannot use Maxwell filter without MEG channels.")
 
+    if (
+        config.raw_resample_before_filter
+        and config.raw_resample_sfreq is not None
+        and config.h_freq is not None
+        and config.h_freq >= config.raw_resample_sfreq / 2.0
+    ):
+        raise ValueError(
+            "When resampling before filtering (raw_resample_before_filter=True), "
+            f"h_freq ({config.h_freq} Hz) must be below the Nyquist frequency of "
+            f"the resampled data ({config.raw_resample_sfreq / 2.0} Hz)."
+        )
+
     reject = config.reject
     ica_reject = config.ica_reject
     if config.spatial_filter == "ica":
@@ -314,6 +332,18 @@ def _check_config(config: SimpleNamespace, config_path: PathLike | None) -> None
                 f"but you set baseline={bl}"
             )
 
+    for key in ("memory_max_size", "parallel_memory_budget"):
+        val = getattr(config, key)
+        if not isinstance(val, str):
+            continue
+        try:
+            memstr_to_bytes(val)
+        except ValueError:
+            raise ValueError(
+                f'{key} must be a number of bytes or a string like "10G", '
+                f"got {repr(val)}"
+            )
+
     # check cluster permutation parameters
     if config.cluster_n_permutations < 10 / config.cluster_permutation_p_threshold:
         raise ValueError(
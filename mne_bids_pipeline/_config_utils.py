@@ -1,8 +1,13 @@
 """Utilities for mangling config vars."""
 
+import atexit
 import copy
 import functools
+import json
+import os
 import pathlib
+import re
+import tempfile
 from collections.abc import Iterable
 from types import ModuleType, SimpleNamespace
 from typing import Any, Literal, TypeVar
@@ -48,9 +53,91 @@ def get_fs_subject(config: SimpleNamespace, subject: str) -> str:
         return f"sub-{subject}"
 
 
+# Points worker processes to the BIDS index written by the main process
+_BIDS_INDEX_ENV = "_MNE_BIDS_PIPELINE_BIDS_INDEX"
+_ENTITY_ABBR = dict(subject="sub", session="ses", task="task", run="run")
+
+
+@functools.cache
+def _get_bids_index(bids_root: pathlib.Path) -> dict[str, list[tuple[tuple, str]]]:
+    """Get the (parent directories, name) of all files, by top-level directory.
+
+    Like mne_bids.get_entity_vals(), derivatives, sourcedata and hidden files are
+    skipped. The dataset is only walked once per process, and not at all by
+    workers, which read the index shared by the main process.
+    """
+    fname = os.environ.get(_BIDS_INDEX_ENV)
+    if fname:
+        try:
+            with open(fname, encoding="utf-8") as fid:
+                shared = json.load(fid)
+        except (OSError, json.JSONDecodeError):
+            shared = dict(bids_root=None)
+        if shared["bids_root"] == str(bids_root):
+            return {
+                top: [(tuple(parts), name) for parts, name in files]
+                for top, files in shared["files"].items()
+            }
+    index = dict()
+    for dirpath, dirs, files in os.walk(bids_root):
+        parts = pathlib.Path(dirpath).relative_to(bids_root).parts
+        if not parts:
+            dirs[:] = [d for d in dirs if d not in ("derivatives", "sourcedata")]
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        index.setdefault(parts[0] if parts else "", []).extend(
+            (parts, name) for name in sorted(files) if not name.startswith(".")
+        )
+    return index
+
+
+def _share_bids_index(bids_root: pathlib.Path) -> None:
+    """Write the BIDS index to a file that worker processes started later read."""
+    index = _get_bids_index(bids_root)
+    fd, fname = tempfile.mkstemp(prefix="mne_bids_pipeline_", suffix=".json")
+    with os.fdopen(fd, "w", encoding="utf-8") as fid:
+        json.dump(dict(bids_root=str(bids_root), files=index), fid)
+    atexit.register(pathlib.Path(fname).unlink, missing_ok=True)
+    os.environ[_BIDS_INDEX_ENV] = fname
+
+
 @functools.cache
-def _get_entity_vals_cached(*args, **kwargs) -> list[str]:
-    return mne_bids.get_entity_vals(*args, **kwargs)
+def _get_entity_vals_cached(
+    bids_root: pathlib.Path,
+    *,
+    entity_key: Literal["subject", "session", "task", "run"],
+    ignore_datatypes: tuple[str] = (),
+    subject: str | None = None,
+) -> list[str]:
+    """Get the values of an entity like mne_bids.get_entity_vals().
+
+    The values are looked up in the index of the dataset rather than walking the
+    directory tree each time. If subject is given, only its directory is used.
+    """
+    entity_abbr = _ENTITY_ABBR[entity_key]
+    pattern = re.compile(rf"{entity_abbr}-(.*?)_")
+    index = _get_bids_index(bids_root)
+    if subject is None:
+        files = [file for top_files in index.values() for file in top_files]
+    else:
+        files = [
+            (parts, name)
+            for parts, name in index.get(f"sub-{subject}", [])
+            if len(parts) < 2 or parts[1] not in ("derivatives", "sourcedata")
+        ]
+    values = set()
+    for parts, name in files:
+        if f"{entity_abbr}-" not in name or "_" not in name:
+            continue
+        parent = parts[-1] if parts else bids_root.name
+        if parent in ignore_datatypes:
+            continue
+        stem = pathlib.PurePath(name).stem
+        if stem.startswith("sub-emptyroom_"):
+            continue
+        match = pattern.search(stem)
+        if match is not None:
+            values.add(match.group(1))
+    return sorted(values)
 
 
 def get_datatype(config: SimpleNamespace) -> Literal["meg", "eeg"]:
@@ -87,7 +174,7 @@ def _get_ignore_datatypes(config: SimpleNamespace) -> tuple[str]:
 
 def get_subjects(config: SimpleNamespace) -> list[str]:
     _valid_subjects = _get_entity_vals_cached(
-        root=config.bids_root,
+        config.bids_root,
         entity_key="subject",
         ignore_datatypes=_get_ignore_datatypes(config),
     )
@@ -115,7 +202,7 @@ def get_subjects(config: SimpleNamespace) -> list[str]:
 def get_sessions(config: SimpleNamespace) -> list[None] | list[str]:
     sessions = copy.deepcopy(config.sessions)
     _all_sessions = _get_entity_vals_cached(
-        root=config.bids_root,
+        config.bids_root,
         entity_key="session",
         ignore_datatypes=_get_ignore_datatypes(config),
     )
@@ -163,9 +250,10 @@ def _get_runs_all_subjects_cached(
     for subject in get_subjects(config):
         # Only traverse through the current subject's directory
         valid_runs_subj = _get_entity_vals_cached(
-            config.bids_root / f"sub-{subject}",
+            config.bids_root,
             entity_key="run",
             ignore_datatypes=_get_ignore_datatypes(config),
+            subject=subject,
         )
 
         # If we don't have any `run` entities, just set it to None, as we
@@ -321,7 +409,7 @@ def get_task(config: SimpleNamespace) -> str | None:
     if task:
         return task
     _valid_tasks = _get_entity_vals_cached(
-        root=config.bids_root,
+        config.bids_root,
         entity_key="task",
         ignore_datatypes=_get_ignore_datatypes(config),
     )
@@ -373,18 +461,13 @@ def get_mf_cal_fname(
     *, config: SimpleNamespace, subject: str, session: str
 ) -> pathlib.Path:
     if config.mf_cal_fname is None:
-        bids_path = BIDSPath(
-            subject=subject,
-            session=session,
-            suffix="meg",
-            datatype="meg",
-            root=config.bids_root,
-        ).match()[0]
-        mf_cal_fpath = bids_path.meg_calibration_fpath
+        mf_cal_fpath = _get_mf_bids_fpaths(
+            bids_root=config.bids_root, subject=subject, session=session
+        )[0]
         if mf_cal_fpath is None:
             raise ValueError(
                 "Could not determine Maxwell Filter Calibration file from BIDS "
-                f"definition for file {bids_path}."
+                f"definition for subject {subject}, session {session}."
             )
     else:
         mf_cal_fpath = pathlib.Path(config.mf_cal_fname).expanduser().absolute()
@@ -401,13 +484,9 @@ def get_mf_ctc_fname(
     *, config: SimpleNamespace, subject: str, session: str
 ) -> pathlib.Path:
     if config.mf_ctc_fname is None:
-        mf_ctc_fpath = BIDSPath(
-            subject=subject,
-            session=session,
-            suffix="meg",
-            datatype="meg",
-            root=config.bids_root,
-        ).meg_crosstalk_fpath
+        mf_ctc_fpath = _get_mf_bids_fpaths(
+            bids_root=config.bids_root, subject=subject, session=session
+        )[1]
         if mf_ctc_fpath is None:
             raise ValueError("Could not find Maxwell Filter cross-talk file.")
     else:
@@ -421,6 +500,27 @@ def get_mf_ctc_fname(
     return mf_ctc_fpath
 
 
+@functools.cache
+def _get_mf_bids_fpaths(
+    *, bids_root: pathlib.Path, subject: str, session: str | None
+) -> tuple[pathlib.Path | None, pathlib.Path | None]:
+    """Get the fine-calibration and cross-talk files of a subject and session.
+
+    These are shared by all runs, so the directory of the session is only
+    searched once instead of for the configuration of each run.
+    """
+    bids_path = BIDSPath(
+        subject=subject,
+        session=session,
+        suffix="meg",
+        datatype="meg",
+        root=bids_root,
+    )
+    matches = bids_path.match()
+    cal_fpath = matches[0].meg_calibration_fpath if matches else None
+    return cal_fpath, bids_path.meg_crosstalk_fpath
+
+
 RawEpochsEvokedT = TypeVar(
     "RawEpochsEvokedT", bound=mne.io.BaseRaw | mne.BaseEpochs | mne.Evoked
 )
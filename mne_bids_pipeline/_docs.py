@@ -35,6 +35,8 @@ _EXECUTION_OPTIONS = (
     # Eventually we could deduplicate these with the execution.md list
     "n_jobs",
     "parallel_backend",
+    "parallel_across_steps",
+    "parallel_memory_budget",
     "dask_open_dashboard",
     "dask_temp_dir",
     "dask_worker_memory_limit",
@@ -45,6 +47,9 @@ _EXECUTION_OPTIONS = (
     "memory_file_method",
     "memory_subdir",
     "memory_verbose",
+    "memory_content_store",
+    "memory_max_size",
+    "memory_max_age",
     "config_validation",
     "interactive",
 )
@@ -1,10 +1,18 @@
-from collections.abc import Iterable
+import copy
+import functools
+import importlib
+import inspect
+import json
+import pathlib
+import time
+from collections.abc import Callable, Iterable
 from types import SimpleNamespace
 from typing import Literal
 
 import mne
 import numpy as np
 import pandas as pd
+from filelock import FileLock
 from mne_bids import BIDSPath, get_bids_path_from_fname, read_raw_bids
 
 from ._config_utils import (
@@ -18,7 +26,12 @@ from ._config_utils import (
 )
 from ._io import _read_json
 from ._logging import gen_log_kwargs, logger
-from ._run import _update_for_splits
+from ._run import (
+    _HASH_INDEX_MIN_AGE,
+    _get_memory_location,
+    _update_for_splits,
+    _write_json_atomic,
+)
 from .typing import PathLike
 
 
@@ -148,16 +161,78 @@ def make_epochs(
     return epochs
 
 
-def annotations_to_events(*, raw_paths: list[PathLike]) -> dict[str, int]:
+def _concatenate_epochs(epochs_list: list[mne.BaseEpochs]) -> mne.BaseEpochs:
+    """Concatenate the preloaded epochs of several runs.
+
+    This is equivalent to ``mne.concatenate_epochs(epochs_list)``, but the
+    epochs are removed from epochs_list once their data have been copied into
+    the preallocated output. The peak memory usage is thus the size of the
+    result plus the largest run, rather than twice the size of the result.
+    With MNE versions lacking the private function needed for this,
+    ``mne.concatenate_epochs()`` is used instead.
+    """
+    if len(epochs_list) == 1:
+        return epochs_list.pop()
+    concatenate_epochs = _get_mne_private_func(
+        "mne.epochs",
+        "_concatenate_epochs",
+        ("epochs_list", "with_data", "add_offset", "on_mismatch"),
+    )
+    if concatenate_epochs is None:
+        epochs = mne.concatenate_epochs(epochs_list, on_mismatch="warn", verbose=False)
+        epochs_list.clear()
+        return epochs
+    (
+        info,
+        _,
+        raw_sfreq,
+        events,
+        event_id,
+        tmin,
+        _,
+        metadata,
+        baseline,
+        _,
+        drop_log,
+    ) = concatenate_epochs(epochs_list, with_data=False, on_mismatch="warn")
+    n_epochs = [len(epochs) for epochs in epochs_list]
+    first_data = epochs_list[0].get_data(copy=False)
+    data = np.empty((sum(n_epochs), *first_data.shape[1:]), dtype=first_data.dtype)
+    del first_data
+    start = 0
+    for n in n_epochs:
+        data[start : start + n] = epochs_list.pop(0).get_data(copy=False)
+        start += n
+    epochs = mne.EpochsArray(
+        data=data,
+        info=info,
+        events=events,
+        event_id=event_id,
+        tmin=tmin,
+        baseline=None,
+        selection=np.where([len(d) == 0 for d in drop_log])[0],
+        drop_log=drop_log,
+        proj=False,
+        on_missing="ignore",
+        metadata=metadata,
+        raw_sfreq=raw_sfreq,
+        verbose=False,
+    )
+    # Don't reapply the baseline correction, but keep the original baseline
+    epochs.baseline = baseline
+    return epochs
+
+
+def annotations_to_events(
+    *, raw_paths: list[BIDSPath], exec_params: SimpleNamespace
+) -> dict[str, int]:
     """Generate a unique event name -> event code mapping.
 
     The mapping can that can be used across all passed raws.
     """
     event_names: list[str] = []
-    for raw_fname in raw_paths:
-        raw = mne.io.read_raw_fif(raw_fname)
-        _, event_id = mne.events_from_annotations(raw=raw)
-        for event_name in event_id.keys():
+    for entry in _read_event_index(raw_paths=raw_paths, exec_params=exec_params):
+        for event_name in entry["event_names"]:
             if event_name not in event_names:
                 event_names.append(event_name)
 
@@ -169,6 +244,65 @@ def annotations_to_events(*, raw_paths: list[PathLike]) -> dict[str, int]:
     return event_name_to_code_map
 
 
+def _read_event_index(
+    *, raw_paths: list[BIDSPath], exec_params: SimpleNamespace
+) -> list[dict]:
+    """Get the events of raw files without parsing their annotations every time.
+
+    The events of each file are stored in a per-subject index in the cache
+    directory, keyed on the file path. An entry is reused as long as the size,
+    mtime and inode of the file are unchanged.
+    """
+    location = _get_memory_location(exec_params)
+    if location is None:
+        return [_get_raw_events(raw_path) for raw_path in raw_paths]
+    bids_path = raw_paths[0]
+    name = f"sub-{bids_path.subject}"
+    if bids_path.session is not None:
+        name += f"_ses-{bids_path.session}"
+    fname = location / "event_index" / f"{name}.json"
+    entries = _read_event_index_file(fname)
+    new_entries = dict()
+    for raw_path in raw_paths:
+        path = pathlib.Path(raw_path)
+        stat = path.stat()
+        meta = dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns, inode=stat.st_ino)
+        entry = entries.get(str(path))
+        if entry is None or {k: entry[k] for k in meta} != meta:
+            entry = entries[str(path)] = dict(**meta, **_get_raw_events(path))
+            if time.time() - stat.st_mtime >= _HASH_INDEX_MIN_AGE:
+                new_entries[str(path)] = entry
+    if new_entries:
+        fname.parent.mkdir(parents=True, exist_ok=True)
+        with FileLock(fname.with_suffix(fname.suffix + ".lock")):
+            entries = _read_event_index_file(fname)
+            entries.update(new_entries)
+            _write_json_atomic(fname, entries)
+    return [entries[str(pathlib.Path(raw_path))] for raw_path in raw_paths]
+
+
+def _read_event_index_file(fname: pathlib.Path) -> dict:
+    try:
+        with open(fname, encoding="utf-8") as fid:
+            return json.load(fid)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return dict()
+
+
+def _get_raw_events(raw_path: PathLike) -> dict:
+    raw = mne.io.read_raw_fif(raw_path)
+    events, event_id = mne.events_from_annotations(raw=raw)
+    code_to_name = {code: name for name, code in event_id.items()}
+    return dict(
+        sfreq=float(raw.info["sfreq"]),
+        first_samp=int(raw.first_samp),
+        n_times=int(raw.n_times),
+        event_names=list(event_id),
+        samples=events[:, 0].tolist(),
+        names=[code_to_name[code] for code in events[:, 2]],
+    )
+
+
 def _rename_events_func(
     cfg: SimpleNamespace,
     raw: mne.io.BaseRaw,
@@ -530,7 +664,7 @@ def _get_bids_path_in(
     session: str | None,
     run: str | None,
     task: str | None,
-    kind: Literal["orig", "sss", "filt"] = "orig",
+    kind: Literal["orig", "sss", "filt", "regress"] = "orig",
 ) -> BIDSPath:
     # b/c can be used before this is updated
     path_kwargs = dict(
@@ -545,7 +679,7 @@ def _get_bids_path_in(
         check=False,
     )
     if kind != "orig":
-        assert kind in ("sss", "filt"), kind
+        assert kind in ("sss", "filt", "regress"), kind
         path_kwargs["root"] = cfg.deriv_root
         path_kwargs["suffix"] = "raw"
         path_kwargs["extension"] = ".fif"
@@ -566,7 +700,7 @@ def _get_run_path(
     session: str | None,
     run: str | None,
     task: str | None,
-    kind: Literal["orig", "sss", "filt"],
+    kind: Literal["orig", "sss", "filt", "regress"],
     add_bads: bool | None = None,
     allow_missing: bool = False,
     key: str | None = None,
@@ -596,7 +730,7 @@ def _get_rest_path(
     cfg: SimpleNamespace,
     subject: str,
     session: str | None,
-    kind: Literal["orig", "sss", "filt"],
+    kind: Literal["orig", "sss", "filt", "regress"],
     add_bads: bool | None = None,
 ) -> dict:
     if not (cfg.process_rest and not cfg.task_is_rest):
@@ -618,14 +752,14 @@ def _get_noise_path(
     cfg: SimpleNamespace,
     subject: str,
     session: str | None,
-    kind: Literal["orig", "sss", "filt"],
+    kind: Literal["orig", "sss", "filt", "regress"],
     mf_reference_run: str | None,
     add_bads: bool | None = None,
 ) -> dict:
     if not (cfg.process_empty_room and get_datatype(config=cfg) == "meg"):
         return dict()
     if kind != "orig":
-        assert kind in ("sss", "filt")
+        assert kind in ("sss", "filt", "regress")
         raw_fname = _get_bids_path_in(
             cfg=cfg,
             subject=subject,
@@ -666,7 +800,7 @@ def _get_run_rest_noise_path(
     session: str | None,
     run: str | None,
     task: str | None,
-    kind: Literal["orig", "sss", "filt"],
+    kind: Literal["orig", "sss", "filt", "regress"],
     mf_reference_run: str | None,
     add_bads: bool | None = None,
 ) -> dict:
@@ -717,7 +851,7 @@ def _path_dict(
     cfg: SimpleNamespace,
     bids_path_in: BIDSPath,
     add_bads: bool | None = None,
-    kind: Literal["orig", "sss", "filt"],
+    kind: Literal["orig", "sss", "filt", "regress"],
     allow_missing: bool,
     key: str | None = None,
     subject: str,
@@ -770,6 +904,51 @@ def _read_bads_tsv(
     return bads_tsv[bads_tsv.columns[0]].tolist()
 
 
+def _read_mf_calibration(fname: PathLike | None) -> dict | None:
+    """Read a fine-calibration file, reusing the result for unchanged files."""
+    if fname is None:
+        return None
+    fname = pathlib.Path(fname)
+    calibration = _read_mf_calibration_cached(
+        fname=fname, mtime_ns=fname.stat().st_mtime_ns
+    )
+    return copy.deepcopy(calibration)
+
+
+@functools.lru_cache(maxsize=4)
+def _read_mf_calibration_cached(*, fname: pathlib.Path, mtime_ns: int) -> dict:
+    return mne.preprocessing.read_fine_calibration(fname)
+
+
+class _Digitization:
+    """The digitization points of a recording, compared by their values."""
+
+    def __init__(self, info: mne.Info):
+        self.info = info
+        self.key = tuple((d["kind"], d["ident"], *d["r"]) for d in info["dig"])
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _Digitization) and self.key == other.key
+
+
+def _get_mf_head_origin(
+    origin: Literal["auto"] | np.ndarray, info: mne.Info
+) -> Literal["auto"] | np.ndarray:
+    """Fit the head origin once for the digitization shared by all runs."""
+    if not isinstance(origin, str) or not info["dig"]:
+        return origin
+    assert origin == "auto", origin
+    return _fit_mf_head_origin_cached(_Digitization(info)).copy()
+
+
+@functools.lru_cache(maxsize=4)
+def _fit_mf_head_origin_cached(dig: _Digitization) -> np.ndarray:
+    return mne.bem.fit_sphere_to_headshape(dig.info, units="m", verbose=False)[1]
+
+
 def _import_data_kwargs(*, config: SimpleNamespace, subject: str) -> dict:
     """Get config params needed for any raw data loading."""
     return dict(
@@ -826,3 +1005,78 @@ def _read_raw_msg(
     else:
         run_type = "experimental"
     return f"Reading {run_type} recording: {bids_path_in.basename}", run_type
+
+
+def _read_raw_fif(fname: BIDSPath, *, preload: bool = False) -> mne.io.Raw:
+    """Read processed raw data, by default without loading them into memory.
+
+    Without preload, data are only read from disk when accessed, e.g., for the
+    time windows of epochs. Preloading is only needed for in-place operations.
+    """
+    return mne.io.read_raw_fif(fname, preload=preload)
+
+
+def _get_mne_private_func(
+    module: str, name: str, params: tuple[str, ...]
+) -> Callable | None:
+    """Get a private MNE function if its leading parameters are as expected.
+
+    Returns None if the function is missing or has changed in the installed MNE
+    version, so that the caller can fall back to the public API.
+    """
+    try:
+        func = getattr(importlib.import_module(module), name)
+        these_params = tuple(inspect.signature(func).parameters)
+    except (ImportError, AttributeError, TypeError, ValueError):
+        return None
+    if these_params[: len(params)] != params:
+        return None
+    return func
+
+
+def _get_picks(
+    info: mne.Info,
+    picks: str | Iterable | None,
+    *,
+    none: str = "data",
+    exclude: str | Iterable = "bads",
+) -> np.ndarray:
+    """Get the indices of the picked channels like MNE functions do."""
+    picks_to_idx = _get_mne_private_func(
+        "mne._fiff.pick", "_picks_to_idx", ("info", "picks", "none", "exclude")
+    )
+    if picks_to_idx is not None:
+        return picks_to_idx(info, picks, none, exclude=exclude)
+    # Pick the channels of a single-sample raw instead
+    raw = mne.io.RawArray(np.zeros((len(info.ch_names), 1)), info, verbose=False)
+    raw.pick(none if picks is None else picks, exclude=exclude)
+    return np.array([info.ch_names.index(ch_name) for ch_name in raw.ch_names], int)
+
+
+def _get_segments(raw: mne.io.BaseRaw) -> list[tuple[int, int]]:
+    """Get the segments raw.filter() and maxwell_filter() process separately.
+
+    These are the sample ranges between "edge" and "bad_acq_skip" annotations.
+    """
+    kinds = ("edge", "bad_acq_skip")
+    starts_stops = _get_mne_private_func(
+        "mne.annotations", "_annotations_starts_stops", ("raw", "kinds")
+    )
+    if starts_stops is not None:
+        return list(zip(*starts_stops(raw, kinds, invert=True)))
+    skip = [
+        desc.upper().startswith(tuple(kind.upper() for kind in kinds))
+        for desc in raw.annotations.description
+    ]
+    onsets = raw.annotations.onset[skip] - raw.first_time
+    ends = raw.time_as_index(onsets + raw.annotations.duration[skip], use_rounding=True)
+    onsets = raw.time_as_index(onsets, use_rounding=True)
+    mask = np.ones(raw.n_times, bool)
+    for onset, end in zip(onsets, ends):
+        mask[onset:end] = False
+    change = np.diff(np.concatenate([[False], mask, [False]]).astype(int))
+    # Annotations without duration (e.g., from concatenation) split segments
+    splits = onsets[onsets == ends]
+    starts = np.sort(np.concatenate([np.flatnonzero(change == 1), splits]))
+    stops = np.sort(np.concatenate([np.flatnonzero(change == -1), splits]))
+    return list(zip(starts, stops))
@@ -1,6 +1,9 @@
 """I/O helpers."""
 
+import pathlib
+
 import json_tricks
+import mne
 
 from .typing import PathLike
 
@@ -13,3 +16,9 @@ def _write_json(fname: PathLike, data: dict) -> None:
 def _read_json(fname: PathLike) -> dict:
     with open(fname, encoding="utf-8") as f:
         return json_tricks.load(f)
+
+
+def _write_info(fname: PathLike, info: mne.Info) -> None:
+    # Not all supported MNE versions can overwrite an existing file
+    pathlib.Path(fname).unlink(missing_ok=True)
+    mne.io.write_info(fname, info)
@@ -1,17 +1,31 @@
 import argparse
+import copy
+import importlib
 import pathlib
 import time
 from textwrap import dedent
 from types import ModuleType, SimpleNamespace
 
 import numpy as np
+import pandas as pd
 
 from ._config_import import _import_config
 from ._config_template import create_template_config
-from ._config_utils import _get_step_modules
+from ._config_utils import (
+    _get_step_modules,
+    _share_bids_index,
+    get_mf_reference_run,
+    get_subjects,
+)
 from ._logging import gen_log_kwargs, logger
-from ._parallel import get_parallel_backend
-from ._run import _short_step_path
+from ._parallel import (
+    _log_worker_reuse,
+    get_n_jobs,
+    get_parallel_backend,
+    parallel_func,
+)
+from ._run import _LOG_KEYS, _export_logs, _gc_cache, _plan, _short_step_path
+from ._telemetry import _read_telemetry
 
 
 def main():
@@ -106,6 +120,29 @@ def main():
         action="store_true",
         help="Disable caching of intermediate results.",
     )
+    parser.add_argument(
+        "--cache-gc",
+        dest="cache_gc",
+        action="store_true",
+        help="Clean up the cache according to the memory_max_size and "
+        "memory_max_age settings, report the reclaimed space, and exit "
+        "without running any steps.",
+    )
+    parser.add_argument(
+        "--plan",
+        dest="plan",
+        action="store_true",
+        help="Do not run anything, but report which tasks of the requested "
+        "steps would be computed (and why) or be taken from the cache, along "
+        "with runtime estimates based on previous runs.",
+    )
+    parser.add_argument(
+        "--export-logs",
+        dest="export_logs",
+        action="store_true",
+        help="Export the logs of all previous runs to an Excel workbook and "
+        "exit without running any steps.",
+    )
     options = parser.parse_args()
 
     if options.create_config is not None:
@@ -183,6 +220,10 @@ def main():
         overrides.on_error = on_error
     if not cache:
         overrides.memory_location = False
+    if options.plan:
+        # Evaluate all tasks one after another in this process
+        overrides.n_jobs = 1
+        overrides.parallel_across_steps = False
 
     step_modules: list[ModuleType] = []
     STEP_MODULES = _get_step_modules()
@@ -221,26 +262,224 @@ def main():
         config_path=config_path,
         overrides=overrides,
     )
-    # Initialize dask now
+    if options.cache_gc:
+        _gc_cache(exec_params=config_imported.exec_params, force=True)
+        del __mne_bids_pipeline_step__
+        logger.end()
+        return
+    if options.export_logs:
+        fname = _export_logs(config=config_imported)
+        msg = f"Exported the logs to {fname}"
+        logger.info(**gen_log_kwargs(message=msg, emoji="📊"))
+        del __mne_bids_pipeline_step__
+        logger.end()
+        return
+    if options.plan:
+        config_imported.exec_params.plan = True
+    if get_n_jobs(exec_params=config_imported.exec_params) > 1:
+        # So that the workers do not need to walk the dataset again
+        _share_bids_index(config_imported.bids_root)
+    # Initialize dask or start the (reusable) loky workers now
     with get_parallel_backend(config_imported.exec_params):
         pass
     del __mne_bids_pipeline_step__
     logger.end()
 
+    if config_imported.exec_params.parallel_across_steps:
+        step_groups = _group_step_modules(step_modules)
+    else:
+        step_groups = [(False, step_modules)]
+    for per_subject, these_step_modules in step_groups:
+        if per_subject and get_n_jobs(exec_params=config_imported.exec_params) > 1:
+            _run_steps_per_subject(
+                step_modules=these_step_modules, config=config_imported
+            )
+            continue
+        for step_module in these_step_modules:
+            start = time.time()
+            step = _short_step_path(pathlib.Path(step_module.__file__))
+            logger.title(title=f"{step}")
+            if options.plan and step.startswith("freesurfer/"):
+                # These run external tools and cannot be planned
+                msg = "Skipping, cannot be planned …"
+                logger.info(**gen_log_kwargs(message=msg, emoji="skip"))
+            else:
+                step_module.main(config=config_imported)
+            logger.end(f"done ({_format_elapsed(time.time() - start)})")
+
+    if options.plan:
+        _log_plan(config=config_imported)
+        return
+    __mne_bids_pipeline_step__ = pathlib.Path(__file__)  # used for logging
+    _log_worker_reuse()
+    _gc_cache(exec_params=config_imported.exec_params)
+    del __mne_bids_pipeline_step__
+
+
+def _log_plan(*, config: SimpleNamespace) -> None:
+    import rich.table
+
+    prev_times = _get_previous_times(config=config)
+    table = rich.table.Table(
+        "Step", "Subject", "Session", "Run", "Task", "Result", "Reason", "Est. time"
+    )
+    styles = dict(hit="green", miss="yellow", forced="magenta")
+    n_results = dict(hit=0, miss=0, forced=0)
+    total_time = 0.0
+    n_unknown = 0
+    for row in _plan.rows:
+        n_results[row["result"]] += 1
+        est_time = None
+        if row["result"] != "hit":
+            est_time = _estimate_time(prev_times=prev_times, row=row)
+            if est_time is None:
+                n_unknown += 1
+            else:
+                total_time += est_time
+        table.add_row(
+            row["step"],
+            *("" if row[key] is None else str(row[key]) for key in _LOG_KEYS),
+            f"[{styles[row['result']]}]{row['result']}[/]",
+            row["reason"],
+            "" if est_time is None else _format_elapsed(est_time),
+        )
+    logger.title("Plan")
+    logger._console.print(table)
+    msg = (
+        f"{n_results['hit']} cached, {n_results['miss']} to compute, "
+        f"{n_results['forced']} forced; estimated serial runtime: "
+        f"{_format_elapsed(total_time)}"
+    )
+    if n_unknown:
+        msg += f" (plus {n_unknown} task(s) without previous timing)"
+    logger.end(msg)
+
+
+def _get_previous_times(*, config: SimpleNamespace) -> dict[str, pd.DataFrame]:
+    df = _read_telemetry(config=config)
+    # Cached results say nothing about the actual runtime
+    df = df[df["cache"] != "hit"]
+    return {step: step_df for step, step_df in df.groupby("step")}
+
+
+def _estimate_time(*, prev_times: dict[str, pd.DataFrame], row: dict) -> float | None:
+    df = prev_times.get(row["step"])
+    if df is None:
+        return None
+    df = df[df["success"] == True]  # noqa: E712
+    times = pd.to_numeric(df["time"], errors="coerce")
+    if not times.notna().any():
+        return None
+    keys = pd.DataFrame(
+        {key: df[key] if key in df.columns else None for key in _LOG_KEYS}
+    ).map(lambda x: "" if pd.isna(x) else str(x))
+    this_key = pd.Series(
+        ["" if row[key] is None else str(row[key]) for key in _LOG_KEYS],
+        index=list(_LOG_KEYS),
+    )
+    match = (keys == this_key).all(axis=1) & times.notna()
+    if match.any():
+        return float(times[match].iloc[-1])
+    # Use the median of the step for tasks that have not been run before
+    return float(times.median())
+
+
+def _format_elapsed(elapsed: float) -> str:
+    hours, remainder = divmod(elapsed, 3600)
+    hours = int(hours)
+    minutes, seconds = divmod(remainder, 60)
+    minutes = int(minutes)
+    seconds = int(np.ceil(seconds))  # always take full seconds
+    elapsed = f"{seconds}s"
+    if minutes:
+        elapsed = f"{minutes}m {elapsed}"
+    if hours:
+        elapsed = f"{hours}h {elapsed}"
+    return elapsed
+
+
+def _is_subject_level(step_module: ModuleType) -> bool:
+    # Steps that process each subject without needing the results of (or
+    # sharing outputs with) any other subject. Source-level steps can share
+    # the template MRI and are thus excluded.
+    stage = step_module.__name__.split(".")[-2]
+    name = step_module.__name__.split(".")[-1]
+    return stage in ("preprocessing", "sensor") and not name.startswith("_99_")
+
+
+def _group_step_modules(
+    step_modules: list[ModuleType],
+) -> list[tuple[bool, list[ModuleType]]]:
+    """Split into consecutive groups of subject-level and other steps."""
+    step_groups = list()
     for step_module in step_modules:
-        start = time.time()
+        per_subject = _is_subject_level(step_module)
+        if not step_groups or step_groups[-1][0] != per_subject:
+            step_groups.append((per_subject, list()))
+        step_groups[-1][1].append(step_module)
+    return step_groups
+
+
+def _run_steps_per_subject(
+    *,
+    step_modules: list[ModuleType],
+    config: SimpleNamespace,
+) -> None:
+    start = time.time()
+    first = _short_step_path(pathlib.Path(step_modules[0].__file__))
+    last = _short_step_path(pathlib.Path(step_modules[-1].__file__))
+    logger.title(title=f"{first} … {last} (per subject)")
+    # The reference run is determined from the runs of *all* subjects, so
+    # resolve it before restricting the config to single subjects
+    mf_reference_run = get_mf_reference_run(config=config)
+    with get_parallel_backend(config.exec_params):
+        parallel, run_func = parallel_func(
+            _run_subject_steps,
+            exec_params=config.exec_params,
+            steps=[
+                _short_step_path(pathlib.Path(step_module.__file__))
+                for step_module in step_modules
+            ],
+        )
+        parallel(
+            run_func(
+                step_names=[step_module.__name__ for step_module in step_modules],
+                config=_get_subject_config(
+                    config=config,
+                    subject=subject,
+                    mf_reference_run=mf_reference_run,
+                ),
+                subject=subject,
+            )
+            for subject in get_subjects(config)
+        )
+    logger.end(f"done ({_format_elapsed(time.time() - start)})")
+
+
+def _get_subject_config(
+    *,
+    config: SimpleNamespace,
+    subject: str,
+    mf_reference_run: str,
+) -> SimpleNamespace:
+    subject_config = copy.copy(config)
+    subject_config.subjects = [subject]
+    subject_config.mf_reference_run = mf_reference_run
+    # Each subject is processed by a single worker
+    subject_config.exec_params = copy.copy(config.exec_params)
+    subject_config.exec_params.n_jobs = 1
+    return subject_config
+
+
+def _run_subject_steps(
+    *,
+    step_names: list[str],
+    config: SimpleNamespace,
+    subject: str,
+) -> None:
+    for step_name in step_names:
+        step_module = importlib.import_module(step_name)
         step = _short_step_path(pathlib.Path(step_module.__file__))
-        logger.title(title=f"{step}")
-        step_module.main(config=config_imported)
-        elapsed = time.time() - start
-        hours, remainder = divmod(elapsed, 3600)
-        hours = int(hours)
-        minutes, seconds = divmod(remainder, 60)
-        minutes = int(minutes)
-        seconds = int(np.ceil(seconds))  # always take full seconds
-        elapsed = f"{seconds}s"
-        if minutes:
-            elapsed = f"{minutes}m {elapsed}"
-        if hours:
-            elapsed = f"{hours}h {elapsed}"
-        logger.end(f"done ({elapsed})")
+        msg = f"Running {step} …"
+        logger.info(**gen_log_kwargs(message=msg, subject=subject))
+        step_module.main(config=config)
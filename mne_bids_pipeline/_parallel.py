@@ -1,14 +1,22 @@
 """Parallelization."""
 
-from collections.abc import Callable
+import functools
+import importlib
+import os
+import time
+from collections.abc import Callable, Iterable
 from types import SimpleNamespace
 from typing import Literal
 
 import joblib
+import psutil
+from joblib.disk import memstr_to_bytes
 from mne.utils import logger as mne_logger
-from mne.utils import use_log_level
+from mne.utils import sizeof_fmt, use_log_level
 
+from ._config_utils import _pl
 from ._logging import _is_testing, gen_log_kwargs, logger
+from ._telemetry import _read_peak_rss
 
 
 def get_n_jobs(*, exec_params: SimpleNamespace, log_override: bool = False) -> int:
@@ -110,6 +118,68 @@ def get_parallel_backend_name(
     return backend
 
 
+# Keep idle loky workers alive for the entire pipeline run, so all steps can
+# share the same (already warmed-up) pool of worker processes.
+_LOKY_IDLE_WORKER_TIMEOUT = 24 * 60 * 60
+
+# Imported by each loky worker on startup, so that steps don't have to pay
+# for this over and over again
+_WORKER_PRELOAD_MODULES = (
+    "numpy",
+    "scipy",
+    "pandas",
+    "matplotlib",
+    "mne",
+    "mne_bids",
+    "sklearn",
+    "autoreject",
+)
+
+_worker_pool = SimpleNamespace(pids=frozenset(), n_reused=0)
+
+
+def _preload_worker_modules() -> None:
+    import matplotlib
+
+    matplotlib.use("Agg")
+    for module in _WORKER_PRELOAD_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+
+def _warm_up_workers(*, backend_kwargs: dict) -> None:
+    # Make sure that the workers are running (and have pre-imported the heavy
+    # modules), and check whether they are the ones already used before
+    n_jobs = backend_kwargs["n_jobs"]
+    start = time.time()
+    with joblib.parallel_backend("loky", **backend_kwargs):
+        pids = joblib.Parallel()(joblib.delayed(os.getpid)() for _ in range(n_jobs))
+    if set(pids) <= _worker_pool.pids:
+        _worker_pool.n_reused += 1
+        return
+
+    # Not all workers necessarily ran a task above, but all of them were
+    # started by now, as child processes of this one
+    _worker_pool.pids = frozenset(
+        child.pid for child in psutil.Process().children(recursive=True)
+    )
+    msg = (
+        f"Started {n_jobs} worker processes in {time.time() - start:0.1f} s, "
+        "they will be reused for all steps"
+    )
+    logger.info(**gen_log_kwargs(message=msg, emoji="🔥"))
+
+
+def _log_worker_reuse() -> None:
+    n_reused = _worker_pool.n_reused
+    if not n_reused:
+        return
+    msg = f"Reused the running worker processes in {n_reused} step{_pl(n_reused)}"
+    logger.info(**gen_log_kwargs(message=msg, emoji="♻️"))
+
+
 def get_parallel_backend(exec_params: SimpleNamespace) -> joblib.parallel_backend:
     import joblib
 
@@ -123,13 +193,67 @@ def get_parallel_backend(exec_params: SimpleNamespace) -> joblib.parallel_backen
 
     if backend == "loky":
         kwargs["inner_max_num_threads"] = 1
+        if kwargs["n_jobs"] > 1:
+            kwargs["idle_worker_timeout"] = _LOKY_IDLE_WORKER_TIMEOUT
+            kwargs["initializer"] = _preload_worker_modules
+            _warm_up_workers(backend_kwargs=kwargs)
     else:
         setup_dask_client(exec_params=exec_params)
 
     return joblib.parallel_backend(backend, **kwargs)
 
 
-def parallel_func(func: Callable, *, exec_params: SimpleNamespace):
+def get_max_parallel_tasks(
+    *,
+    exec_params: SimpleNamespace,
+    steps: list[str] | None = None,
+) -> int:
+    """Get the number of tasks that may run at once given the memory budget.
+
+    The peak memory usage per task is taken from previous runs of the given
+    steps (default: the calling step).
+    """
+    n_jobs = get_n_jobs(exec_params=exec_params)
+    budget = exec_params.parallel_memory_budget
+    if budget is None or n_jobs == 1:
+        return n_jobs
+    if isinstance(budget, str):
+        budget = memstr_to_bytes(budget)
+    if steps is None:
+        from ._run import _get_step_path, _short_step_path
+
+        steps = [_short_step_path(_get_step_path())]
+    peak_rss = _read_peak_rss(deriv_root=exec_params.deriv_root, steps=steps)
+    if peak_rss is None:
+        return n_jobs
+    max_tasks = int(min(max(budget // peak_rss, 1), n_jobs))
+    if max_tasks < n_jobs:
+        msg = (
+            f"Running at most {max_tasks} tasks in parallel, as they previously "
+            f"used up to {sizeof_fmt(peak_rss)} of memory each (budget: "
+            f"{sizeof_fmt(budget)})"
+        )
+        logger.info(**gen_log_kwargs(message=msg, emoji="🧠"))
+    return max_tasks
+
+
+def _set_n_threads(*, exec_params: SimpleNamespace, n_tasks: int) -> SimpleNamespace:
+    """Share the cores not used by parallel tasks among these tasks.
+
+    With fewer tasks than n_jobs (e.g., a single subject with many runs), the
+    remaining cores can be used by threads within each task. The result is
+    stored as exec_params.n_threads, which is not part of the cache key.
+    """
+    n_threads = max(get_n_jobs(exec_params=exec_params) // max(n_tasks, 1), 1)
+    return SimpleNamespace(**vars(exec_params), n_threads=n_threads)
+
+
+def parallel_func(
+    func: Callable,
+    *,
+    exec_params: SimpleNamespace,
+    steps: list[str] | None = None,
+):
     if (
         get_parallel_backend_name(exec_params=exec_params) == "loky"
         and get_n_jobs(exec_params=exec_params) == 1
@@ -139,7 +263,13 @@ def parallel_func(func: Callable, *, exec_params: SimpleNamespace):
     else:  # Dask or n_jobs > 1
         from joblib import Parallel, delayed
 
-        parallel = Parallel()
+        max_tasks = get_max_parallel_tasks(exec_params=exec_params, steps=steps)
+        if max_tasks < get_n_jobs(exec_params=exec_params):
+            # Keep all (warm) workers, but only dispatch a new task once a
+            # running one has finished
+            parallel = Parallel(pre_dispatch=max_tasks, batch_size=1)
+        else:
+            parallel = Parallel()
 
         def run_verbose(*args, verbose=mne_logger.level, **kwargs):
             with use_log_level(verbose=verbose):
@@ -147,4 +277,38 @@ def parallel_func(func: Callable, *, exec_params: SimpleNamespace):
 
         my_func = delayed(run_verbose)
 
+        # Check the cache here, so that we only dispatch what actually needs to run
+        check_skip = getattr(func, "check_skip", None)
+        if check_skip is not None:
+            parallel = functools.partial(
+                _run_not_skipped, parallel=parallel, check_skip=check_skip
+            )
+
     return parallel, my_func
+
+
+def _run_not_skipped(
+    tasks: Iterable[tuple[Callable, tuple, dict]],
+    *,
+    parallel: Callable,
+    check_skip: Callable,
+) -> list:
+    tasks = list(tasks)
+    out = [None] * len(tasks)
+    run_idx = list()
+    for ti, (_, args, kwargs) in enumerate(tasks):
+        assert len(args) == 0, args  # make sure params are only kwargs
+        out[ti] = check_skip(**kwargs)
+        if out[ti] is None:
+            run_idx.append(ti)
+    n_skipped = len(tasks) - len(run_idx)
+    if n_skipped:
+        msg = (
+            f"Skipped {n_skipped} of {len(tasks)} tasks (cached), "
+            f"dispatching the remaining {len(run_idx)} …"
+        )
+        logger.info(**gen_log_kwargs(message=msg, emoji="skip"))
+    if run_idx:
+        for ti, log_info in zip(run_idx, parallel(tasks[ti] for ti in run_idx)):
+            out[ti] = log_info
+    return out
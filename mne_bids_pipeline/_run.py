@@ -1,15 +1,21 @@
 """Script-running utilities."""
 
 import copy
+import datetime
 import functools
 import hashlib
 import inspect
+import json
+import os
 import pathlib
 import pdb
+import shutil
 import sys
+import threading
 import time
 import traceback
 from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from types import SimpleNamespace
 from typing import Literal
 
@@ -17,10 +23,18 @@ import json_tricks
 import pandas as pd
 from filelock import FileLock
 from joblib import Memory
+from joblib.disk import memstr_to_bytes
+from mne.utils import sizeof_fmt
 from mne_bids import BIDSPath
 
 from ._config_utils import get_task
 from ._logging import _is_testing, gen_log_kwargs, logger
+from ._telemetry import (
+    _TELEMETRY_KEYS,
+    _read_telemetry,
+    _ResourceMonitor,
+    _write_telemetry,
+)
 
 
 def failsafe_run(
@@ -42,17 +56,21 @@ def failsafe_run(
                 require_output=require_output,
                 func_name=f"{__mne_bids_pipeline_step__}::{func.__name__}",
             )
+            if getattr(exec_params, "plan", False):
+                return _plan_call(
+                    memory=memory,
+                    func=func,
+                    kwargs=kwargs,
+                    step=_short_step_path(__mne_bids_pipeline_step__),
+                )
             t0 = time.time()
-            log_info = pd.concat(
-                [
-                    pd.Series(kwargs, dtype=object),
-                    pd.Series(index=["time", "success", "error_message"], dtype=object),
-                ]
-            )
+            log_info = _new_log_info(kwargs)
+            monitor = _ResourceMonitor()
 
             try:
                 assert len(args) == 0, args  # make sure params are only kwargs
-                out = memory.cache(func)(*args, **kwargs)
+                with monitor:
+                    out = memory.cache(func)(*args, **kwargs)
                 assert out is None  # nothing should be returned
                 log_info["success"] = True
                 log_info["error_message"] = ""
@@ -105,19 +123,539 @@ def failsafe_run(
                     logger.error(
                         **gen_log_kwargs(message=message, **kwargs_log, emoji="🔂")
                     )
-            log_info["time"] = round(time.time() - t0, ndigits=1)
+            log_info["time"] = round(time.time() - t0, ndigits=3)
+            log_info.update(monitor.results)
+            log_info["cache"] = memory.cache_status
             return log_info
 
+        def check_skip(**kwargs) -> pd.Series | None:
+            """Check if the call can be skipped, without running or dispatching it.
+
+            This allows the parent process to only send the tasks that actually
+            need to run to the workers. Returns the log entry for skipped calls,
+            and None otherwise.
+            """
+            __mne_bids_pipeline_step__ = pathlib.Path(inspect.getfile(func))  # noqa
+            t0 = time.time()
+            memory = ConditionalStepMemory(
+                exec_params=kwargs["exec_params"],
+                get_input_fnames=get_input_fnames,
+                get_output_fnames=get_output_fnames,
+                require_output=require_output,
+                func_name=f"{__mne_bids_pipeline_step__}::{func.__name__}",
+            )
+            try:
+                status = memory.check_skip(func, **kwargs)
+            except Exception:
+                status = None  # the actual call will handle the error
+            if status is None:
+                return None
+            logger.info(
+                **gen_log_kwargs(
+                    message=status.msg, emoji=status.emoji, **status.log_kwargs
+                )
+            )
+            log_info = _new_log_info(kwargs)
+            log_info["success"] = True
+            log_info["error_message"] = ""
+            log_info["time"] = round(time.time() - t0, ndigits=3)
+            log_info["cache"] = "hit"
+            return log_info
+
+        __mne_bids_pipeline_failsafe_wrapper__.check_skip = check_skip
         return __mne_bids_pipeline_failsafe_wrapper__
 
     return failsafe_run_decorator
 
 
+# Collected by _plan_call() when running with --plan
+_plan = SimpleNamespace(rows=list(), dirty_subjects=set())
+
+
+def _plan_call(
+    *,
+    memory: "ConditionalStepMemory",
+    func: Callable,
+    kwargs: dict,
+    step: str,
+) -> pd.Series:
+    """Determine whether a call would be computed, without running it."""
+    subject = kwargs.get("subject", None)
+    try:
+        status = memory._check(func, (), kwargs.copy())
+    except Exception as e:
+        # Most likely the inputs will only be created by a previous step
+        result = "miss"
+        reason = f"Inputs not available ({str(e).splitlines()[0]})"
+    else:
+        if status is None:
+            result = "miss"
+            if memory.get_input_fnames is None:
+                reason = "Not cached"
+            else:
+                reason = "Caching disabled"
+        else:
+            result = "hit" if status.skip else "forced" if status.forced else "miss"
+            reason = status.msg or "No cached result for these inputs and settings"
+            reason = reason.removesuffix(" …").removesuffix(", will recompute")
+    upstream_dirty = subject in _plan.dirty_subjects or (
+        subject == "average" and _plan.dirty_subjects
+    )
+    if result == "hit" and upstream_dirty:
+        result = "miss"
+        reason = "Inputs will change (upstream tasks will be computed)"
+    if result != "hit":
+        _plan.dirty_subjects.add(subject)
+    _plan.rows.append(
+        dict(
+            step=step,
+            **{key: kwargs.get(key, None) for key in _LOG_KEYS},
+            result=result,
+            reason=reason,
+        )
+    )
+    log_info = _new_log_info(kwargs)
+    log_info["success"] = True
+    log_info["error_message"] = ""
+    return log_info
+
+
+def _new_log_info(kwargs: dict) -> pd.Series:
+    return pd.concat(
+        [
+            pd.Series(kwargs, dtype=object),
+            pd.Series(index=list(_TELEMETRY_KEYS), dtype=object),
+        ]
+    )
+
+
 def hash_file_path(path: pathlib.Path) -> str:
+    # Read in chunks so that memory usage does not depend on the file size
+    file_hash = hashlib.blake2b(digest_size=32)
     with open(path, "rb") as f:
-        md5_hash = hashlib.md5(f.read())
-        md5_hashed = md5_hash.hexdigest()
-    return md5_hashed
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+_HASH_CHUNK_SIZE = 2**20
+_HASH_MAX_THREADS = 8
+
+# Files modified this recently might still change without their size or mtime
+# changing (mtime granularity), so their hashes are not stored in the index
+_HASH_INDEX_MIN_AGE = 2.0
+
+
+def _write_json_atomic(fname: pathlib.Path, data: dict) -> None:
+    # Readers (that do not hold the lock) should never see a partial file
+    tmp_fname = fname.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_fname, "w", encoding="utf-8") as fid:
+        json.dump(data, fid)
+    os.replace(tmp_fname, fname)
+
+
+class _FileHashIndex:
+    """Persistent index of file hashes, keyed on the file path.
+
+    A stored hash is reused as long as the size, mtime and inode of the file
+    are unchanged, so unmodified files do not need to be read again. The index
+    file is read once, and newly computed hashes are only written to it by
+    :meth:`flush`, so that hashing many files does not rewrite it each time.
+    """
+
+    def __init__(self, fname: pathlib.Path):
+        self.fname = fname
+        self._lock = FileLock(fname.with_suffix(fname.suffix + ".lock"))
+        self._entries = None
+        self._pending = dict()
+        self._thread_lock = threading.Lock()  # in case of a process-local lock
+
+    def _read(self) -> dict:
+        try:
+            with open(self.fname, encoding="utf-8") as fid:
+                return json.load(fid)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return dict()
+
+    def get_hash(self, path: pathlib.Path) -> str:
+        key = str(path)
+        path_stat = path.stat()
+        meta = dict(
+            size=path_stat.st_size,
+            mtime_ns=path_stat.st_mtime_ns,
+            inode=path_stat.st_ino,
+        )
+        with self._thread_lock:
+            if self._entries is None:
+                self._entries = self._read()
+            entry = self._entries.get(key)
+        if entry is not None and {k: entry[k] for k in meta} == meta:
+            return entry["hash"]
+
+        this_hash = hash_file_path(path)
+        if time.time() - path_stat.st_mtime >= _HASH_INDEX_MIN_AGE:
+            with self._thread_lock:
+                self._entries[key] = self._pending[key] = dict(**meta, hash=this_hash)
+        return this_hash
+
+    def set_hash(self, path: pathlib.Path, this_hash: str) -> None:
+        """Store the known hash of a file, e.g. one linked to a blob."""
+        path_stat = path.stat()
+        with self._thread_lock:
+            if self._entries is None:
+                self._entries = self._read()
+            self._entries[str(path)] = self._pending[str(path)] = dict(
+                size=path_stat.st_size,
+                mtime_ns=path_stat.st_mtime_ns,
+                inode=path_stat.st_ino,
+                hash=this_hash,
+            )
+
+    def flush(self) -> None:
+        """Write the hashes computed since the last flush to the index file."""
+        with self._thread_lock:
+            if not self._pending:
+                return
+            self.fname.parent.mkdir(parents=True, exist_ok=True)
+            with self._lock:
+                # Keep the entries written by other processes in the meantime
+                entries = self._read()
+                entries.update(self._pending)
+                _write_json_atomic(self.fname, entries)
+            self._pending.clear()
+            entries.update(self._entries)
+            self._entries = entries
+
+    def prune(self) -> int:
+        """Remove the entries of files that were modified or do not exist anymore."""
+        self.flush()
+        if not self.fname.exists():
+            return 0
+        with self._thread_lock, self._lock:
+            entries = self._read()
+            n_entries = len(entries)
+            for key, entry in list(entries.items()):
+                try:
+                    path_stat = os.stat(key)
+                except OSError:
+                    del entries[key]
+                    continue
+                if (path_stat.st_size, path_stat.st_mtime_ns, path_stat.st_ino) != (
+                    entry["size"],
+                    entry["mtime_ns"],
+                    entry["inode"],
+                ):
+                    del entries[key]
+            _write_json_atomic(self.fname, entries)
+            self._entries = entries
+        return n_entries - len(entries)
+
+
+# The hashes computed by this process, so that files used by several steps are
+# only hashed once
+_file_hashes: dict[tuple[str, int, int, int], str] = dict()
+
+
+def _get_file_hash_key(path: pathlib.Path) -> tuple[str, int, int, int]:
+    path_stat = path.stat()
+    return (str(path), path_stat.st_size, path_stat.st_mtime_ns, path_stat.st_ino)
+
+
+def _get_file_hash(path: pathlib.Path, *, hash_index: _FileHashIndex | None) -> str:
+    key = _get_file_hash_key(path)
+    try:
+        return _file_hashes[key]
+    except KeyError:
+        pass
+    if hash_index is None:
+        this_hash = hash_file_path(path)
+    else:
+        this_hash = hash_index.get_hash(path)
+    if time.time() - path.stat().st_mtime >= _HASH_INDEX_MIN_AGE:
+        _file_hashes[key] = this_hash
+    return this_hash
+
+
+def _remember_file_hash(
+    path: pathlib.Path, this_hash: str, *, hash_index: _FileHashIndex | None
+) -> None:
+    """Remember the hash of a file whose contents are known, to not read it."""
+    if time.time() - path.stat().st_mtime >= _HASH_INDEX_MIN_AGE:
+        _file_hashes[_get_file_hash_key(path)] = this_hash
+        if hash_index is not None:
+            hash_index.set_hash(path, this_hash)
+
+
+def _map_threaded(func: Callable, items: list) -> list:
+    # For I/O bound work like hashing files (which releases the GIL), threads
+    # are sufficient
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(len(items), _HASH_MAX_THREADS)) as ex:
+        return list(ex.map(func, items))
+
+
+def _find_sidecars(bids_path: BIDSPath | pathlib.Path) -> list[pathlib.Path]:
+    # also hash the sidecar files if this is a BIDSPath and
+    # MNE-BIDS is new enough
+    if not hasattr(bids_path, "find_matching_sidecar"):
+        return []
+    sidecars = list()
+    # from mne_bids/read.py
+    # The v.datatype is maybe not right, might need to use
+    # _infer_datatype like in read.py...
+    for suffix, extension in (
+        ("events", ".tsv"),
+        ("channels", ".tsv"),
+        ("electrodes", ".tsv"),
+        ("coordsystem", ".json"),
+        (bids_path.datatype, ".json"),
+    ):
+        sidecar = bids_path.find_matching_sidecar(
+            suffix=suffix, extension=extension, on_error="ignore"
+        )
+        if sidecar is not None:
+            sidecars.append(sidecar)
+    return sidecars
+
+
+class _ContentStore:
+    """Content-addressed store for deduplicating identical output files.
+
+    Output files are hard-linked to a blob named by their hash, so identical
+    outputs share the same data on disk. Writing to a hard-linked file in place
+    would change the blob (and all other files linked to it), so the linked
+    outputs of a task are unlinked before the task runs again (see
+    :class:`_LinkedOutputs`).
+    """
+
+    def __init__(self, root: pathlib.Path):
+        self.root = root
+
+    def blob_path(self, this_hash: str) -> pathlib.Path:
+        return self.root / this_hash[:2] / this_hash
+
+    def add(
+        self,
+        path: pathlib.Path,
+        this_hash: str,
+        *,
+        hash_index: _FileHashIndex | None = None,
+    ) -> None:
+        """Replace the file by a link to the blob with the same content."""
+        blob = self.blob_path(this_hash)
+        try:
+            if blob.exists() and not os.path.samefile(blob, path):
+                # Never link to a blob that does not match its name anymore
+                if blob.stat().st_size == path.stat().st_size and (
+                    _get_file_hash(blob, hash_index=hash_index) == this_hash
+                ):
+                    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+                    os.link(blob, tmp_path)
+                    os.replace(tmp_path, path)
+                    _remember_file_hash(path, this_hash, hash_index=hash_index)
+                    return
+                blob.unlink()
+            if not blob.exists():
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                os.link(path, blob)
+                _remember_file_hash(blob, this_hash, hash_index=None)
+        except OSError:
+            # E.g., hard links not supported or across file systems, or another
+            # process adding the same blob at the same time; keep the file as is
+            pass
+
+    def gc(self) -> tuple[int, int]:
+        """Remove blobs no output file links to anymore."""
+        n_removed = n_bytes = 0
+        for blob in self.root.glob("??/*"):
+            blob_stat = blob.stat()
+            if blob_stat.st_nlink == 1:
+                blob.unlink()
+                n_removed += 1
+                n_bytes += blob_stat.st_size
+        return n_removed, n_bytes
+
+
+class _LinkedOutputs:
+    """The output files of each task that are linked to the content store.
+
+    These are unlinked before the task runs again. The record is kept in the
+    derivatives directory, so that this also happens after the content store
+    or caching were disabled.
+    """
+
+    def __init__(self, deriv_root: pathlib.Path):
+        self.fname = deriv_root / ".content_store_links.json"
+        self._lock = FileLock(self.fname.with_suffix(".json.lock"))
+
+    def _read(self) -> dict:
+        try:
+            with open(self.fname, encoding="utf-8") as fid:
+                return json.load(fid)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return dict()
+
+    def _update(self, task_key: str, paths: list[str]) -> list[str]:
+        if not paths and not self.fname.exists():
+            return []
+        with self._lock:
+            tasks = self._read()
+            old_paths = tasks.pop(task_key, [])
+            if paths:
+                tasks[task_key] = paths
+            if old_paths or paths:
+                _write_json_atomic(self.fname, tasks)
+        return old_paths
+
+    def release(self, task_key: str) -> None:
+        """Unlink the linked outputs of a task before it runs again."""
+        for path in self._update(task_key, []):
+            path = pathlib.Path(path)
+            try:
+                if path.stat().st_nlink > 1:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def set(self, task_key: str, out_files: dict | None) -> None:
+        """Record the outputs of a task that are linked to the content store."""
+        paths = list()
+        for fname, _ in (out_files or dict()).values():
+            try:
+                if os.stat(fname).st_nlink > 1:
+                    paths.append(fname)
+            except FileNotFoundError:
+                pass
+        self._update(task_key, paths)
+
+
+@functools.cache
+def _get_hash_index(location: pathlib.Path) -> _FileHashIndex:
+    return _FileHashIndex(location / "file_hashes.json")
+
+
+def _get_memory_location(exec_params: SimpleNamespace) -> pathlib.Path | None:
+    memory_location = exec_params.memory_location
+    if memory_location is True:
+        use_location = exec_params.deriv_root / exec_params.memory_subdir
+    elif not memory_location:
+        use_location = None
+    else:
+        use_location = pathlib.Path(memory_location)
+    return use_location
+
+
+def _get_content_store(exec_params: SimpleNamespace) -> _ContentStore | None:
+    use_location = _get_memory_location(exec_params)
+    if not exec_params.memory_content_store or use_location is None:
+        return None
+    return _ContentStore(use_location / "objects")
+
+
+def _gc_cache(*, exec_params: SimpleNamespace, force: bool = False) -> None:
+    """Clean up the cache.
+
+    Evicts the cache entries exceeding the configured size and age limits, and
+    removes unused blobs from the content store. If force is True (i.e., when
+    running with --cache-gc), also prunes the file hash index and always
+    reports a summary.
+    """
+    use_location = _get_memory_location(exec_params)
+    if use_location is None or not use_location.exists():
+        if force:
+            msg = "No cache to clean up."
+            logger.info(**gen_log_kwargs(message=msg, emoji="🧹"))
+        return
+    messages = list()
+
+    max_size = exec_params.memory_max_size
+    max_age = exec_params.memory_max_age
+    if force or max_size is not None or max_age is not None:
+        memory = Memory(use_location, verbose=0)
+        items = memory.store_backend.get_items()
+        evicted = _get_cache_items_to_evict(
+            items=items,
+            max_size=max_size,
+            max_age=max_age,
+        )
+        func_evicted = dict()
+        for item in evicted:
+            shutil.rmtree(item.path, ignore_errors=True)
+            func = pathlib.Path(item.path).parent.relative_to(
+                memory.store_backend.location
+            )
+            n_items, n_bytes = func_evicted.get(func, (0, 0))
+            func_evicted[func] = (n_items + 1, n_bytes + item.size)
+        for func, (n_items, n_bytes) in sorted(func_evicted.items()):
+            messages.append(
+                f"Evicted {n_items} cache entr{'y' if n_items == 1 else 'ies'} "
+                f"({sizeof_fmt(n_bytes)}) of {func}"
+            )
+        if evicted or force:
+            n_bytes = sum(item.size for item in evicted)
+            size = sum(item.size for item in items) - n_bytes
+            messages.append(
+                f"Reclaimed {sizeof_fmt(n_bytes)} from {len(evicted)} cache "
+                f"entries, {len(items) - len(evicted)} entries "
+                f"({sizeof_fmt(size)}) remain"
+            )
+
+    content_store = _get_content_store(exec_params)
+    if content_store is not None and content_store.root.exists():
+        n_removed, n_bytes = content_store.gc()
+        if n_removed or force:
+            messages.append(
+                f"Removed {n_removed} unused file(s) from the content store, "
+                f"freeing {sizeof_fmt(n_bytes)}"
+            )
+
+    if force:
+        n_pruned = _get_hash_index(use_location).prune()
+        messages.append(f"Pruned {n_pruned} outdated file hash(es)")
+
+    for msg in messages:
+        logger.info(**gen_log_kwargs(message=msg, emoji="🧹"))
+
+
+def _get_cache_items_to_evict(
+    *,
+    items: list,
+    max_size: str | int | None,
+    max_age: float | None,
+) -> list:
+    if isinstance(max_size, str):
+        max_size = memstr_to_bytes(max_size)
+    now = datetime.datetime.now()
+    func_items = dict()
+    for item in items:
+        func_items.setdefault(pathlib.Path(item.path).parent, []).append(item)
+    evict = list()
+    candidates = list()
+    for these_items in func_items.values():
+        these_items.sort(key=lambda item: item.last_access, reverse=True)
+        # Always keep the most recently used entry of each step function
+        for item in these_items[1:]:
+            age = (now - item.last_access).total_seconds() / 86400
+            if max_age is not None and age > max_age:
+                evict.append(item)
+            else:
+                candidates.append(item)
+    if max_size is not None:
+        size = sum(item.size for item in items) - sum(item.size for item in evict)
+        for item in sorted(candidates, key=lambda item: item.last_access):
+            if size <= max_size:
+                break
+            evict.append(item)
+            size -= item.size
+    return evict
+
+
+def _get_file_hash_index(exec_params: SimpleNamespace) -> _FileHashIndex | None:
+    use_location = _get_memory_location(exec_params)
+    if exec_params.memory_file_method != "hash" or use_location is None:
+        return None
+    return _get_hash_index(use_location)
 
 
 class ConditionalStepMemory:
@@ -130,13 +668,7 @@ class ConditionalStepMemory:
         require_output: bool,
         func_name: str,
     ):
-        memory_location = exec_params.memory_location
-        if memory_location is True:
-            use_location = exec_params.deriv_root / exec_params.memory_subdir
-        elif not memory_location:
-            use_location = None
-        else:
-            use_location = pathlib.Path(memory_location)
+        use_location = _get_memory_location(exec_params)
         # Actually make the Memory object only if necessary
         if use_location is not None and get_input_fnames is not None:
             self.memory = Memory(use_location, verbose=exec_params.memory_verbose)
@@ -147,144 +679,45 @@ class ConditionalStepMemory:
         self.get_input_fnames = get_input_fnames
         self.get_output_fnames = get_output_fnames
         self.memory_file_method = exec_params.memory_file_method
+        self.hash_index = _get_file_hash_index(exec_params)
+        self.linked_outputs = _LinkedOutputs(exec_params.deriv_root)
         self.require_output = require_output
         self.func_name = func_name
+        # One of "hit", "computed", "forced" or "uncached" after the call
+        self.cache_status = None
 
     def cache(self, func):
         def wrapper(*args, **kwargs):
-            in_files = out_files = None
-            force_run = kwargs.pop("force_run", False)
-            these_kwargs = kwargs.copy()
-            these_kwargs.pop("exec_params", None)
-            if self.get_output_fnames is not None:
-                out_files = self.get_output_fnames(**these_kwargs)
-            if self.get_input_fnames is not None:
-                in_files = kwargs["in_files"] = self.get_input_fnames(**these_kwargs)
-            del these_kwargs
-            if self.memory is None:
-                func(*args, **kwargs)
+            status = self._check(func, args, kwargs)
+            task_key = self._get_task_key(kwargs)
+            if status is None:  # no memory
+                self.cache_status = "uncached"
+                self.linked_outputs.release(task_key)
+                self.linked_outputs.set(task_key, func(*args, **kwargs))
                 return
-
-            # This is an implementation detail so we don't need a proper error
-            assert isinstance(in_files, dict), type(in_files)
-
-            # Deal with cases (e.g., custom cov) where input files are unknown
-            unknown_inputs = in_files.pop("__unknown_inputs__", False)
-            # If this is ever true, we'll need to improve the logic below
-            assert not (unknown_inputs and force_run)
-
-            hash_ = functools.partial(_path_to_str_hash, method=self.memory_file_method)
-            hashes = []
-            for k, v in in_files.items():
-                hashes.append(hash_(k, v))
-                # also hash the sidecar files if this is a BIDSPath and
-                # MNE-BIDS is new enough
-                if not hasattr(v, "find_matching_sidecar"):
-                    continue
-                # from mne_bids/read.py
-                # The v.datatype is maybe not right, might need to use
-                # _infer_datatype like in read.py...
-                for suffix, extension in (
-                    ("events", ".tsv"),
-                    ("channels", ".tsv"),
-                    ("electrodes", ".tsv"),
-                    ("coordsystem", ".json"),
-                    (v.datatype, ".json"),
-                ):
-                    sidecar = v.find_matching_sidecar(
-                        suffix=suffix, extension=extension, on_error="ignore"
+            if status.msg is not None:
+                logger.info(
+                    **gen_log_kwargs(
+                        message=status.msg, emoji=status.emoji, **status.log_kwargs
                     )
-                    if sidecar is None:
-                        continue
-                    hashes.append(hash_(k, sidecar))
-
-            kwargs["cfg"] = copy.deepcopy(kwargs["cfg"])
-            kwargs["cfg"].hashes = hashes
-            del in_files  # will be modified by func call
-
-            # Someday we could modify the joblib API to combine this with the
-            # call (https://github.com/joblib/joblib/issues/1342), but our hash
-            # should be plenty fast so let's not bother for now.
-            memorized_func = self.memory.cache(func, ignore=self.ignore)
-            msg = emoji = None
-            short_circuit = False
-            # Used for logging automatically
-            subject = kwargs.get("subject", None)  # noqa
-            session = kwargs.get("session", None)  # noqa
-            run = kwargs.get("run", None)  # noqa
-            task = kwargs.get("task", None)  # noqa
-            bad_out_files = False
-            try:
-                done = memorized_func.check_call_in_cache(*args, **kwargs)
-            except Exception:
-                done = False
-            if done:
-                if unknown_inputs:
-                    msg = (
-                        "Computation forced because input files cannot "
-                        f"be determined ({unknown_inputs}) …"
-                    )
-                    emoji = "🤷"
-                elif force_run:
-                    msg = "Computation forced despite existing cached result …"
-                    emoji = "🔂"
-                else:
-                    # Check our output file hashes
-                    # Need to make a copy of kwargs["in_files"] in particular
-                    use_kwargs = copy.deepcopy(kwargs)
-                    out_files_hashes = memorized_func(*args, **use_kwargs)
-                    for key, (fname, this_hash) in out_files_hashes.items():
-                        fname = pathlib.Path(fname)
-                        if not fname.exists():
-                            msg = f"Output file missing: {fname}, will recompute …"
-                            emoji = "🧩"
-                            bad_out_files = True
-                            break
-                        got_hash = hash_(key, fname, kind="out")[1]
-                        if this_hash != got_hash:
-                            msg = (
-                                f"Output file {self.memory_file_method} mismatch for "
-                                f"{fname} ({this_hash} != {got_hash}), will "
-                                "recompute …"
-                            )
-                            emoji = "🚫"
-                            bad_out_files = True
-                            break
-                    else:
-                        msg = "Computation unnecessary (cached) …"
-                        emoji = "cache"
-            # When out_files_expected is not None, we should check if the output files
-            # exist and stop if they do (e.g., in bem surface or coreg surface
-            # creation)
-            elif out_files is not None:
-                have_all = all(path.exists() for path in out_files.values())
-                if not have_all:
-                    msg = "Output files missing, will recompute …"
-                    emoji = "🧩"
-                elif force_run:
-                    msg = "Computation forced despite existing output files …"
-                    emoji = "🔂"
-                else:
-                    msg = "Computation unnecessary (output files exist) …"
-                    emoji = "🔍"
-                    short_circuit = True
-            del out_files
-
-            if msg is not None:
-                logger.info(**gen_log_kwargs(message=msg, emoji=emoji))
-            if short_circuit:
+                )
+            if status.skip:
+                self.cache_status = "hit"
                 return
 
+            self.cache_status = "forced" if status.forced else "computed"
+            self.linked_outputs.release(task_key)
             # https://joblib.readthedocs.io/en/latest/memory.html#joblib.memory.MemorizedFunc.call  # noqa: E501
-            if force_run or unknown_inputs or bad_out_files:
+            if status.recompute:
                 # Joblib 1.4.0 only returns the output, but 1.3.2 returns both.
                 # Fortunately we can use tuple-ness to tell the difference (we always
                 # return None or a dict)
-                out_files = memorized_func.call(*args, **kwargs)
+                out_files = status.memorized_func.call(*args, **kwargs)
                 if isinstance(out_files, tuple):
                     out_files = out_files[0]
             else:
-                out_files = memorized_func(*args, **kwargs)
+                out_files = status.memorized_func(*args, **kwargs)
+            self.linked_outputs.set(task_key, out_files)
             if self.require_output:
                 assert isinstance(out_files, dict) and len(out_files), (
                     f"Internal error: step must return non-empty out_files dict, got "
@@ -298,50 +731,215 @@ class ConditionalStepMemory:
 
         return wrapper
 
+    def _get_task_key(self, kwargs: dict) -> str:
+        task_kwargs = {
+            key: val
+            for key, val in kwargs.items()
+            if key not in ("cfg", "exec_params", "in_files", "force_run")
+        }
+        return f"{self.func_name}::{sorted(task_kwargs.items())!r}"
+
+    def check_skip(self, func, *args, **kwargs) -> SimpleNamespace | None:
+        """Check whether a call can be skipped without running (or shipping) it.
+
+        Returns the status (with the message to log) if it can be skipped,
+        and None otherwise. The passed kwargs are not modified.
+        """
+        if self.memory is None:
+            return None
+        status = self._check(func, args, kwargs.copy())
+        return status if status.skip else None
+
+    def _check(self, func, args: tuple, kwargs: dict) -> SimpleNamespace | None:
+        # Modifies kwargs in place to what should be passed to the memorized func
+        in_files = out_files = None
+        force_run = kwargs.pop("force_run", False)
+        these_kwargs = kwargs.copy()
+        these_kwargs.pop("exec_params", None)
+        if self.get_output_fnames is not None:
+            out_files = self.get_output_fnames(**these_kwargs)
+        if self.get_input_fnames is not None:
+            in_files = kwargs["in_files"] = self.get_input_fnames(**these_kwargs)
+        del these_kwargs
+        if self.memory is None:
+            return None
+
+        # This is an implementation detail so we don't need a proper error
+        assert isinstance(in_files, dict), type(in_files)
+
+        # Deal with cases (e.g., custom cov) where input files are unknown
+        unknown_inputs = in_files.pop("__unknown_inputs__", False)
+        # If this is ever true, we'll need to improve the logic below
+        assert not (unknown_inputs and force_run)
+
+        hash_ = functools.partial(
+            _path_to_str_hash,
+            method=self.memory_file_method,
+            hash_index=self.hash_index,
+        )
+        # Finding and hashing the files is I/O bound, so use threads
+        sidecars = _map_threaded(_find_sidecars, list(in_files.values()))
+        to_hash = list()
+        for (k, v), these_sidecars in zip(in_files.items(), sidecars):
+            to_hash.append((k, v))
+            to_hash.extend((k, sidecar) for sidecar in these_sidecars)
+        hashes = _map_threaded(lambda item: hash_(*item), to_hash)
+        if self.hash_index is not None:
+            self.hash_index.flush()
+
+        kwargs["cfg"] = copy.deepcopy(kwargs["cfg"])
+        kwargs["cfg"].hashes = hashes
+        del in_files  # will be modified by func call
+
+        # Someday we could modify the joblib API to combine this with the
+        # call (https://github.com/joblib/joblib/issues/1342), but our hash
+        # should be plenty fast so let's not bother for now.
+        memorized_func = self.memory.cache(func, ignore=self.ignore)
+        msg = emoji = None
+        skip = False
+        bad_out_files = False
+        try:
+            done = memorized_func.check_call_in_cache(*args, **kwargs)
+        except Exception:
+            done = False
+        if done:
+            if unknown_inputs:
+                msg = (
+                    "Computation forced because input files cannot "
+                    f"be determined ({unknown_inputs}) …"
+                )
+                emoji = "🤷"
+            elif force_run:
+                msg = "Computation forced despite existing cached result …"
+                emoji = "🔂"
+            else:
+                # Check our output file hashes
+                # Need to make a copy of kwargs["in_files"] in particular
+                use_kwargs = copy.deepcopy(kwargs)
+                out_files_hashes = memorized_func(*args, **use_kwargs)
+                missing = [
+                    fname
+                    for fname, _ in out_files_hashes.values()
+                    if not pathlib.Path(fname).exists()
+                ]
+                if missing:
+                    msg = f"Output file missing: {missing[0]}, will recompute …"
+                    emoji = "🧩"
+                    bad_out_files = True
+                else:
+                    got_hashes = _map_threaded(
+                        lambda item: hash_(
+                            item[0], pathlib.Path(item[1][0]), kind="out"
+                        )[1],
+                        list(out_files_hashes.items()),
+                    )
+                    if self.hash_index is not None:
+                        self.hash_index.flush()
+                    for (fname, this_hash), got_hash in zip(
+                        out_files_hashes.values(), got_hashes
+                    ):
+                        if this_hash != got_hash:
+                            msg = (
+                                f"Output file {self.memory_file_method} mismatch "
+                                f"for {fname} ({this_hash} != {got_hash}), will "
+                                "recompute …"
+                            )
+                            emoji = "🚫"
+                            bad_out_files = True
+                            break
+                if not bad_out_files:
+                    msg = "Computation unnecessary (cached) …"
+                    emoji = "cache"
+                    skip = True
+        # When out_files_expected is not None, we should check if the output files
+        # exist and stop if they do (e.g., in bem surface or coreg surface
+        # creation)
+        elif out_files is not None:
+            have_all = all(path.exists() for path in out_files.values())
+            if not have_all:
+                msg = "Output files missing, will recompute …"
+                emoji = "🧩"
+            elif force_run:
+                msg = "Computation forced despite existing output files …"
+                emoji = "🔂"
+            else:
+                msg = "Computation unnecessary (output files exist) …"
+                emoji = "🔍"
+                skip = True
+        del out_files
+
+        return SimpleNamespace(
+            msg=msg,
+            emoji=emoji,
+            skip=skip,
+            recompute=bool(force_run or unknown_inputs or bad_out_files),
+            forced=bool(force_run or unknown_inputs),
+            memorized_func=memorized_func,
+            # Used for logging
+            log_kwargs={
+                key: kwargs.get(key, None)
+                for key in ("subject", "session", "run", "task")
+            },
+        )
+
     def clear(self) -> None:
         self.memory.clear()
 
 
 def save_logs(*, config: SimpleNamespace, logs: list[pd.Series]) -> None:
-    fname = config.deriv_root / f"task-{get_task(config)}_log.xlsx"
+    if getattr(config.exec_params, "plan", False):
+        return  # nothing was run
 
     # Get the script from which the function is called for logging
-    sheet_name = _short_step_path(_get_step_path()).replace("/", "-")
-    sheet_name = sheet_name[-30:]  # shorten due to limit of excel format
+    step = _short_step_path(_get_step_path())
+    _write_telemetry(config=config, step=step, logs=logs)
 
-    df = pd.DataFrame(logs)
-    del logs
 
+_LOG_KEYS = ("subject", "session", "run", "task")
+
+
+def _export_logs(*, config: SimpleNamespace) -> pathlib.Path:
+    """Export the logs to an Excel workbook with one sheet per step."""
+    fname = config.deriv_root / f"task-{get_task(config)}_log.xlsx"
+    df = _read_telemetry(config=config)
     with FileLock(fname.with_suffix(fname.suffix + ".lock")):
-        append = fname.exists()
-        writer = pd.ExcelWriter(
-            fname,
-            engine="openpyxl",
-            mode="a" if append else "w",
-            if_sheet_exists="replace" if append else None,
-        )
-        assert isinstance(config, SimpleNamespace), type(config)
-        cf_df = dict()
-        for key, val in config.__dict__.items():
-            # We need to be careful about functions, json_tricks does not work with them
-            if inspect.isfunction(val):
-                new_val = ""
-                if func_file := inspect.getfile(val):
-                    new_val += f"{func_file}:"
-                if getattr(val, "__qualname__", None):
-                    new_val += val.__qualname__
-                val = "custom callable" if not new_val else new_val
-            val = json_tricks.dumps(val, indent=4, sort_keys=False)
-            # 32767 char limit per cell (could split over lines but if something is
-            # this long, you'll probably get the gist from the first 32k chars)
-            if len(val) > 32767:
-                val = val[:32765] + " …"
-            cf_df[key] = val
-        cf_df = pd.DataFrame([cf_df], dtype=object)
-        with writer:
+        with pd.ExcelWriter(fname, engine="openpyxl") as writer:
             # Config first then the data
-            cf_df.to_excel(writer, sheet_name="config", index=False)
-            df.to_excel(writer, sheet_name=sheet_name, index=False)
+            _config_to_df(config).to_excel(writer, sheet_name="config", index=False)
+            for step, step_df in df.groupby("step", sort=False):
+                # Only keep the most recent entry of each task
+                keys = [
+                    key
+                    for key in step_df.columns
+                    if key not in ("step", "timestamp", *_TELEMETRY_KEYS)
+                ]
+                step_df = step_df[~step_df[keys].astype(str).duplicated(keep="last")]
+                step_df = step_df.drop(columns="step").dropna(axis=1, how="all")
+                # shorten due to limit of excel format
+                sheet_name = step.replace("/", "-")[-30:]
+                step_df.to_excel(writer, sheet_name=sheet_name, index=False)
+    return fname
+
+
+def _config_to_df(config: SimpleNamespace) -> pd.DataFrame:
+    assert isinstance(config, SimpleNamespace), type(config)
+    cf_df = dict()
+    for key, val in config.__dict__.items():
+        # We need to be careful about functions, json_tricks does not work with them
+        if inspect.isfunction(val):
+            new_val = ""
+            if func_file := inspect.getfile(val):
+                new_val += f"{func_file}:"
+            if getattr(val, "__qualname__", None):
+                new_val += val.__qualname__
+            val = "custom callable" if not new_val else new_val
+        val = json_tricks.dumps(val, indent=4, sort_keys=False)
+        # 32767 char limit per cell (could split over lines but if something is
+        # this long, you'll probably get the gist from the first 32k chars)
+        if len(val) > 32767:
+            val = val[:32765] + " …"
+        cf_df[key] = val
+    return pd.DataFrame([cf_df], dtype=object)
 
 
 def _update_for_splits(
@@ -355,13 +953,17 @@ def _update_for_splits(
         assert key is None
         files_dict, key = dict(x=files_dict), "x"
     bids_path = files_dict[key]
-    if bids_path.fpath.exists():
+    # List the directory once rather than probing each candidate file, as each
+    # stat can be slow on network file systems
+    fpath = bids_path.fpath
+    names = _list_dir(fpath.parent)
+    if fpath.name in names:
         return bids_path  # no modifications needed
-    if bids_path.copy().update(run=None).fpath.exists():
+    if bids_path.copy().update(run=None).fpath.name in names:
         # Remove the run information
         return bids_path.copy().update(run=None)
     bids_path = bids_path.copy().update(split="01")
-    missing = not bids_path.fpath.exists()
+    missing = bids_path.fpath.name not in names
     if not allow_missing:
         assert not missing, f"Missing file: {bids_path.fpath}"
     if missing:
@@ -373,12 +975,19 @@ def _update_for_splits(
     for split in range(2, 100):
         split_key = f"{split:02d}"
         bids_path_next = bids_path.copy().update(split=split_key)
-        if not bids_path_next.fpath.exists():
+        if bids_path_next.fpath.name not in names:
             break
         files_dict[f"{key}_split-{split_key}"] = bids_path_next
     return bids_path
 
 
+def _list_dir(path: pathlib.Path) -> set[str]:
+    try:
+        return set(os.listdir(path))
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
+
+
 def _sanitize_callable(val):
     # Callables are not nicely pickleable, so let's pass a string instead
     if callable(val):
@@ -420,6 +1029,8 @@ def _prep_out_files(
 ):
     if check_relative is None:
         check_relative = exec_params.deriv_root
+    content_store = _get_content_store(exec_params)
+    hash_index = _get_file_hash_index(exec_params)
     for key, fname in out_files.items():
         # Sanity check that we only ever write to the derivatives directory
         if bids_only:
@@ -434,12 +1045,24 @@ def _prep_out_files(
                 f"Output BIDSPath not relative to expected root {check_relative}:"
                 f"\n{fname}"
             )
+        # Only deduplicate FIF files, which make up most of the data and are
+        # only ever written as a whole (never updated like, e.g., reports)
+        if content_store is not None and fname.suffix == ".fif":
+            this_hash = _get_file_hash(fname, hash_index=hash_index)
+            content_store.add(fname, this_hash, hash_index=hash_index)
+            if exec_params.memory_file_method == "hash":
+                # The contents did not change, so do not hash the file again
+                out_files[key] = (str(fname), this_hash)
+                continue
         out_files[key] = _path_to_str_hash(
             key,
             fname,
             method=exec_params.memory_file_method,
             kind="out",
+            hash_index=hash_index,
         )
+    if hash_index is not None:
+        hash_index.flush()
     return out_files
 
 
@@ -449,6 +1072,7 @@ def _path_to_str_hash(
     *,
     method: Literal["mtime", "hash"],
     kind: str = "in",
+    hash_index: _FileHashIndex | None = None,
 ):
     if isinstance(v, BIDSPath):
         v = v.fpath
@@ -458,5 +1082,5 @@ def _path_to_str_hash(
         this_hash = v.stat().st_mtime
     else:
         assert method == "hash"  # guaranteed
-        this_hash = hash_file_path(v)
+        this_hash = _get_file_hash(v, hash_index=hash_index)
     return (str(v), this_hash)
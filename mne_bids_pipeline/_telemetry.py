@@ -0,0 +1,169 @@
+"""Per-task timing and resource telemetry."""
+
+import datetime
+import functools
+import json
+import pathlib
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import psutil
+from filelock import FileLock
+
+from ._config_utils import get_task
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# The values recorded for each task (in addition to the task parameters)
+_TELEMETRY_KEYS = (
+    "time",
+    "cpu_time",
+    "peak_rss",
+    "read_bytes",
+    "write_bytes",
+    "cache",
+    "success",
+    "error_message",
+)
+
+# The columns every telemetry table has, even if no task was recorded yet
+_TELEMETRY_COLUMNS = ("step", "timestamp", *_TELEMETRY_KEYS)
+
+# Task parameters that are not written to the log
+_IGNORE_KEYS = ("cfg", "exec_params", "in_files")
+
+
+class _ResourceMonitor:
+    """Measure the resources used by the current process while in this context.
+
+    As each worker process only runs one task at a time, this gives the
+    resources used by the task.
+    """
+
+    def __init__(self, *, interval: float = 0.05):
+        self.interval = interval
+        self.results = dict()
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._peak_rss = 0
+
+    def _sample(self) -> None:
+        while True:
+            self._peak_rss = max(self._peak_rss, self._process.memory_info().rss)
+            if self._stop.wait(self.interval):
+                break
+
+    def __enter__(self) -> "_ResourceMonitor":
+        self._t0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+        self._io0 = _get_io_counters(self._process)
+        self._max_rss0 = _get_max_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        # Sampling can miss short spikes, but if the peak RSS of the process
+        # increased, the new peak must have been reached during this task
+        max_rss = _get_max_rss()
+        if max_rss is not None and max_rss > self._max_rss0:
+            self._peak_rss = max(self._peak_rss, max_rss)
+        io = _get_io_counters(self._process)
+        self.results = dict(
+            time=round(time.perf_counter() - self._t0, 3),
+            cpu_time=round(time.process_time() - self._cpu0, 3),
+            peak_rss=self._peak_rss,
+            read_bytes=None if io is None else io[0] - self._io0[0],
+            write_bytes=None if io is None else io[1] - self._io0[1],
+        )
+
+
+def _get_io_counters(process: psutil.Process) -> tuple[int, int] | None:
+    try:
+        io = process.io_counters()
+    except (AttributeError, psutil.Error):  # not available on macOS
+        return None
+    return io.read_bytes, io.write_bytes
+
+
+def _get_max_rss() -> int | None:
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if not psutil.MACOS:
+        max_rss *= 1024  # kB
+    return max_rss
+
+
+def _get_telemetry_fname(*, config: SimpleNamespace) -> pathlib.Path:
+    return config.deriv_root / f"task-{get_task(config)}_log.jsonl"
+
+
+def _write_telemetry(
+    *,
+    config: SimpleNamespace,
+    step: str,
+    logs: list[pd.Series],
+) -> None:
+    """Append the logs of a step to the telemetry file."""
+    timestamp = datetime.datetime.now().isoformat(timespec="seconds")
+    lines = list()
+    for log_info in logs:
+        record = dict(step=step, timestamp=timestamp)
+        for key, val in log_info.items():
+            if key in _IGNORE_KEYS:
+                continue
+            if isinstance(val, float) and np.isnan(val):
+                val = None
+            record[key] = val
+        lines.append(json.dumps(record, default=_to_json) + "\n")
+    if not lines:
+        return
+    fname = _get_telemetry_fname(config=config)
+    with FileLock(fname.with_suffix(fname.suffix + ".lock")):
+        with open(fname, "a", encoding="utf-8") as fid:
+            fid.writelines(lines)
+
+
+def _to_json(val):
+    if isinstance(val, np.generic):
+        return val.item()
+    return str(val)
+
+
+def _read_telemetry(*, config: SimpleNamespace) -> pd.DataFrame:
+    fname = _get_telemetry_fname(config=config)
+    if not fname.exists():
+        return pd.DataFrame(columns=list(_TELEMETRY_COLUMNS))
+    return _read_jsonl_cached(fname=fname, mtime_ns=fname.stat().st_mtime_ns).copy()
+
+
+def _read_peak_rss(*, deriv_root: pathlib.Path, steps: list[str]) -> int | None:
+    """Get the highest peak memory usage of a task of the given steps."""
+    peak_rss = None
+    for fname in deriv_root.glob("task-*_log.jsonl"):
+        df = _read_jsonl_cached(fname=fname, mtime_ns=fname.stat().st_mtime_ns)
+        # Cached results say nothing about the memory usage
+        df = df[df["step"].isin(steps) & (df["cache"] != "hit")]
+        this_peak_rss = df["peak_rss"].max()
+        if pd.notna(this_peak_rss):
+            peak_rss = max(peak_rss or 0, int(this_peak_rss))
+    return peak_rss
+
+
+@functools.lru_cache(maxsize=4)
+def _read_jsonl_cached(*, fname: pathlib.Path, mtime_ns: int) -> pd.DataFrame:
+    df = pd.read_json(fname, lines=True, dtype=False)
+    # An empty file (or one written by an older version) can lack some columns
+    for key in _TELEMETRY_COLUMNS:
+        if key not in df.columns:
+            df[key] = None
+    return df
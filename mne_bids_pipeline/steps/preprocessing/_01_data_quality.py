@@ -16,9 +16,11 @@ from ..._config_utils import (
 )
 from ..._import_data import (
     _bads_path,
+    _get_mf_head_origin,
     _get_mf_reference_run_path,
     _get_run_rest_noise_path,
     _import_data_kwargs,
+    _read_mf_calibration,
     _read_raw_msg,
     import_er_data,
     import_experimental_data,
@@ -258,9 +260,9 @@ def _find_bads_maxwell(
         auto_scores,
     ) = mne.preprocessing.find_bad_channels_maxwell(
         raw=raw_filt,
-        calibration=cfg.mf_cal_fname,
+        calibration=_read_mf_calibration(cfg.mf_cal_fname),
         cross_talk=cfg.mf_ctc_fname,
-        origin=cfg.mf_head_origin,
+        origin=_get_mf_head_origin(cfg.mf_head_origin, raw.info),
         coord_frame="head",
         return_scores=True,
         h_freq=None,  # we filtered manually above
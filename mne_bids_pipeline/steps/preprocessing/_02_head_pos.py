@@ -1,8 +1,20 @@
-"""Estimate head positions."""
+"""Estimate head positions.
 
+This is done in three separately cached stages, so that e.g. changing the
+goodness-of-fit limit does not require estimating the cHPI amplitudes again:
+
+1. Estimate the cHPI amplitudes and SNR.
+2. Estimate the cHPI coil locations.
+3. Estimate the head positions.
+"""
+
+from collections.abc import Callable
 from types import SimpleNamespace
 
 import mne
+import numpy as np
+from h5io import read_hdf5, write_hdf5
+from mne_bids import BIDSPath
 
 from ..._config_utils import (
     get_runs_tasks,
@@ -14,13 +26,14 @@ from ..._import_data import (
     _import_data_kwargs,
     import_experimental_data,
 )
+from ..._io import _write_info
 from ..._logging import gen_log_kwargs, logger
 from ..._parallel import get_parallel_backend, parallel_func
 from ..._report import _open_report
 from ..._run import _prep_out_files, failsafe_run, save_logs
 
 
-def get_input_fnames_head_pos(
+def _get_raw_path(
     *,
     cfg: SimpleNamespace,
     subject: str,
@@ -28,7 +41,6 @@ def get_input_fnames_head_pos(
     run: str | None,
     task: str | None,
 ) -> dict:
-    """Get paths of files required by run_head_pos function."""
     return _get_run_rest_noise_path(
         cfg=cfg,
         subject=subject,
@@ -40,10 +52,296 @@ def get_input_fnames_head_pos(
     )
 
 
+def _get_chpi_paths(
+    *,
+    cfg: SimpleNamespace,
+    bids_path_in: BIDSPath,
+) -> dict[str, BIDSPath]:
+    paths = dict()
+    for key, suffix, extension in (
+        ("info", "chpiinfo", ".fif"),
+        ("amplitudes", "chpiamplitudes", ".h5"),
+        ("locs", "chpilocs", ".h5"),
+    ):
+        paths[key] = bids_path_in.copy().update(
+            suffix=suffix,
+            extension=extension,
+            root=cfg.deriv_root,
+            check=False,
+        )
+    return paths
+
+
+def _get_chpi_in_files(
+    *,
+    cfg: SimpleNamespace,
+    subject: str,
+    session: str | None,
+    run: str | None,
+    task: str | None,
+    keys: tuple[str, ...],
+) -> dict:
+    bids_path_in = _get_raw_path(
+        cfg=cfg,
+        subject=subject,
+        session=session,
+        run=run,
+        task=task,
+    )[f"raw_task-{task}_run-{run}"]
+    chpi_paths = _get_chpi_paths(cfg=cfg, bids_path_in=bids_path_in)
+    return {f"chpi_{key}": chpi_paths[key] for key in keys}
+
+
+# The parts of the cHPI model set up by MNE that are used to fit the amplitudes
+_HPI_KEYS = (
+    "freqs",
+    "grad_subpicks",
+    "hpi_pick",
+    "inv_model",
+    "inv_model_reord",
+    "mag_subpicks",
+    "meg_picks",
+    "model",
+    "n_window",
+    "on",
+    "proj",
+    "proj_op",
+    "t_window",
+)
+
+
+def _setup_chpi_fit(
+    raw: mne.io.BaseRaw, *, t_window: float | str
+) -> tuple[dict, Callable, Callable] | None:
+    """Set up fitting the cHPI amplitudes and SNR using private MNE functions.
+
+    Returns None if these are not available in the installed MNE-Python version.
+    """
+    try:
+        from mne._chpi_numba import _fast_fit, _fast_fit_snr
+        from mne.chpi import _setup_hpi_amplitude_fitting
+    except ImportError:
+        return None
+    hpi = _setup_hpi_amplitude_fitting(raw.info, t_window)
+    if not set(_HPI_KEYS).issubset(hpi):
+        return None
+    return hpi, _fast_fit, _fast_fit_snr
+
+
+def _compute_chpi_amplitudes_snr(
+    raw: mne.io.BaseRaw,
+    *,
+    t_step_min: float,
+    t_window: float | str,
+    batched: bool = False,
+) -> tuple[dict, dict]:
+    """Compute cHPI amplitudes and SNR in a single pass over the data.
+
+    The results are the same as those of :func:`mne.chpi.compute_chpi_amplitudes`
+    and :func:`mne.chpi.compute_chpi_snr`, which would each read all time
+    windows and set up the cHPI model separately. If ``batched``, all
+    full-length windows are fit in batches instead of one at a time.
+    """
+    chpi_fit = _setup_chpi_fit(raw, t_window=t_window)
+    if chpi_fit is None:
+        msg = (
+            "The installed MNE-Python version does not support estimating the "
+            "cHPI amplitudes and SNR in a single pass, using "
+            "mne.chpi.compute_chpi_amplitudes() and compute_chpi_snr() instead."
+        )
+        if batched:
+            logger.warning(**gen_log_kwargs(message=msg))
+        else:
+            logger.info(**gen_log_kwargs(message=msg))
+        kwargs = dict(t_step_min=t_step_min, t_window=t_window, verbose=False)
+        return (
+            mne.chpi.compute_chpi_amplitudes(raw, **kwargs),
+            mne.chpi.compute_chpi_snr(raw, **kwargs),
+        )
+    hpi, _fast_fit, _fast_fit_snr = chpi_fit
+    sfreq = raw.info["sfreq"]
+    start, stop = raw._tmin_tmax_to_start_stop(0, None)
+    fit_idxs = raw.time_as_index(
+        np.arange(start / sfreq + hpi["t_window"] / 2.0, stop / sfreq, t_step_min),
+        use_rounding=True,
+    )
+    times = np.round(fit_idxs + raw.first_samp - hpi["n_window"] / 2.0) / sfreq
+    starts = np.maximum(fit_idxs - hpi["n_window"] // 2, 0)
+    stops = np.minimum(starts + hpi["n_window"], len(raw.times))
+    n_freqs = len(hpi["freqs"])
+    n_chans = len(hpi["proj"]["data"]["col_names"])
+    chpi_amplitudes = dict(
+        times=times,
+        proj=hpi["proj"],
+        slopes=np.full((len(times), n_freqs, n_chans), np.nan),
+    )
+    snr_dict = dict(times=times, freqs=hpi["freqs"])
+    ch_types = raw.get_channel_types()
+    grad_offset = 3 if "mag" in ch_types else 0
+    snr_cols = dict()
+    for ch_type, offset in (("mag", 0), ("grad", grad_offset)):
+        if ch_type in ch_types:
+            for ki, key in enumerate(("snr", "power", "resid")):
+                snr_dict[f"{ch_type}_{key}"] = np.full(
+                    (len(times), 1 if key == "resid" else n_freqs), np.nan
+                )
+                snr_cols[f"{ch_type}_{key}"] = offset + ki
+
+    def _store(idx: np.ndarray | int, slopes: np.ndarray, snrs: np.ndarray) -> None:
+        chpi_amplitudes["slopes"][idx] = slopes
+        for key, col in snr_cols.items():
+            # The residual is the same for all frequencies
+            if key.endswith("resid"):
+                snr_dict[key][idx] = snrs[..., :1, col]
+            else:
+                snr_dict[key][idx] = snrs[..., col]
+
+    fit_mask = _get_chpi_coils_on(raw, hpi=hpi, starts=starts, stops=stops)
+    if batched:
+        # Windows at the edges of the recording are shorter and fit below
+        batch_mask = fit_mask & (stops - starts == hpi["n_window"])
+        batch_idx = np.flatnonzero(batch_mask)
+        _store(batch_idx, *_fit_chpi_batched(raw, hpi=hpi, starts=starts[batch_idx]))
+        fit_mask &= ~batch_mask
+    for mi in np.flatnonzero(fit_mask):
+        # Both fits use the same data
+        data = raw[hpi["meg_picks"], starts[mi] : stops[mi]][0]
+        slopes = _fast_fit(
+            data, hpi["proj_op"], n_freqs, hpi["model"], hpi["inv_model_reord"]
+        )
+        snrs = _fast_fit_snr(
+            data,
+            n_freqs,
+            hpi["model"],
+            hpi["inv_model"],
+            hpi["mag_subpicks"],
+            hpi["grad_subpicks"],
+        )
+        _store(mi, slopes, snrs)
+    return chpi_amplitudes, snr_dict
+
+
+def _get_chpi_coils_on(
+    raw: mne.io.BaseRaw,
+    *,
+    hpi: dict,
+    starts: np.ndarray,
+    stops: np.ndarray,
+) -> np.ndarray:
+    """Get whether at least 3 cHPI coils are on during each time window."""
+    if hpi["hpi_pick"] is None:
+        return np.ones(len(starts), bool)
+    chpi_data = raw[hpi["hpi_pick"]][0][0]
+    ons = (np.round(chpi_data).astype(np.int64) & hpi["on"][:, np.newaxis]).astype(bool)
+    # Cumulative number of samples during which each coil is off
+    n_off = np.zeros((len(ons), ons.shape[1] + 1), np.int64)
+    np.cumsum(~ons, axis=1, out=n_off[:, 1:])
+    n_on = (n_off[:, stops] == n_off[:, starts]).sum(axis=0)
+    return n_on >= 3
+
+
+def _fit_chpi_batched(
+    raw: mne.io.BaseRaw,
+    *,
+    hpi: dict,
+    starts: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Fit the cHPI amplitudes and SNR of many full-length time windows at once.
+
+    All windows share the same design matrix, so the coefficients of a batch of
+    windows are obtained with a single matrix product. The external SSS
+    projector is applied to the cHPI coefficients instead of to the data of each
+    window, and the phase of each cHPI frequency is estimated with a batched
+    eigendecomposition of the 2x2 sine-cosine Gram matrices instead of an SVD.
+    The results match those of the window-by-window fit up to numerical
+    precision, except that the sign of each amplitude vector is arbitrary in
+    both cases.
+
+    Returns the amplitudes, shape (n_windows, n_freqs, n_channels), and the SNR
+    estimates in the layout of :func:`mne._chpi_numba._fast_fit_snr`, shape
+    (n_windows, n_freqs, 3 * n_ch_types).
+    """
+    n_window = hpi["n_window"]
+    n_freqs = len(hpi["freqs"])
+    meg_picks = hpi["meg_picks"]
+    model, inv_model = hpi["model"], hpi["inv_model"]
+    model_gram = model.T @ model
+    slopes = np.empty((len(starts), n_freqs, len(meg_picks)))
+    ch_subpicks = [
+        subpicks
+        for subpicks in (hpi["mag_subpicks"], hpi["grad_subpicks"])
+        if len(subpicks)
+    ]
+    snrs = np.empty((len(starts), n_freqs, 3 * len(ch_subpicks)))
+    # Limit the memory used by the data of each batch to about 32 MB
+    n_batch = max(2**22 // (len(meg_picks) * n_window), 1)
+    for bi in range(0, len(starts), n_batch):
+        batch_starts = starts[bi : bi + n_batch]
+        batch_sl = slice(bi, bi + len(batch_starts))
+        data = raw[meg_picks, batch_starts[0] : batch_starts[-1] + n_window][0]
+        # Only changes the DC coefficients, but avoids a loss of precision below
+        data = data - data.mean(axis=1, keepdims=True)
+        # shape (n_channels, n_windows, n_window)
+        windows = np.lib.stride_tricks.sliding_window_view(data, n_window, axis=1)[
+            :, batch_starts - batch_starts[0]
+        ]
+        coefs = windows @ inv_model.T
+
+        # Amplitudes, using the projected sine and cosine coefficients
+        proj_coefs = hpi["proj_op"] @ coefs[..., : 2 * n_freqs].reshape(
+            len(meg_picks), -1
+        )
+        # shape (n_windows, n_freqs, 2, n_channels)
+        proj_coefs = proj_coefs.reshape(len(meg_picks), -1, 2, n_freqs).transpose(
+            1, 3, 2, 0
+        )
+        # The first left singular vector is the eigenvector with the largest
+        # eigenvalue of the Gram matrix
+        vecs = np.linalg.eigh(proj_coefs @ proj_coefs.swapaxes(-1, -2))[1][..., -1]
+        slopes[batch_sl] = np.einsum("wfk,wfkc->wfc", vecs, proj_coefs)
+
+        # SNR, using the coefficients of the data that are not projected
+        power = (coefs[..., :n_freqs] ** 2 + coefs[..., n_freqs : 2 * n_freqs] ** 2) / 2
+        # The model includes a DC term, so the residuals have zero mean and their
+        # variance is the part of the data variance that the model does not explain
+        resid_var = (
+            np.einsum("cwt,cwt->cw", windows, windows)
+            - np.einsum("cwk,cwk->cw", coefs @ model_gram, coefs)
+        ) / n_window
+        for ti, subpicks in enumerate(ch_subpicks):
+            avg_power = power[subpicks].mean(axis=0)
+            avg_resid = resid_var[subpicks].mean(axis=0)[:, np.newaxis]
+            snrs[batch_sl, :, 3 * ti] = 10 * np.log10(avg_power / avg_resid)
+            snrs[batch_sl, :, 3 * ti + 1] = avg_power
+            snrs[batch_sl, :, 3 * ti + 2] = avg_resid
+    return slopes, snrs
+
+
+# %% cHPI amplitudes and SNR
+
+
+def get_input_fnames_chpi_amplitudes(
+    *,
+    cfg: SimpleNamespace,
+    subject: str,
+    session: str | None,
+    run: str | None,
+    task: str | None,
+) -> dict:
+    """Get paths of files required by run_chpi_amplitudes function."""
+    return _get_raw_path(
+        cfg=cfg,
+        subject=subject,
+        session=session,
+        run=run,
+        task=task,
+    )
+
+
 @failsafe_run(
-    get_input_fnames=get_input_fnames_head_pos,
+    get_input_fnames=get_input_fnames_chpi_amplitudes,
 )
-def run_head_pos(
+def run_chpi_amplitudes(
     *,
     cfg: SimpleNamespace,
     exec_params: SimpleNamespace,
@@ -58,18 +356,11 @@ def run_head_pos(
     in_key = f"raw_task-{task}_run-{run}"
     bids_path_in = in_files.pop(in_key)
     bids_path_bads_in = in_files.pop(f"{in_key}-bads", None)
-    out_files = dict()
-    key = f"raw_run-{run}-pos"
-    out_files[key] = bids_path_in.copy().update(
-        suffix="headpos",
-        extension=".txt",
-        root=cfg.deriv_root,
-        check=False,
+    chpi_paths = _get_chpi_paths(cfg=cfg, bids_path_in=bids_path_in)
+    out_files = dict(
+        chpi_info=chpi_paths["info"],
+        chpi_amplitudes=chpi_paths["amplitudes"],
     )
-    # Now take everything from the bids_path_in and overwrite the parameters
-    subject = bids_path_in.subject  # noqa: F841
-    session = bids_path_in.session  # noqa: F841
-    run = bids_path_in.run
 
     raw = import_experimental_data(
         cfg=cfg,
@@ -77,37 +368,188 @@ def run_head_pos(
         bids_path_bads_in=bids_path_bads_in,
         data_is_rest=None,  # autodetect
     )
-    # TODO: We should split these into separate cached steps.
-    # This could all be part of this file -- we can put multiple loops inside
-    # main() to do it. But this can wait until a use case pushes us to do it.
-    logger.info(**gen_log_kwargs(message="Estimating cHPI amplitudes"))
-    chpi_amplitudes = mne.chpi.compute_chpi_amplitudes(
+    logger.info(**gen_log_kwargs(message="Estimating cHPI amplitudes and SNR"))
+    chpi_amplitudes, snr_dict = _compute_chpi_amplitudes_snr(
         raw,
         t_step_min=cfg.mf_mc_t_step_min,
         t_window=cfg.mf_mc_t_window,
+        batched=cfg.mf_mc_batched_fit,
     )
-    logger.info(**gen_log_kwargs(message="Estimating cHPI SNR"))
-    snr_dict = mne.chpi.compute_chpi_snr(
-        raw,
-        t_step_min=cfg.mf_mc_t_step_min,
-        t_window=cfg.mf_mc_t_window,
+    # The later stages need the measurement info (e.g. the digitized cHPI coils)
+    _write_info(out_files["chpi_info"], raw.info)
+    write_hdf5(
+        out_files["chpi_amplitudes"].fpath,
+        dict(
+            times=chpi_amplitudes["times"],
+            proj=dict(chpi_amplitudes["proj"]),
+            slopes=chpi_amplitudes["slopes"],
+            snr=snr_dict,
+        ),
+        overwrite=True,
+    )
+
+    with _open_report(
+        cfg=cfg,
+        exec_params=exec_params,
+        subject=subject,
+        session=session,
+        run=run,
+        task=task,
+    ) as report:
+        msg = "Adding cHPI SNR to report."
+        logger.info(**gen_log_kwargs(message=msg))
+        fig = mne.viz.plot_chpi_snr(snr_dict)
+        report.add_figure(
+            fig=fig,
+            title=f"cHPI SNR: run {bids_path_in.run}",
+            image_format="svg",
+            section="Head position",
+            tags=("raw", f"run-{bids_path_in.run}", "chpi", "sss"),
+            replace=True,
+        )
+        plt.close(fig)
+    del bids_path_in
+    assert len(in_files) == 0, in_files.keys()
+    return _prep_out_files(exec_params=exec_params, out_files=out_files)
+
+
+def _read_chpi_amplitudes(fname: BIDSPath) -> dict:
+    chpi_amplitudes = read_hdf5(fname.fpath)
+    chpi_amplitudes["proj"] = mne.Projection(**chpi_amplitudes["proj"])
+    return chpi_amplitudes
+
+
+def get_config_chpi_amplitudes(
+    *,
+    config: SimpleNamespace,
+    subject: str,
+    session: str | None,
+) -> SimpleNamespace:
+    cfg = SimpleNamespace(
+        mf_mc_t_step_min=config.mf_mc_t_step_min,
+        mf_mc_t_window=config.mf_mc_t_window,
+        mf_mc_batched_fit=config.mf_mc_batched_fit,
+        **_import_data_kwargs(config=config, subject=subject),
+    )
+    return cfg
+
+
+# %% cHPI locations
+
+
+def get_input_fnames_chpi_locs(
+    *,
+    cfg: SimpleNamespace,
+    subject: str,
+    session: str | None,
+    run: str | None,
+    task: str | None,
+) -> dict:
+    """Get paths of files required by run_chpi_locs function."""
+    return _get_chpi_in_files(
+        cfg=cfg,
+        subject=subject,
+        session=session,
+        run=run,
+        task=task,
+        keys=("info", "amplitudes"),
+    )
+
+
+@failsafe_run(
+    get_input_fnames=get_input_fnames_chpi_locs,
+)
+def run_chpi_locs(
+    *,
+    cfg: SimpleNamespace,
+    exec_params: SimpleNamespace,
+    subject: str,
+    session: str | None,
+    run: str | None,
+    task: str | None,
+    in_files: dict,
+) -> dict:
+    info = mne.io.read_info(in_files.pop("chpi_info"))
+    fname_amplitudes = in_files.pop("chpi_amplitudes")
+    chpi_amplitudes = _read_chpi_amplitudes(fname_amplitudes)
+    out_files = dict(
+        chpi_locs=_get_chpi_paths(cfg=cfg, bids_path_in=fname_amplitudes)["locs"]
     )
     logger.info(**gen_log_kwargs(message="Estimating cHPI locations"))
-    chpi_locs = mne.chpi.compute_chpi_locs(raw.info, chpi_amplitudes)
+    chpi_locs = mne.chpi.compute_chpi_locs(info, chpi_amplitudes)
+    write_hdf5(out_files["chpi_locs"].fpath, chpi_locs, overwrite=True)
+    assert len(in_files) == 0, in_files.keys()
+    return _prep_out_files(exec_params=exec_params, out_files=out_files)
+
+
+def get_config_chpi_locs(
+    *,
+    config: SimpleNamespace,
+    subject: str,
+    session: str | None,
+) -> SimpleNamespace:
+    cfg = SimpleNamespace(
+        **_import_data_kwargs(config=config, subject=subject),
+    )
+    return cfg
+
+
+# %% Head positions
+
+
+def get_input_fnames_head_pos(
+    *,
+    cfg: SimpleNamespace,
+    subject: str,
+    session: str | None,
+    run: str | None,
+    task: str | None,
+) -> dict:
+    """Get paths of files required by run_head_pos function."""
+    return _get_chpi_in_files(
+        cfg=cfg,
+        subject=subject,
+        session=session,
+        run=run,
+        task=task,
+        keys=("info", "locs"),
+    )
+
+
+@failsafe_run(
+    get_input_fnames=get_input_fnames_head_pos,
+)
+def run_head_pos(
+    *,
+    cfg: SimpleNamespace,
+    exec_params: SimpleNamespace,
+    subject: str,
+    session: str | None,
+    run: str | None,
+    task: str | None,
+    in_files: dict,
+) -> dict:
+    import matplotlib.pyplot as plt
+
+    info = mne.io.read_info(in_files.pop("chpi_info"))
+    fname_locs = in_files.pop("chpi_locs")
+    chpi_locs = read_hdf5(fname_locs.fpath)
+    out_files = dict()
+    key = f"raw_run-{run}-pos"
+    out_files[key] = fname_locs.copy().update(
+        suffix="headpos",
+        extension=".txt",
+        check=False,
+    )
     logger.info(**gen_log_kwargs(message="Estimating head positions"))
     head_pos = mne.chpi.compute_head_pos(
-        raw.info,
+        info,
         chpi_locs,
         gof_limit=cfg.mf_mc_gof_limit,
         dist_limit=cfg.mf_mc_dist_limit,
     )
     mne.chpi.write_head_pos(out_files[key], head_pos)
 
-    # Reporting
-    tags = ("raw", f"run-{bids_path_in.run}", "chpi", "sss")
-    section = "Head position"
-    title = f"run {bids_path_in.run}"
-
     with _open_report(
         cfg=cfg,
         exec_params=exec_params,
@@ -116,29 +558,18 @@ def run_head_pos(
         run=run,
         task=task,
     ) as report:
-        msg = "Adding cHPI SNR and head positions to report."
+        msg = "Adding head positions to report."
         logger.info(**gen_log_kwargs(message=msg))
-        fig = mne.viz.plot_chpi_snr(snr_dict)
-        report.add_figure(
-            fig=fig,
-            title=f"cHPI SNR: {title}",
-            image_format="svg",
-            section=section,
-            tags=tags,
-            replace=True,
-        )
-        plt.close(fig)
         fig = mne.viz.plot_head_positions(head_pos, mode="traces")
         report.add_figure(
             fig=fig,
-            title=f"Head positions: {title}",
+            title=f"Head positions: run {fname_locs.run}",
             image_format="svg",
-            section=section,
-            tags=tags,
+            section="Head position",
+            tags=("raw", f"run-{fname_locs.run}", "chpi", "sss"),
             replace=True,
         )
         plt.close(fig)
-    del bids_path_in
     assert len(in_files) == 0, in_files.keys()
     return _prep_out_files(exec_params=exec_params, out_files=out_files)
 
@@ -150,10 +581,8 @@ def get_config(
     session: str | None,
 ) -> SimpleNamespace:
     cfg = SimpleNamespace(
-        mf_mc_t_step_min=config.mf_mc_t_step_min,
         mf_mc_gof_limit=config.mf_mc_gof_limit,
         mf_mc_dist_limit=config.mf_mc_dist_limit,
-        mf_mc_t_window=config.mf_mc_t_window,
         **_import_data_kwargs(config=config, subject=subject),
     )
     return cfg
@@ -166,25 +595,40 @@ def main(*, config: SimpleNamespace) -> None:
         logger.info(**gen_log_kwargs(message=msg, emoji="skip"))
         return
 
+    subjects_sessions_runs_tasks = [
+        (subject, session, run, task)
+        for subject in get_subjects(config)
+        for session in get_sessions(config)
+        for run, task in get_runs_tasks(
+            config=config,
+            subject=subject,
+            session=session,
+            which=("runs", "rest"),
+        )
+    ]
     with get_parallel_backend(config.exec_params):
-        parallel, run_func = parallel_func(run_head_pos, exec_params=config.exec_params)
-        logs = parallel(
-            run_func(
-                cfg=get_config(config=config, subject=subject, session=session),
-                exec_params=config.exec_params,
-                subject=subject,
-                session=session,
-                run=run,
-                task=task,
-            )
-            for subject in get_subjects(config)
-            for session in get_sessions(config)
-            for run, task in get_runs_tasks(
-                config=config,
-                subject=subject,
-                session=session,
-                which=("runs", "rest"),
+        logs = list()
+        # Each stage needs the outputs of the previous one
+        for func, get_config_func in (
+            (run_chpi_amplitudes, get_config_chpi_amplitudes),
+            (run_chpi_locs, get_config_chpi_locs),
+            (run_head_pos, get_config),
+        ):
+            parallel, run_func = parallel_func(func, exec_params=config.exec_params)
+            logs += parallel(
+                run_func(
+                    cfg=get_config_func(
+                        config=config,
+                        subject=subject,
+                        session=session,
+                    ),
+                    exec_params=config.exec_params,
+                    subject=subject,
+                    session=session,
+                    run=run,
+                    task=task,
+                )
+                for subject, session, run, task in subjects_sessions_runs_tasks
             )
-        )
 
     save_logs(config=config, logs=logs)
@@ -15,12 +15,13 @@ The function loads machine-specific calibration files.
 """
 
 import gc
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from types import SimpleNamespace
 
 import mne
 import numpy as np
-from mne_bids import read_raw_bids
+from mne_bids import BIDSPath, read_raw_bids
 
 from ..._config_utils import (
     _pl,
@@ -31,19 +32,82 @@ from ..._config_utils import (
     get_subjects,
 )
 from ..._import_data import (
+    _get_mf_head_origin,
     _get_mf_reference_run_path,
     _get_run_path,
     _get_run_rest_noise_path,
+    _get_segments,
     _import_data_kwargs,
+    _read_bads_tsv,
+    _read_mf_calibration,
     import_er_data,
     import_experimental_data,
 )
+from ..._io import _write_info
 from ..._logging import gen_log_kwargs, logger
-from ..._parallel import get_parallel_backend, parallel_func
+from ..._parallel import _set_n_threads, get_parallel_backend, parallel_func
 from ..._report import _add_raw, _open_report
 from ..._run import _prep_out_files, _update_for_splits, failsafe_run, save_logs
 
 
+# %% Reference run info
+def get_input_fnames_ref_info(
+    *,
+    cfg: SimpleNamespace,
+    subject: str,
+    session: str | None,
+) -> dict:
+    return _get_mf_reference_run_path(cfg=cfg, subject=subject, session=session)
+
+
+@failsafe_run(
+    get_input_fnames=get_input_fnames_ref_info,
+)
+def write_ref_info(
+    *,
+    cfg: SimpleNamespace,
+    exec_params: SimpleNamespace,
+    subject: str,
+    session: str | None,
+    in_files: dict,
+) -> dict:
+    bids_path_ref_in = in_files.pop("raw_ref_run")
+    bids_path_ref_bads_in = in_files.pop("raw_ref_run-bads", None)
+    msg = f"Loading reference run: {cfg.mf_reference_run}."
+    logger.info(**gen_log_kwargs(message=msg))
+    raw = read_raw_bids(
+        bids_path=bids_path_ref_in,
+        extra_params=cfg.reader_extra_params,
+        verbose=cfg.read_raw_bids_verbose,
+    )
+    info = raw.info
+    del raw
+    if bids_path_ref_bads_in is not None:
+        info["bads"] = _read_bads_tsv(cfg=cfg, bids_path_bads=bids_path_ref_bads_in)
+        info._check_consistency()
+    out_files = dict()
+    out_files["ref_info"] = _get_ref_info_path(
+        cfg=cfg, bids_path_ref_in=bids_path_ref_in
+    )
+    _write_info(out_files["ref_info"], info)
+    assert len(in_files) == 0, in_files.keys()
+    return _prep_out_files(exec_params=exec_params, out_files=out_files)
+
+
+def _get_ref_info_path(
+    *,
+    cfg: SimpleNamespace,
+    bids_path_ref_in: BIDSPath,
+) -> BIDSPath:
+    return bids_path_ref_in.copy().update(
+        suffix="refinfo",
+        split=None,
+        extension=".fif",
+        root=cfg.deriv_root,
+        check=False,
+    )
+
+
 # %% eSSS
 def get_input_fnames_esss(
     *,
@@ -239,9 +303,15 @@ def get_input_fnames_maxwell_filter(
             )
         )
 
-    # reference run (used for `destination` and also bad channels for noise)
+    # reference run info (used for `destination`), and for empty-room data also the
+    # reference run itself (for its bad channels, montage, and annotations)
     # use add_bads=None here to mean "add if autobad is turned on"
-    in_files.update(_get_mf_reference_run_path(**kwargs))
+    ref_run_path = _get_mf_reference_run_path(**kwargs)
+    in_files["raw_ref_run_info"] = _get_ref_info_path(
+        cfg=cfg, bids_path_ref_in=ref_run_path["raw_ref_run"]
+    )
+    if run is None and task == "noise":
+        in_files.update(ref_run_path)
 
     is_rest_noise = run is None and task in ("noise", "rest")
     if is_rest_noise:
@@ -315,21 +385,11 @@ def run_maxwell_filter(
     bids_path_out = bids_path_in.copy().update(**bids_path_out_kwargs)
 
     out_files = dict()
-    # Load dev_head_t and digitization points from MaxFilter reference run.
-    msg = f"Loading reference run: {cfg.mf_reference_run}."
-    logger.info(**gen_log_kwargs(message=msg))
-
-    bids_path_ref_in = in_files.pop("raw_ref_run")
-    raw = read_raw_bids(
-        bids_path=bids_path_ref_in,
-        extra_params=cfg.reader_extra_params,
-        verbose=cfg.read_raw_bids_verbose,
-    )
-    bids_path_ref_bads_in = in_files.pop("raw_ref_run-bads", None)
+    # Load dev_head_t from the info of the MaxFilter reference run.
+    ref_info_fname = in_files.pop("raw_ref_run_info")
     if isinstance(destination, str):
         assert destination == "reference_run"
-        destination = raw.info["dev_head_t"]
-    del raw
+        destination = mne.io.read_info(ref_info_fname)["dev_head_t"]
     assert isinstance(destination, mne.transforms.Transform), destination
 
     # Maxwell-filter experimental data.
@@ -354,11 +414,10 @@ def run_maxwell_filter(
     apply_msg += " to"
 
     mf_kws = dict(
-        calibration=in_files.pop("mf_cal_fname"),
+        calibration=_read_mf_calibration(in_files.pop("mf_cal_fname")),
         cross_talk=in_files.pop("mf_ctc_fname"),
         st_duration=cfg.mf_st_duration,
         st_correlation=cfg.mf_st_correlation,
-        origin=cfg.mf_head_origin,
         coord_frame="head",
         destination=destination,
         head_pos=head_pos,
@@ -377,10 +436,11 @@ def run_maxwell_filter(
         fr = raw.info["dev_head_t"]["trans"]
         where = "original head position"
     else:
+        bids_path_ref_bads_in = in_files.pop("raw_ref_run-bads", None)
         raw = import_er_data(
             cfg=cfg,
             bids_path_er_in=bids_path_in,
-            bids_path_ref_in=bids_path_ref_in,
+            bids_path_ref_in=in_files.pop("raw_ref_run"),
             # TODO: This can break processing, need to use union for all,
             # otherwise can get for ds003392:
             # "Reference run data rank does not match empty-room data rank"
@@ -392,6 +452,8 @@ def run_maxwell_filter(
         fr = np.eye(4)
         where = "MEG device origin"
 
+    mf_kws["origin"] = _get_mf_head_origin(cfg.mf_head_origin, raw.info)
+
     # Give some information about the transformation
     to = destination["trans"]
     dist = 1000 * np.linalg.norm(fr[:3, 3] - to[:3, 3])
@@ -412,7 +474,15 @@ def run_maxwell_filter(
         )
         logger.warning(**gen_log_kwargs(message=msg))
 
-    raw_sss = mne.preprocessing.maxwell_filter(raw, **mf_kws)
+    if cfg.mf_chunk_duration is None:
+        raw_sss = mne.preprocessing.maxwell_filter(raw, **mf_kws)
+    else:
+        raw_sss = _maxwell_filter_chunks(
+            raw,
+            chunk_duration=cfg.mf_chunk_duration,
+            n_threads=getattr(exec_params, "n_threads", 1),
+            mf_kws=mf_kws,
+        )
     del raw
     gc.collect()
 
@@ -534,6 +604,180 @@ def run_maxwell_filter(
     return _prep_out_files(exec_params=exec_params, out_files=out_files)
 
 
+def _get_mf_chunks(
+    *,
+    onsets: np.ndarray,
+    ends: np.ndarray,
+    n_times: int,
+    chunk_size: int,
+    n_window: int,
+    n_step: int,
+    n_pad: int,
+    n_min: int,
+    pos_idx: np.ndarray | None,
+) -> list[tuple[int, int, int, int]]:
+    """Get the (padded start, start, stop, padded stop) of the chunks.
+
+    The chunks start at multiples of chunk_size (a multiple of the tSSS window
+    step n_step) in each contiguous segment. They are padded by n_pad samples
+    (aligned to the window steps) so that all windows overlapping a chunk are
+    the same as in the whole recording, and with head positions (pos_idx) also
+    back to the head position in effect at the start of the chunk, so that the
+    movement compensation is interpolated the same way.
+    """
+
+    def get_segment(idx: int) -> tuple[int, int] | None:
+        k = np.searchsorted(onsets, idx, "right") - 1
+        if k >= 0 and idx < ends[k]:
+            return onsets[k], ends[k]
+        return None
+
+    def pad(start: int, stop: int) -> tuple[int, int]:
+        pad_start = start - n_pad
+        if pos_idx is not None:
+            pad_start = min(pad_start, pos_idx[pos_idx <= start].max(initial=0))
+        segment = get_segment(start)
+        if segment is not None and pad_start >= segment[0]:
+            pad_start -= (pad_start - segment[0]) % n_step
+        pad_start = max(pad_start, 0)
+        pad_stop = stop + n_pad
+        segment = get_segment(stop - 1)
+        if segment is not None:
+            pad_stop += -(pad_stop - segment[0]) % n_step
+            # The last window of the segment is longer
+            if pad_stop + n_window > segment[1]:
+                pad_stop = max(segment[1], stop)
+        pad_stop = min(pad_stop, n_times)
+        # Cropping at the edge of a skipped segment would leave an empty one
+        if pad_start > 0 and pad_start in onsets:
+            pad_start -= 1
+        if pad_stop < n_times and pad_stop in ends:
+            pad_stop += 1
+        return pad_start, pad_stop
+
+    def is_valid(pad_start: int, pad_stop: int) -> bool:
+        # maxwell_filter() needs a contiguous segment of (up to) n_min samples
+        n_contiguous = np.max(
+            np.minimum(ends, pad_stop) - np.maximum(onsets, pad_start), initial=0
+        )
+        return n_contiguous > 0 and min(n_min, pad_stop - pad_start) <= n_contiguous + 1
+
+    starts = set()
+    for onset, end in zip(onsets, ends):
+        starts.update(range(onset + chunk_size, end, chunk_size))
+    chunks = list()
+    start = 0
+    for stop in sorted(starts) + [n_times]:
+        pad_start, pad_stop = pad(start, stop)
+        if stop < n_times and not is_valid(pad_start, pad_stop):
+            continue  # merge with the next chunk
+        chunks.append((pad_start, start, stop, pad_stop))
+        start = stop
+    return chunks
+
+
+def _maxwell_filter_chunks(
+    raw: mne.io.BaseRaw,
+    *,
+    chunk_duration: float,
+    n_threads: int,
+    mf_kws: dict,
+) -> mne.io.RawArray:
+    """Maxwell filter the (preloaded) data in padded chunks using threads."""
+    sfreq = raw.info["sfreq"]
+    if mf_kws["st_duration"] is None:
+        n_window = n_step = 1
+        n_pad = 0
+        # Without tSSS, maxwell_filter() processes the data in 10-s windows
+        n_min = max(int(round(10.0 * sfreq)), 1)
+    else:
+        n_window = n_min = int(round(mf_kws["st_duration"] * sfreq))
+        n_step = n_window - n_window // 2  # tSSS windows overlap by half
+        n_pad = -(-n_window // n_step) * n_step
+    chunk_size = max(int(round(chunk_duration * sfreq)), n_window)
+    chunk_size = -(-chunk_size // n_step) * n_step
+    skip_by_annotation = ("edge", "bad_acq_skip")
+    onsets, ends = np.array(_get_segments(raw), int).reshape(-1, 2).T
+    head_pos = mf_kws["head_pos"]
+    pos_idx = None
+    if head_pos is not None:
+        pos_idx = raw.time_as_index(head_pos[:, 0] - raw.first_time, use_rounding=True)
+    chunks = _get_mf_chunks(
+        onsets=onsets,
+        ends=ends,
+        n_times=raw.n_times,
+        chunk_size=chunk_size,
+        n_window=n_window,
+        n_step=n_step,
+        n_pad=n_pad,
+        n_min=n_min,
+        pos_idx=pos_idx,
+    )
+    n_threads = min(n_threads, len(chunks))
+    msg = (
+        f"Processing {len(chunks)} chunk{_pl(chunks)} of about "
+        f"{chunk_size / sfreq:0.1f} s using {n_threads} thread{_pl(n_threads)}"
+    )
+    logger.info(**gen_log_kwargs(message=msg))
+
+    def filter_chunk(pad_start: int, pad_stop: int) -> mne.io.BaseRaw:
+        chunk = mne.io.RawArray(
+            raw._data[:, pad_start:pad_stop],
+            raw.info,
+            first_samp=raw.first_samp + pad_start,
+            verbose=False,
+        )
+        annotations = raw.annotations.copy()
+        if annotations.orig_time is None:
+            # These onsets include the first time, but set_annotations() adds it
+            annotations.onset -= chunk.first_time
+        chunk.set_annotations(annotations, emit_warning=False)
+        chunk_kws = dict(mf_kws)
+        if head_pos is not None:
+            # Start with the head position in effect at the start of the chunk
+            keep = pos_idx >= pad_start
+            chunk_kws["head_pos"] = head_pos[keep]
+            if not keep.all() and pad_start not in pos_idx:
+                first_pos = head_pos[np.flatnonzero(~keep)[-1]].copy()
+                first_pos[0] = chunk.first_time
+                chunk_kws["head_pos"] = np.vstack([first_pos, head_pos[keep]])
+        return mne.preprocessing.maxwell_filter(
+            chunk, skip_by_annotation=skip_by_annotation, verbose=False, **chunk_kws
+        )
+
+    # Most of the time is spent in BLAS calls, which release the GIL
+    with ThreadPoolExecutor(max_workers=n_threads) as ex:
+        pad_starts, _, _, pad_stops = zip(*chunks)
+        chunks_sss = ex.map(filter_chunk, pad_starts, pad_stops)
+        data = info = None
+        for (pad_start, start, stop, _), chunk_sss in zip(chunks, chunks_sss):
+            if data is None:
+                data = np.empty((len(chunk_sss.ch_names), raw.n_times))
+                info = chunk_sss.info
+            data[:, start:stop] = chunk_sss._data[
+                :, start - pad_start : stop - pad_start
+            ]
+            del chunk_sss
+
+    raw_sss = mne.io.RawArray(data, info, first_samp=raw.first_samp, verbose=False)
+    annotations = raw.annotations.copy()
+    if annotations.orig_time is None:
+        annotations.onset -= raw_sss.first_time
+    raw_sss.set_annotations(annotations)
+    return raw_sss
+
+
+def get_config_ref_info(
+    *,
+    config: SimpleNamespace,
+    subject: str,
+) -> SimpleNamespace:
+    cfg = SimpleNamespace(
+        **_import_data_kwargs(config=config, subject=subject),
+    )
+    return cfg
+
+
 def get_config_esss(
     *,
     config: SimpleNamespace,
@@ -576,6 +820,7 @@ def get_config_maxwell_filter(
         mf_mc_rotation_velocity_limit=config.mf_mc_rotation_velocity_limit,
         mf_mc_translation_velocity_limit=config.mf_mc_translation_velocity_limit,
         mf_esss=config.mf_esss,
+        mf_chunk_duration=config.mf_chunk_duration,
         **_import_data_kwargs(config=config, subject=subject),
     )
     return cfg
@@ -590,7 +835,25 @@ def main(*, config: SimpleNamespace) -> None:
 
     with get_parallel_backend(config.exec_params):
         logs = list()
-        # First step: compute eSSS projectors
+        # First step: extract the info of the reference run
+        parallel, run_func = parallel_func(
+            write_ref_info, exec_params=config.exec_params
+        )
+        logs += parallel(
+            run_func(
+                cfg=get_config_ref_info(
+                    config=config,
+                    subject=subject,
+                ),
+                exec_params=config.exec_params,
+                subject=subject,
+                session=session,
+            )
+            for subject in get_subjects(config)
+            for session in get_sessions(config)
+        )
+
+        # Second: compute eSSS projectors
         if config.mf_esss:
             parallel, run_func = parallel_func(
                 compute_esss_proj, exec_params=config.exec_params
@@ -610,13 +873,29 @@ def main(*, config: SimpleNamespace) -> None:
                 for session in get_sessions(config)
             )
 
-        # Second: maxwell_filter
+        # Third: maxwell_filter
         parallel, run_func = parallel_func(
             run_maxwell_filter, exec_params=config.exec_params
         )
         # We need to guarantee that the reference_run completes before the
         # noise/rest runs are processed, so we split the loops.
         for which in [("runs",), ("noise", "rest")]:
+            subjects_sessions_runs_tasks = [
+                (subject, session, run, task)
+                for subject in get_subjects(config)
+                for session in get_sessions(config)
+                for run, task in get_runs_tasks(
+                    config=config,
+                    subject=subject,
+                    session=session,
+                    which=which,
+                )
+            ]
+            # Cores not needed for the runs are used to filter chunks of each run
+            exec_params = _set_n_threads(
+                exec_params=config.exec_params,
+                n_tasks=len(subjects_sessions_runs_tasks),
+            )
             logs += parallel(
                 run_func(
                     cfg=get_config_maxwell_filter(
@@ -624,20 +903,13 @@ def main(*, config: SimpleNamespace) -> None:
                         subject=subject,
                         session=session,
                     ),
-                    exec_params=config.exec_params,
+                    exec_params=exec_params,
                     subject=subject,
                     session=session,
                     run=run,
                     task=task,
                 )
-                for subject in get_subjects(config)
-                for session in get_sessions(config)
-                for run, task in get_runs_tasks(
-                    config=config,
-                    subject=subject,
-                    session=session,
-                    which=which,
-                )
+                for subject, session, run, task in subjects_sessions_runs_tasks
             )
 
     save_logs(config=config, logs=logs)
@@ -11,17 +11,26 @@ directory.
 
 To save space, the raw data can be resampled.
 
+If config.fuse_raw_processing = True and config.regress_artifact is set, the
+artifact regression is applied here as well, and only the regressed data are
+saved.
+
 If config.interactive = True plots raw data and power spectral density.
 """  # noqa: E501
 
-from collections.abc import Iterable
+import functools
+import pathlib
+import tempfile
+from collections.abc import Callable, Iterable
+from fractions import Fraction
 from types import SimpleNamespace
 from typing import Literal
 
 import mne
 import numpy as np
-from mne.io.pick import _picks_to_idx
 from mne.preprocessing import EOGRegression
+from scipy.fft import irfft, rfft
+from scipy.signal import firwin, upfirdn
 
 from ..._config_utils import (
     get_runs_tasks,
@@ -29,7 +38,10 @@ from ..._config_utils import (
     get_subjects,
 )
 from ..._import_data import (
+    _get_mne_private_func,
+    _get_picks,
     _get_run_rest_noise_path,
+    _get_segments,
     _import_data_kwargs,
     _read_raw_msg,
     import_er_data,
@@ -39,6 +51,7 @@ from ..._logging import gen_log_kwargs, logger
 from ..._parallel import get_parallel_backend, parallel_func
 from ..._report import _add_raw, _open_report
 from ..._run import _prep_out_files, _update_for_splits, failsafe_run, save_logs
+from ._05_regress_artifact import _add_regression, _regress_artifact
 
 
 def get_input_fnames_frequency_filter(
@@ -140,13 +153,476 @@ def resample(
     task: str | None,
     sfreq: float,
     run_type: Literal["experimental", "empty-room", "resting-state"],
+    method: Literal["fft", "polyphase"] = "fft",
 ) -> None:
     if not sfreq:
         return
 
     msg = f"Resampling {run_type} data to {sfreq:.1f} Hz"
     logger.info(**gen_log_kwargs(message=msg))
-    raw.resample(sfreq, npad="auto")
+    raw.resample(sfreq, npad="auto", method=method)
+
+
+# The private MNE functions (and their leading parameters) used to filter and
+# resample the data exactly like raw.filter() and raw.resample() do
+_MNE_FILTER_PRIVATE_API = {
+    "_filt_check_picks": ("info", "picks"),
+    "_filt_update_info": ("info", "update_info", "l_freq", "h_freq"),
+    "_resample_stim_channels": ("stim_data", "up", "down"),
+    "_smart_pad": ("x", "n_pad"),
+}
+
+
+def _have_mne_filter_private_api() -> bool:
+    """Check whether the private MNE filtering functions are usable."""
+    return all(
+        _get_mne_private_func("mne.filter", name, params) is not None
+        for name, params in _MNE_FILTER_PRIVATE_API.items()
+    )
+
+
+def _get_notch_freqs(
+    *,
+    cfg: SimpleNamespace,
+    sfreq: float,
+) -> tuple[np.ndarray | None, np.ndarray | None]:
+    """Get the notch frequencies and widths whose stop bands are below Nyquist."""
+    if cfg.notch_freq is None:
+        return None, None
+    freqs = np.atleast_1d(cfg.notch_freq).astype(float)
+    if cfg.notch_widths is None:
+        notch_widths = freqs / 200.0
+    else:
+        notch_widths = np.broadcast_to(cfg.notch_widths, freqs.shape)
+    keep = freqs + notch_widths / 2.0 + cfg.notch_trans_bandwidth / 2.0 < sfreq / 2.0
+    if not keep.all():
+        msg = (
+            f"Not notch filtering at {', '.join(str(f) for f in freqs[~keep])} Hz, "
+            f"which is above the Nyquist frequency ({sfreq / 2.0} Hz)."
+        )
+        logger.info(**gen_log_kwargs(message=msg))
+    if not keep.any():
+        return None, None
+    return freqs[keep], notch_widths[keep]
+
+
+def _get_fir_kernels(
+    *,
+    cfg: SimpleNamespace,
+    sfreq: float,
+) -> list[np.ndarray]:
+    """Design the FIR filters raw.notch_filter() and raw.filter() would apply."""
+    kernels = list()
+    freqs, notch_widths = _get_notch_freqs(cfg=cfg, sfreq=sfreq)
+    if freqs is not None:
+        tb_2 = cfg.notch_trans_bandwidth / 2.0
+        # A band-stop filter (l_freq > h_freq) for all frequencies at once
+        kernels.append(
+            mne.filter.create_filter(
+                None,
+                sfreq,
+                l_freq=freqs + notch_widths / 2.0 + tb_2,
+                h_freq=freqs - notch_widths / 2.0 - tb_2,
+                l_trans_bandwidth=tb_2,
+                h_trans_bandwidth=tb_2,
+                verbose="error",
+            )
+        )
+    if cfg.l_freq is not None or cfg.h_freq is not None:
+        kernels.append(
+            mne.filter.create_filter(
+                None,
+                sfreq,
+                l_freq=cfg.l_freq,
+                h_freq=cfg.h_freq,
+                l_trans_bandwidth=cfg.l_trans_bandwidth,
+                h_trans_bandwidth=cfg.h_trans_bandwidth,
+                verbose="error",
+            )
+        )
+    if cfg.raw_filter_single_pass and len(kernels) > 1:
+        # Equivalent to applying them one after the other
+        kernels = [functools.reduce(np.convolve, kernels)]
+    return kernels
+
+
+def _convolve_valid(x: np.ndarray, h: np.ndarray) -> np.ndarray:
+    """Convolve all rows of x with h (mode="valid") using overlap-add FFTs."""
+    n_h, n_x = len(h), x.shape[-1]
+    # FFT length with the lowest cost, as in mne.filter._overlap_add_filter()
+    n_fft = 2 ** np.arange(
+        np.ceil(np.log2(2 * n_h - 1)),
+        np.ceil(np.log2(max(n_x, 2 * n_h - 1))) + 1,
+        dtype=int,
+    )
+    cost = np.ceil(n_x / (n_fft - n_h + 1)) * n_fft * (np.log2(n_fft) + 1)
+    cost += 4e-5 * n_fft * n_x
+    n_fft = int(n_fft[np.argmin(cost)])
+    n_seg = n_fft - n_h + 1
+    h_fft = rfft(h, n_fft)
+    out = np.zeros(x.shape[:-1] + (n_x + n_h - 1,))
+    for start in range(0, n_x, n_seg):
+        seg = irfft(rfft(x[..., start : start + n_seg], n_fft) * h_fft, n_fft)
+        stop = min(start + n_fft, out.shape[-1])
+        out[..., start:stop] += seg[..., : stop - start]
+    return out[..., n_h - 1 : n_x]
+
+
+def _fir_filter_block(
+    data: np.ndarray,
+    *,
+    kernels: list[np.ndarray],
+    start: int,
+    stop: int,
+    segment: tuple[int, int],
+) -> tuple[np.ndarray, int]:
+    """Apply zero-phase FIR filters to the samples start:stop of a segment.
+
+    The edges of the segment are padded like raw.filter() does, elsewhere the
+    block shrinks by half a filter length on each side per filter. Returns the
+    filtered data and the index of their first sample.
+    """
+    for h in kernels:
+        n_half = len(h) // 2
+        n_pad = (
+            n_half if start == segment[0] else 0,
+            n_half if stop == segment[1] else 0,
+        )
+        data = _convolve_valid(mne.filter._smart_pad(data, n_pad), h)
+        start += n_half - n_pad[0]
+        stop -= n_half - n_pad[1]
+    assert data.shape[-1] == stop - start
+    return data, start
+
+
+def _read_fir_filtered(
+    read: Callable[[int, int], np.ndarray],
+    start: int,
+    stop: int,
+    *,
+    kernels: list[np.ndarray],
+    picks: np.ndarray,
+    segments: list[tuple[int, int]],
+    n_times: int,
+) -> np.ndarray:
+    """Compute the samples start:stop of the filtered signal.
+
+    Only the picked channels are filtered, each contiguous segment separately.
+    The input samples the block depends on are read via read(start, stop).
+    """
+    margin = sum(len(h) // 2 for h in kernels)
+    buf_start = max(start - margin, 0)
+    buf = read(buf_start, min(stop + margin, n_times))
+    data = buf[:, start - buf_start : stop - buf_start].copy()
+    if not kernels:
+        return data
+    for segment in segments:
+        this_start, this_stop = max(start, segment[0]), min(stop, segment[1])
+        if this_start >= this_stop:
+            continue
+        block_start = max(this_start - margin, segment[0])
+        block_stop = min(this_stop + margin, segment[1])
+        block, block_start = _fir_filter_block(
+            buf[picks, block_start - buf_start : block_stop - buf_start],
+            kernels=kernels,
+            start=block_start,
+            stop=block_stop,
+            segment=segment,
+        )
+        data[picks, this_start - start : this_stop - start] = block[
+            :, this_start - block_start : this_stop - block_start
+        ]
+    return data
+
+
+def _get_polyphase_kernel(
+    *, sfreq_in: float, sfreq_out: float
+) -> tuple[np.ndarray, int, int]:
+    """Design the anti-aliasing filter scipy.signal.resample_poly() would use."""
+    ratio = Fraction(sfreq_out / sfreq_in).limit_denominator(1000)
+    if not np.isclose(float(ratio), sfreq_out / sfreq_in, rtol=1e-12, atol=0):
+        raise ValueError(
+            f"Cannot resample from {sfreq_in} Hz to {sfreq_out} Hz using a "
+            "polyphase filter, as the ratio of the sampling frequencies is not a "
+            "simple fraction. Use the FFT-based resampling without block-wise "
+            "filtering or choose a different raw_resample_sfreq."
+        )
+    up, down = ratio.numerator, ratio.denominator
+    max_rate = max(up, down)
+    h = firwin(2 * 10 * max_rate + 1, 1.0 / max_rate, window=("kaiser", 5.0)) * up
+    return h, up, down
+
+
+def _read_resampled(
+    read: Callable[[int, int], np.ndarray],
+    start: int,
+    stop: int,
+    *,
+    h: np.ndarray,
+    up: int,
+    down: int,
+    n_times: int,
+) -> np.ndarray:
+    """Compute the samples start:stop of the polyphase-resampled signal.
+
+    This matches scipy.signal.resample_poly(..., padtype="reflect") on the
+    whole signal, reading only the input samples the block depends on via
+    read(start, stop).
+    """
+    half_len = len(h) // 2
+    # First and last input sample needed
+    first = -((half_len - start * down) // up)
+    last = ((stop - 1) * down + half_len) // up
+    # Start at an input sample for which the output samples fall on the grid of
+    # upfirdn(), i.e., (half_len - first * up) % down == 0
+    first -= (first - half_len * pow(up, -1, down)) % down
+    idx = np.arange(first, last + 1)
+    # Reflect at the edges (without repeating the edge sample)
+    idx = np.abs(idx)
+    idx = np.where(idx >= n_times, 2 * (n_times - 1) - idx, idx)
+    read_start, read_stop = idx.min(), idx.max() + 1
+    data = read(read_start, read_stop)[:, idx - read_start]
+    offset = (half_len - first * up) // down
+    return upfirdn(h, data, up, down, axis=-1)[:, start + offset : stop + offset]
+
+
+def _update_filter_info(
+    *, cfg: SimpleNamespace, info: mne.Info, picks: np.ndarray
+) -> None:
+    """Update the highpass and lowpass in info like raw.filter() does."""
+    if cfg.l_freq is None and cfg.h_freq is None:
+        return
+    update_info, _ = mne.filter._filt_check_picks(info, picks, cfg.l_freq, cfg.h_freq)
+    mne.filter._filt_update_info(info, update_info, cfg.l_freq, cfg.h_freq)
+
+
+def _fir_filter_inplace(
+    *,
+    cfg: SimpleNamespace,
+    raw: mne.io.BaseRaw,
+    picks: np.ndarray | None,
+) -> None:
+    """Apply the FIR filters to the picked channels of preloaded data in place.
+
+    The channels are filtered one at a time, so only one channel is copied.
+    """
+    picks = _get_picks(raw.info, picks, none="data_or_ica", exclude=())
+    kernels = _get_fir_kernels(cfg=cfg, sfreq=raw.info["sfreq"])
+    segments = _get_segments(raw)
+
+    def filter_channel(x: np.ndarray) -> np.ndarray:
+        for start, stop in segments:
+            x[start:stop] = _fir_filter_block(
+                x[np.newaxis, start:stop],
+                kernels=kernels,
+                start=start,
+                stop=stop,
+                segment=(start, stop),
+            )[0][0]
+        return x
+
+    if kernels:
+        raw.apply_function(filter_channel, picks=picks, n_jobs=1, channel_wise=True)
+    _update_filter_info(cfg=cfg, info=raw.info, picks=picks)
+
+
+def _filter_resample_blocks(
+    *,
+    cfg: SimpleNamespace,
+    raw: mne.io.BaseRaw,
+    sfreq: float | None,
+    picks: np.ndarray | None,
+    run_type: Literal["experimental", "empty-room", "resting-state"],
+    tmp_dir: pathlib.Path,
+) -> mne.io.RawArray:
+    """Filter and resample (to sfreq) the data using a polyphase filter.
+
+    All picked channels are filtered at once. If cfg.raw_filter_block_duration
+    is set, this is done block by block and the result is written to a
+    temporary file in tmp_dir, which is memory-mapped by the returned raw.
+    """
+    sfreq_in = raw.info["sfreq"]
+    sfreq_out = sfreq or sfreq_in
+    resample_first = cfg.raw_resample_before_filter and sfreq_out != sfreq_in
+    n_times_in = raw.n_times
+    picks = _get_picks(raw.info, picks, none="data_or_ica", exclude=())
+    if sfreq_out == sfreq_in:
+        n_times_out = n_times_in
+    else:
+        h, up, down = _get_polyphase_kernel(sfreq_in=sfreq_in, sfreq_out=sfreq_out)
+        n_times_out = int(round(n_times_in * up / down))
+
+    if cfg.raw_filter_block_duration is None:
+        block_size = n_times_out
+        data = np.empty((len(raw.ch_names), n_times_out))
+    else:
+        block_size = max(int(round(cfg.raw_filter_block_duration * sfreq_out)), 1)
+        msg = f"Processing {run_type} data in blocks of {block_size / sfreq_out:.1f} s"
+        logger.info(**gen_log_kwargs(message=msg))
+        # The mapping stays valid after the (anonymous) file is closed
+        with tempfile.TemporaryFile(dir=tmp_dir) as fid:
+            data = np.memmap(
+                fid, dtype=np.float64, mode="w+", shape=(len(raw.ch_names), n_times_out)
+            )
+
+    info = raw.info.copy()
+    _update_filter_info(cfg=cfg, info=info, picks=picks)
+    first_samp = raw.first_samp
+    if sfreq_out != sfreq_in:
+        first_samp = int(round(first_samp * sfreq_out / sfreq_in))
+        lowpass = np.inf if info["lowpass"] is None else info["lowpass"]
+        with info._unlock():
+            info["lowpass"] = min(lowpass, sfreq_out / 2.0)
+            info["sfreq"] = float(sfreq_out)
+    raw_out = mne.io.RawArray(data, info, first_samp=first_samp, verbose=False)
+    annotations = raw.annotations.copy()
+    if annotations.orig_time is None:
+        # These onsets include the first time, but set_annotations() adds it
+        annotations.onset -= raw_out.first_time
+    raw_out.set_annotations(annotations)
+
+    def read_raw(start: int, stop: int) -> np.ndarray:
+        return raw.get_data(start=start, stop=stop)
+
+    if sfreq_out == sfreq_in or not resample_first:
+        read_block = functools.partial(
+            _read_fir_filtered,
+            read_raw,
+            kernels=_get_fir_kernels(cfg=cfg, sfreq=sfreq_in),
+            picks=picks,
+            segments=_get_segments(raw),
+            n_times=n_times_in,
+        )
+    if sfreq_out != sfreq_in:
+        msg = f"Resampling {run_type} data to {sfreq_out:.1f} Hz (polyphase)"
+        logger.info(**gen_log_kwargs(message=msg))
+        read_block = functools.partial(
+            _read_resampled,
+            read_raw if resample_first else read_block,
+            h=h,
+            up=up,
+            down=down,
+            n_times=n_times_in,
+        )
+    if resample_first:
+        read_block = functools.partial(
+            _read_fir_filtered,
+            read_block,
+            kernels=_get_fir_kernels(cfg=cfg, sfreq=sfreq_out),
+            picks=picks,
+            segments=_get_segments(raw_out),
+            n_times=n_times_out,
+        )
+
+    for start in range(0, n_times_out, block_size):
+        stop = min(start + block_size, n_times_out)
+        data[:, start:stop] = read_block(start, stop)
+    if sfreq_out != sfreq_in:
+        stim_picks = mne.pick_types(raw.info, meg=False, stim=True, exclude=())
+        if len(stim_picks):
+            data[stim_picks] = mne.filter._resample_stim_channels(
+                raw.get_data(stim_picks), n_times_out, n_times_in
+            )
+    return raw_out
+
+
+def _filter_resample(
+    *,
+    cfg: SimpleNamespace,
+    raw: mne.io.BaseRaw,
+    subject: str,
+    session: str | None,
+    run: str,
+    task: str | None,
+    picks: np.ndarray | None,
+    run_type: Literal["experimental", "empty-room", "resting-state"],
+    tmp_dir: pathlib.Path,
+) -> mne.io.BaseRaw:
+    """Notch filter, band-pass filter, and resample the data as configured."""
+    use_private_api = _have_mne_filter_private_api()
+    if not use_private_api and (
+        cfg.raw_filter_block_duration is not None or cfg.raw_filter_single_pass
+    ):
+        msg = (
+            "The installed MNE-Python version is not compatible with "
+            "raw_filter_block_duration and raw_filter_single_pass, filtering "
+            "the data using raw.filter() instead."
+        )
+        logger.warning(**gen_log_kwargs(message=msg))
+
+    if use_private_api and (
+        cfg.raw_filter_block_duration is not None
+        or (cfg.raw_resample_sfreq and cfg.raw_resample_method == "polyphase")
+    ):
+        # Polyphase resampling and block-wise processing
+        raw = _filter_resample_blocks(
+            cfg=cfg,
+            raw=raw,
+            sfreq=cfg.raw_resample_sfreq,
+            picks=picks,
+            run_type=run_type,
+            tmp_dir=tmp_dir,
+        )
+    else:
+        raw.load_data()
+        if cfg.raw_resample_before_filter:
+            resample(
+                raw=raw,
+                subject=subject,
+                session=session,
+                run=run,
+                task=task,
+                sfreq=cfg.raw_resample_sfreq,
+                run_type=run_type,
+                method=cfg.raw_resample_method,
+            )
+        if use_private_api and cfg.raw_filter_single_pass:
+            msg = f"Filtering {run_type} data in a single pass"
+            logger.info(**gen_log_kwargs(message=msg))
+            _fir_filter_inplace(cfg=cfg, raw=raw, picks=picks)
+        else:
+            notch_freq, notch_widths = cfg.notch_freq, cfg.notch_widths
+            if cfg.raw_resample_before_filter:
+                notch_freq, notch_widths = _get_notch_freqs(
+                    cfg=cfg, sfreq=raw.info["sfreq"]
+                )
+            notch_filter(
+                raw=raw,
+                subject=subject,
+                session=session,
+                run=run,
+                task=task,
+                freqs=notch_freq,
+                trans_bandwidth=cfg.notch_trans_bandwidth,
+                notch_widths=notch_widths,
+                run_type=run_type,
+                picks=picks,
+            )
+            bandpass_filter(
+                raw=raw,
+                subject=subject,
+                session=session,
+                run=run,
+                task=task,
+                h_freq=cfg.h_freq,
+                l_freq=cfg.l_freq,
+                h_trans_bandwidth=cfg.h_trans_bandwidth,
+                l_trans_bandwidth=cfg.l_trans_bandwidth,
+                run_type=run_type,
+                picks=picks,
+            )
+        if not cfg.raw_resample_before_filter:
+            resample(
+                raw=raw,
+                subject=subject,
+                session=session,
+                run=run,
+                task=task,
+                sfreq=cfg.raw_resample_sfreq,
+                run_type=run_type,
+                method=cfg.raw_resample_method,
+            )
+    return raw
 
 
 @failsafe_run(
@@ -190,11 +666,12 @@ def filter_data(
             data_is_rest=data_is_rest,
         )
 
+    fuse_regression = cfg.fuse_raw_processing and cfg.regress_artifact is not None
     out_files[in_key] = bids_path_in.copy().update(
         root=cfg.deriv_root,
         subject=subject,  # save under subject's directory so all files are there
         session=session,
-        processing="filt",
+        processing="regress" if fuse_regression else "filt",
         extension=".fif",
         suffix="raw",
         split=None,
@@ -208,52 +685,32 @@ def filter_data(
     else:
         # Need to figure out the correct picks to use
         model = EOGRegression(**cfg.regress_artifact)
-        picks_regress = _picks_to_idx(
+        picks_regress = _get_picks(
             raw.info, model.picks, none="data", exclude=model.exclude
         )
-        picks_artifact = _picks_to_idx(raw.info, model.picks_artifact)
-        picks_data = _picks_to_idx(raw.info, "data", exclude=())  # raw.filter default
+        picks_artifact = _get_picks(raw.info, model.picks_artifact)
+        picks_data = _get_picks(raw.info, "data", exclude=())  # raw.filter default
         picks = np.unique(np.r_[picks_regress, picks_artifact, picks_data])
 
-    raw.load_data()
-    notch_filter(
+    # For example, might need to create
+    # derivatives/mne-bids-pipeline/sub-emptyroom/ses-20230412/meg
+    out_files[in_key].fpath.parent.mkdir(exist_ok=True, parents=True)
+    raw = _filter_resample(
+        cfg=cfg,
         raw=raw,
         subject=subject,
         session=session,
         run=run,
         task=task,
-        freqs=cfg.notch_freq,
-        trans_bandwidth=cfg.notch_trans_bandwidth,
-        notch_widths=cfg.notch_widths,
-        run_type=run_type,
         picks=picks,
-    )
-    bandpass_filter(
-        raw=raw,
-        subject=subject,
-        session=session,
-        run=run,
-        task=task,
-        h_freq=cfg.h_freq,
-        l_freq=cfg.l_freq,
-        h_trans_bandwidth=cfg.h_trans_bandwidth,
-        l_trans_bandwidth=cfg.l_trans_bandwidth,
-        run_type=run_type,
-        picks=picks,
-    )
-    resample(
-        raw=raw,
-        subject=subject,
-        session=session,
-        run=run,
-        task=task,
-        sfreq=cfg.raw_resample_sfreq,
         run_type=run_type,
+        tmp_dir=out_files[in_key].fpath.parent,
     )
+    if fuse_regression:
+        msg = f"Regressing out artifacts from {run_type} data"
+        logger.info(**gen_log_kwargs(message=msg))
+        model, ch_types = _regress_artifact(cfg=cfg, raw=raw)
 
-    # For example, might need to create
-    # derivatives/mne-bids-pipeline/sub-emptyroom/ses-20230412/meg
-    out_files[in_key].fpath.parent.mkdir(exist_ok=True, parents=True)
     raw.save(
         out_files[in_key],
         overwrite=True,
@@ -261,6 +718,14 @@ def filter_data(
         split_size=cfg._raw_split_size,
     )
     _update_for_splits(out_files, in_key)
+    if fuse_regression:
+        out_files["regress"] = out_files[in_key].copy().update(
+            processing=None,
+            split=None,
+            suffix="regress",
+            extension=".h5",
+        )
+        model.save(out_files["regress"], overwrite=True)
     fmax = 1.5 * cfg.h_freq if cfg.h_freq is not None else np.inf
     if exec_params.interactive:
         # Plot raw data and power spectral density.
@@ -275,16 +740,29 @@ def filter_data(
         run=run,
         task=task,
     ) as report:
-        msg = "Adding filtered raw data to report"
-        logger.info(**gen_log_kwargs(message=msg))
-        _add_raw(
-            cfg=cfg,
-            report=report,
-            bids_path_in=out_files[in_key],
-            title="Raw (filtered)",
-            tags=("filtered",),
-            raw=raw,
-        )
+        if fuse_regression:
+            msg = "Adding filtered and regressed raw data to report"
+            logger.info(**gen_log_kwargs(message=msg))
+            _add_regression(
+                cfg=cfg,
+                report=report,
+                model=model,
+                ch_types=ch_types,
+                run=run,
+                bids_path_in=out_files[in_key],
+                raw=raw,
+            )
+        else:
+            msg = "Adding filtered raw data to report"
+            logger.info(**gen_log_kwargs(message=msg))
+            _add_raw(
+                cfg=cfg,
+                report=report,
+                bids_path_in=out_files[in_key],
+                title="Raw (filtered)",
+                tags=("filtered",),
+                raw=raw,
+            )
 
     assert len(in_files) == 0, in_files.keys()
     return _prep_out_files(exec_params=exec_params, out_files=out_files)
@@ -304,7 +782,12 @@ def get_config(
         notch_trans_bandwidth=config.notch_trans_bandwidth,
         notch_widths=config.notch_widths,
         raw_resample_sfreq=config.raw_resample_sfreq,
+        raw_resample_method=config.raw_resample_method,
+        raw_resample_before_filter=config.raw_resample_before_filter,
+        raw_filter_block_duration=config.raw_filter_block_duration,
+        raw_filter_single_pass=config.raw_filter_single_pass,
         regress_artifact=config.regress_artifact,
+        fuse_raw_processing=config.fuse_raw_processing,
         **_import_data_kwargs(config=config, subject=subject),
     )
     return cfg
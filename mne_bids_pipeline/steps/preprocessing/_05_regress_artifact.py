@@ -3,15 +3,20 @@
 from types import SimpleNamespace
 
 import mne
-from mne.io.pick import _picks_to_idx
 from mne.preprocessing import EOGRegression
+from mne_bids import BIDSPath
 
 from ..._config_utils import (
     get_runs_tasks,
     get_sessions,
     get_subjects,
 )
-from ..._import_data import _get_run_rest_noise_path, _import_data_kwargs, _read_raw_msg
+from ..._import_data import (
+    _get_picks,
+    _get_run_rest_noise_path,
+    _import_data_kwargs,
+    _read_raw_msg,
+)
 from ..._logging import gen_log_kwargs, logger
 from ..._parallel import get_parallel_backend, parallel_func
 from ..._report import _add_raw, _open_report
@@ -53,7 +58,6 @@ def run_regress_artifact(
     task: str | None,
     in_files: dict,
 ) -> dict:
-    model = EOGRegression(proj=False, **cfg.regress_artifact)
     out_files = dict()
     in_key = f"raw_task-{task}_run-{run}"
     bids_path_in = in_files.pop(in_key)
@@ -61,22 +65,13 @@ def run_regress_artifact(
     msg, _ = _read_raw_msg(bids_path_in=bids_path_in, run=run, task=task)
     logger.info(**gen_log_kwargs(message=msg))
     raw = mne.io.read_raw_fif(bids_path_in).load_data()
-    projs = raw.info["projs"]
-    raw.del_proj()
-    model.fit(raw)
-    all_types = raw.get_channel_types()
-    picks = _picks_to_idx(raw.info, model.picks, none="data", exclude=model.exclude)
-    ch_types = set(all_types[pick] for pick in picks)
-    del picks
+    model, ch_types = _regress_artifact(cfg=cfg, raw=raw)
     out_files["regress"] = bids_path_in.copy().update(
         processing=None,
         split=None,
         suffix="regress",
         extension=".h5",
     )
-    model.apply(raw, copy=False)
-    if projs:
-        raw.add_proj(projs)
     raw.save(out_files[in_key], overwrite=True, split_size=cfg._raw_split_size)
     _update_for_splits(out_files, in_key)
     model.save(out_files["regress"], overwrite=True)
@@ -93,31 +88,71 @@ def run_regress_artifact(
     ) as report:
         msg = "Adding regressed raw data to report"
         logger.info(**gen_log_kwargs(message=msg))
-        figs, captions = list(), list()
-        for kind in ("mag", "grad", "eeg"):
-            if kind not in ch_types:
-                continue
-            figs.append(model.plot(ch_type=kind))
-            captions.append(f"Run {run}: {kind}")
-        if figs:
-            report.add_figure(
-                fig=figs,
-                caption=captions,
-                title="Regression weights",
-                tags=("raw", f"run-{run}", "regression"),
-                replace=True,
-            )
-        _add_raw(
+        _add_regression(
             cfg=cfg,
             report=report,
+            model=model,
+            ch_types=ch_types,
+            run=run,
             bids_path_in=out_files[in_key],
-            title="Raw (regression)",
-            tags=("regression",),
             raw=raw,
         )
     return _prep_out_files(exec_params=exec_params, out_files=out_files)
 
 
+def _regress_artifact(
+    *,
+    cfg: SimpleNamespace,
+    raw: mne.io.BaseRaw,
+) -> tuple[EOGRegression, set[str]]:
+    """Fit the regression model and apply it to the (loaded) raw data in place."""
+    model = EOGRegression(proj=False, **cfg.regress_artifact)
+    projs = raw.info["projs"]
+    raw.del_proj()
+    model.fit(raw)
+    all_types = raw.get_channel_types()
+    picks = _get_picks(raw.info, model.picks, none="data", exclude=model.exclude)
+    ch_types = set(all_types[pick] for pick in picks)
+    model.apply(raw, copy=False)
+    if projs:
+        raw.add_proj(projs)
+    return model, ch_types
+
+
+def _add_regression(
+    *,
+    cfg: SimpleNamespace,
+    report: mne.Report,
+    model: EOGRegression,
+    ch_types: set[str],
+    run: str | None,
+    bids_path_in: BIDSPath,
+    raw: mne.io.BaseRaw,
+) -> None:
+    figs, captions = list(), list()
+    for kind in ("mag", "grad", "eeg"):
+        if kind not in ch_types:
+            continue
+        figs.append(model.plot(ch_type=kind))
+        captions.append(f"Run {run}: {kind}")
+    if figs:
+        report.add_figure(
+            fig=figs,
+            caption=captions,
+            title="Regression weights",
+            tags=("raw", f"run-{run}", "regression"),
+            replace=True,
+        )
+    _add_raw(
+        cfg=cfg,
+        report=report,
+        bids_path_in=bids_path_in,
+        title="Raw (regression)",
+        tags=("regression",),
+        raw=raw,
+    )
+
+
 def get_config(
     *,
     config: SimpleNamespace,
@@ -136,6 +171,10 @@ def main(*, config: SimpleNamespace) -> None:
         msg = "Skipping …"
         logger.info(**gen_log_kwargs(message=msg, emoji="skip"))
         return
+    if config.fuse_raw_processing:
+        msg = "Skipping, regression was applied together with the filtering …"
+        logger.info(**gen_log_kwargs(message=msg, emoji="skip"))
+        return
 
     with get_parallel_backend(config.exec_params):
         parallel, run_func = parallel_func(
@@ -12,7 +12,6 @@ the 'ica_reject' limits to remove high-amplitude non-biological artifacts
 from types import SimpleNamespace
 
 import autoreject
-import mne
 import numpy as np
 from mne.preprocessing import ICA
 from mne_bids import BIDSPath
@@ -24,7 +23,12 @@ from ..._config_utils import (
     get_sessions,
     get_subjects,
 )
-from ..._import_data import annotations_to_events, make_epochs
+from ..._import_data import (
+    _concatenate_epochs,
+    _read_raw_fif,
+    annotations_to_events,
+    make_epochs,
+)
 from ..._logging import gen_log_kwargs, logger
 from ..._parallel import get_parallel_backend, parallel_func
 from ..._reject import _get_reject
@@ -88,13 +92,15 @@ def run_ica(
 
     # Generate a unique event name -> event code mapping that can be used
     # across all runs.
-    event_name_to_code_map = annotations_to_events(raw_paths=raw_fnames)
+    event_name_to_code_map = annotations_to_events(
+        raw_paths=raw_fnames, exec_params=exec_params
+    )
 
-    epochs = None
+    epochs_runs = list()
     for idx, (run, raw_fname) in enumerate(zip(cfg.runs, raw_fnames)):
         msg = f"Processing raw data from {raw_fname.basename}"
         logger.info(**gen_log_kwargs(message=msg))
-        raw = mne.io.read_raw_fif(raw_fname, preload=True)
+        raw = _read_raw_fif(raw_fname, preload=idx == 0 and cfg.ica_l_freq is not None)
 
         # Produce high-pass filtered version of the data for ICA.
         # Sanity check – make sure we're using the correct data!
@@ -148,14 +154,13 @@ def run_ica(
         these_epochs.load_data()  # Remove reference to raw
         del raw  # free memory
 
-        if epochs is None:
-            epochs = these_epochs
-        else:
-            epochs = mne.concatenate_epochs([epochs, these_epochs], on_mismatch="warn")
-
+        epochs_runs.append(these_epochs)
         del these_epochs
     del run
 
+    epochs = _concatenate_epochs(epochs_runs)
+    del epochs_runs
+
     # Set an EEG reference
     if "eeg" in cfg.ch_types:
         projection = True if cfg.eeg_reference == "average" else False
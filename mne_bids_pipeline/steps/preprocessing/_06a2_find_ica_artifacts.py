@@ -23,6 +23,7 @@ from ..._config_utils import (
     get_sessions,
     get_subjects,
 )
+from ..._import_data import _read_raw_fif
 from ..._logging import gen_log_kwargs, logger
 from ..._parallel import get_parallel_backend, parallel_func
 from ..._report import _open_report
@@ -153,7 +154,7 @@ def find_ica_artifacts(
     ecg_ics, ecg_scores = [], []
     for ri, raw_fname in enumerate(raw_fnames):
         # Have the channels needed to make ECG epochs
-        raw = mne.io.read_raw(raw_fname, preload=False)
+        raw = _read_raw_fif(raw_fname)
         # ECG epochs
         if not (
             "ecg" in raw.get_channel_types()
@@ -213,7 +214,7 @@ def find_ica_artifacts(
     epochs_eog = None
     eog_ics = eog_scores = []
     for ri, raw_fname in enumerate(raw_fnames):
-        raw = mne.io.read_raw_fif(raw_fname, preload=True)
+        raw = _read_raw_fif(raw_fname)
         if cfg.eog_channels:
             ch_names = cfg.eog_channels
             assert all([ch_name in raw.ch_names for ch_name in ch_names])
@@ -7,10 +7,13 @@ Finally the epochs are saved to disk. For the moment, no rejection is applied.
 To save space, the epoch data can be decimated.
 """
 
+import functools
 import inspect
+from concurrent.futures import ThreadPoolExecutor
 from types import SimpleNamespace
 
 import mne
+import numpy as np
 from mne_bids import BIDSPath
 
 from ..._config_utils import (
@@ -20,9 +23,15 @@ from ..._config_utils import (
     get_sessions,
     get_subjects,
 )
-from ..._import_data import annotations_to_events, make_epochs
+from ..._import_data import (
+    _concatenate_epochs,
+    _read_event_index,
+    _read_raw_fif,
+    annotations_to_events,
+    make_epochs,
+)
 from ..._logging import gen_log_kwargs, logger
-from ..._parallel import get_parallel_backend, parallel_func
+from ..._parallel import _set_n_threads, get_parallel_backend, parallel_func
 from ..._report import _open_report
 from ..._run import (
     _prep_out_files,
@@ -87,8 +96,29 @@ def run_epochs(
 
     # Generate a unique event name -> event code mapping that can be used
     # across all runs.
+    event_name_to_code_map = None
     if not cfg.task_is_rest:
-        event_name_to_code_map = annotations_to_events(raw_paths=raw_fnames)
+        event_name_to_code_map = annotations_to_events(
+            raw_paths=raw_fnames, exec_params=exec_params
+        )
+
+    # Now, generate epochs from each individual run. Reading the data and
+    # epoching mostly releases the GIL, so runs can be processed in threads.
+    make_run_epochs = functools.partial(
+        _make_run_epochs,
+        cfg=cfg,
+        subject=subject,
+        session=session,
+        event_name_to_code_map=event_name_to_code_map,
+    )
+    n_threads = min(getattr(exec_params, "n_threads", 1), len(cfg.runs))
+    if n_threads > 1:
+        msg = f"Epoching {len(cfg.runs)} runs using {n_threads} threads"
+        logger.info(**gen_log_kwargs(message=msg))
+        with ThreadPoolExecutor(max_workers=n_threads) as ex:
+            epochs_runs = list(ex.map(make_run_epochs, cfg.runs, raw_fnames))
+    else:
+        epochs_runs = list(map(make_run_epochs, cfg.runs, raw_fnames))
 
     # Store the rank & corresponding info of the run with the smallest rank.
     # We'll later manually inject this info into concatenated epochs.
@@ -97,56 +127,8 @@ def run_epochs(
     # or performing the inverse modeling.
     smallest_rank = None
     smallest_rank_info = None
-
-    # Now, generate epochs from each individual run.
-    for idx, (run, raw_fname) in enumerate(zip(cfg.runs, raw_fnames)):
-        msg = f"Loading filtered raw data from {raw_fname.basename}"
-        logger.info(**gen_log_kwargs(message=msg))
-        raw = mne.io.read_raw_fif(raw_fname, preload=True)
-
-        # Only keep the subset of the mapping that applies to the current run
-        if cfg.task_is_rest:
-            event_id = None  # make_epochs takes care of it.
-        else:
-            event_id = event_name_to_code_map.copy()
-            for event_name in event_id.copy().keys():
-                if event_name not in raw.annotations.description:
-                    del event_id[event_name]
-
-        msg = "Creating task-related epochs …"
-        logger.info(**gen_log_kwargs(message=msg))
-        epochs = make_epochs(
-            subject=subject,
-            session=session,
-            task=cfg.task,
-            raw=raw,
-            event_id=event_id,
-            conditions=cfg.conditions,
-            tmin=cfg.epochs_tmin,
-            tmax=cfg.epochs_tmax,
-            metadata_tmin=cfg.epochs_metadata_tmin,
-            metadata_tmax=cfg.epochs_metadata_tmax,
-            metadata_keep_first=cfg.epochs_metadata_keep_first,
-            metadata_keep_last=cfg.epochs_metadata_keep_last,
-            metadata_query=cfg.epochs_metadata_query,
-            event_repeated=cfg.event_repeated,
-            epochs_decim=cfg.epochs_decim,
-            task_is_rest=cfg.task_is_rest,
-            rest_epochs_duration=cfg.rest_epochs_duration,
-            rest_epochs_overlap=cfg.rest_epochs_overlap,
-        )
-
-        epochs.load_data()  # Remove reference to raw
-        del raw  # free memory
-
-        if idx == 0:
-            epochs_all_runs = epochs
-        else:
-            epochs_all_runs = mne.concatenate_epochs(
-                [epochs_all_runs, epochs], on_mismatch="warn"
-            )
-
-        if cfg.use_maxwell_filter:
+    if cfg.use_maxwell_filter:
+        for epochs in epochs_runs:
             # Keep track of the info corresponding to the run with the smallest
             # data rank.
             new_rank = mne.compute_rank(epochs, rank="info")["meg"]
@@ -154,11 +136,10 @@ def run_epochs(
                 smallest_rank = new_rank
                 smallest_rank_info = epochs.info.copy()
 
-        del epochs, run
-
-    # Clean up namespace
-    epochs = epochs_all_runs
-    del epochs_all_runs
+    # Concatenate all runs at once instead of one by one, which would copy the
+    # data of all previous runs again for each run
+    epochs = _concatenate_epochs(epochs_runs)
+    del epochs_runs
 
     if cfg.use_maxwell_filter and cfg.noise_cov == "rest":
         raw_rest_filt = mne.io.read_raw(in_files.pop("raw_rest"))
@@ -235,7 +216,7 @@ def run_epochs(
             msg = "Adding events plot to report."
             logger.info(**gen_log_kwargs(message=msg))
             events, event_id, sfreq, first_samp = _get_events(
-                cfg=cfg, subject=subject, session=session
+                raw_fnames=raw_fnames, exec_params=exec_params
             )
             report.add_events(
                 events=events,
@@ -270,6 +251,54 @@ def run_epochs(
     return _prep_out_files(exec_params=exec_params, out_files=out_files)
 
 
+def _make_run_epochs(
+    run: str,
+    raw_fname: BIDSPath,
+    *,
+    cfg: SimpleNamespace,
+    subject: str,
+    session: str | None,
+    event_name_to_code_map: dict[str, int] | None,
+) -> mne.Epochs:
+    msg = f"Loading filtered raw data from {raw_fname.basename}"
+    logger.info(**gen_log_kwargs(message=msg))
+    raw = _read_raw_fif(raw_fname)
+
+    # Only keep the subset of the mapping that applies to the current run
+    if cfg.task_is_rest:
+        event_id = None  # make_epochs takes care of it.
+    else:
+        event_id = event_name_to_code_map.copy()
+        for event_name in event_id.copy().keys():
+            if event_name not in raw.annotations.description:
+                del event_id[event_name]
+
+    msg = "Creating task-related epochs …"
+    logger.info(**gen_log_kwargs(message=msg))
+    epochs = make_epochs(
+        subject=subject,
+        session=session,
+        task=cfg.task,
+        raw=raw,
+        event_id=event_id,
+        conditions=cfg.conditions,
+        tmin=cfg.epochs_tmin,
+        tmax=cfg.epochs_tmax,
+        metadata_tmin=cfg.epochs_metadata_tmin,
+        metadata_tmax=cfg.epochs_metadata_tmax,
+        metadata_keep_first=cfg.epochs_metadata_keep_first,
+        metadata_keep_last=cfg.epochs_metadata_keep_last,
+        metadata_query=cfg.epochs_metadata_query,
+        event_repeated=cfg.event_repeated,
+        epochs_decim=cfg.epochs_decim,
+        task_is_rest=cfg.task_is_rest,
+        rest_epochs_duration=cfg.rest_epochs_duration,
+        rest_epochs_overlap=cfg.rest_epochs_overlap,
+    )
+    epochs.load_data()  # Remove reference to raw
+    return epochs
+
+
 def _add_epochs_image_kwargs(cfg: SimpleNamespace) -> dict:
     arg_spec = inspect.getfullargspec(mne.Report.add_epochs)
     kwargs = dict()
@@ -278,35 +307,23 @@ def _add_epochs_image_kwargs(cfg: SimpleNamespace) -> dict:
     return kwargs
 
 
-# TODO: ideally we wouldn't need this anymore and could refactor the code above
-def _get_events(cfg, subject, session):
-    raws_filt = []
-    raw_fname = BIDSPath(
-        subject=subject,
-        session=session,
-        task=cfg.task,
-        acquisition=cfg.acq,
-        recording=cfg.rec,
-        space=cfg.space,
-        processing=cfg.processing,
-        suffix="raw",
-        extension=".fif",
-        datatype=cfg.datatype,
-        root=cfg.deriv_root,
-        check=False,
-    )
-
-    for run in cfg.runs:
-        this_raw_fname = raw_fname.copy().update(run=run)
-        this_raw_fname = _update_for_splits(this_raw_fname, None, single=True)
-        raw_filt = mne.io.read_raw_fif(this_raw_fname)
-        raws_filt.append(raw_filt)
-        del this_raw_fname
-
-    # Concatenate the filtered raws and extract the events.
-    raw_filt_concat = mne.concatenate_raws(raws_filt, on_mismatch="warn")
-    events, event_id = mne.events_from_annotations(raw=raw_filt_concat)
-    return (events, event_id, raw_filt_concat.info["sfreq"], raw_filt_concat.first_samp)
+def _get_events(
+    *, raw_fnames: list[BIDSPath], exec_params: SimpleNamespace
+) -> tuple[np.ndarray, dict[str, int], float, int]:
+    """Get the events of the runs as if they had been concatenated."""
+    event_id = annotations_to_events(raw_paths=raw_fnames, exec_params=exec_params)
+    index = _read_event_index(raw_paths=raw_fnames, exec_params=exec_params)
+    first_samp = offset = index[0]["first_samp"]
+    events = list()
+    for entry in index:
+        these_events = np.zeros((len(entry["samples"]), 3), int)
+        these_events[:, 0] = np.array(entry["samples"], int) - entry["first_samp"]
+        these_events[:, 0] += offset
+        these_events[:, 2] = [event_id[name] for name in entry["names"]]
+        events.append(these_events)
+        offset += entry["n_times"]
+    events = np.concatenate(events)
+    return events, event_id, index[0]["sfreq"], first_samp
 
 
 def get_config(
@@ -343,6 +360,15 @@ def get_config(
 
 def main(*, config) -> None:
     """Run epochs."""
+    subjects_sessions = [
+        (subject, session)
+        for subject in get_subjects(config)
+        for session in get_sessions(config)
+    ]
+    # Cores not needed for the subjects are used to epoch runs in parallel
+    exec_params = _set_n_threads(
+        exec_params=config.exec_params, n_tasks=len(subjects_sessions)
+    )
     with get_parallel_backend(config.exec_params):
         parallel, run_func = parallel_func(run_epochs, exec_params=config.exec_params)
         logs = parallel(
@@ -351,11 +377,10 @@ def main(*, config) -> None:
                     config=config,
                     subject=subject,
                 ),
-                exec_params=config.exec_params,
+                exec_params=exec_params,
                 subject=subject,
                 session=session,
             )
-            for subject in get_subjects(config)
-            for session in get_sessions(config)
+            for subject, session in subjects_sessions
         )
     save_logs(config=config, logs=logs)
@@ -17,7 +17,11 @@ from ..._config_utils import (
     get_sessions,
     get_subjects,
 )
-from ..._import_data import _get_run_rest_noise_path, _import_data_kwargs
+from ..._import_data import (
+    _get_run_rest_noise_path,
+    _import_data_kwargs,
+    _read_raw_fif,
+)
 from ..._logging import gen_log_kwargs, logger
 from ..._parallel import get_parallel_backend, parallel_func
 from ..._report import _add_raw, _open_report
@@ -96,7 +100,8 @@ def get_input_fnames_apply_ica_raw(
         session=session,
         run=run,
         task=task,
-        kind="filt",
+        # Without fusion, the unregressed data are used here
+        kind=cfg.processing if cfg.fuse_raw_processing else "filt",
         mf_reference_run=cfg.mf_reference_run,
     )
     assert len(in_files)
@@ -209,7 +214,7 @@ def apply_ica_raw(
     out_files[in_key] = raw_fname.copy().update(processing="clean", split=None)
     msg = f"Writing {out_files[in_key].basename} …"
     logger.info(**gen_log_kwargs(message=msg))
-    raw = mne.io.read_raw_fif(raw_fname, preload=True)
+    raw = _read_raw_fif(raw_fname, preload=True)
     ica.apply(raw)
     raw.save(out_files[in_key], overwrite=True, split_size=cfg._raw_split_size)
     _update_for_splits(out_files, in_key)
@@ -244,6 +249,7 @@ def get_config(
         baseline=config.baseline,
         ica_reject=config.ica_reject,
         processing="filt" if config.regress_artifact is None else "regress",
+        fuse_raw_processing=config.fuse_raw_processing,
         _epochs_split_size=config._epochs_split_size,
         **_import_data_kwargs(config=config, subject=subject),
     )
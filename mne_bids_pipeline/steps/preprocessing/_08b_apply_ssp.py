@@ -87,7 +87,8 @@ def get_input_fnames_apply_ssp_raw(
         session=session,
         run=run,
         task=task,
-        kind="filt",
+        # Without fusion, the unregressed data are used here
+        kind=cfg.processing if cfg.fuse_raw_processing else "filt",
         mf_reference_run=cfg.mf_reference_run,
     )
     assert len(in_files)
@@ -150,6 +151,7 @@ def get_config(
 ) -> SimpleNamespace:
     cfg = SimpleNamespace(
         processing="filt" if config.regress_artifact is None else "regress",
+        fuse_raw_processing=config.fuse_raw_processing,
         _epochs_split_size=config._epochs_split_size,
         **_import_data_kwargs(config=config, subject=subject),
     )
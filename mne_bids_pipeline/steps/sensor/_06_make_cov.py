@@ -17,6 +17,7 @@ from ..._config_utils import (
     get_sessions,
     get_subjects,
 )
+from ..._import_data import _read_raw_fif
 from ..._logging import gen_log_kwargs, logger
 from ..._parallel import get_parallel_backend, parallel_func
 from ..._report import _all_conditions, _open_report, _sanitize_cond_tag
@@ -140,7 +141,7 @@ def compute_cov_from_raw(
     msg = f'Output: {out_files["cov"].basename}'
     logger.info(**gen_log_kwargs(message=msg))
 
-    raw_noise = mne.io.read_raw_fif(fname_raw, preload=True)
+    raw_noise = _read_raw_fif(fname_raw)
     cov = mne.compute_raw_covariance(raw_noise, method="shrunk", rank="info")
     return cov
 
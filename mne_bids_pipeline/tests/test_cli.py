@@ -1,9 +1,14 @@
 """Test some CLI options."""
 
 import importlib
+import json
+import os
+import pathlib
 import sys
+import time
 
 import pytest
+from joblib import Memory
 
 from mne_bids_pipeline._main import main
 
@@ -21,3 +26,45 @@ def test_config_generation(tmp_path, monkeypatch):
     spec = importlib.util.spec_from_file_location(cfg_path)
     varnames = [v for v in dir(spec) if not v.startswith("__")]
     assert varnames == []
+
+
+def _square(x):
+    return x**2
+
+
+def _cube(x):
+    return x**3
+
+
+def test_cache_gc(tmp_path, monkeypatch, capsys):
+    """Test cleaning up the cache."""
+    bids_root = tmp_path / "bids"
+    bids_root.mkdir()
+    cache_root = bids_root / "derivatives" / "mne-bids-pipeline" / "_cache"
+    memory = Memory(cache_root, verbose=0)
+    for func in (_square, _cube):
+        for x in range(3):
+            memory.cache(func)(x)
+    items = memory.store_backend.get_items()
+    assert len(items) == 6
+    for item in items:
+        # Make the entries for larger x less recently used
+        metadata = json.loads((pathlib.Path(item.path) / "metadata.json").read_text())
+        x = int(metadata["input_args"]["x"])
+        atime = time.time() - 86400 * (x + 1)
+        os.utime(pathlib.Path(item.path) / "output.pkl", (atime, atime))
+    cfg_path = tmp_path / "config.py"
+    cfg_path.write_text(
+        f"bids_root = {repr(str(bids_root))}\n"
+        'ch_types = ["meg"]\n'
+        'conditions = ["a"]\n'
+        "memory_max_size = 1\n"
+    )
+    monkeypatch.setattr(sys, "argv", ["mne_bids_pipeline", "--cache-gc", str(cfg_path)])
+    main()
+    out = capsys.readouterr().out
+    assert "from 4 cache entries, 2 entries" in out
+    # The most recently used entry of each function is kept
+    assert memory.cache(_square).check_call_in_cache(0)
+    assert memory.cache(_cube).check_call_in_cache(0)
+    assert not memory.cache(_square).check_call_in_cache(1)
@@ -0,0 +1,115 @@
+"""Test the config utilities."""
+
+import os
+from types import SimpleNamespace
+
+import mne_bids
+import pytest
+
+from mne_bids_pipeline._config_utils import (
+    _BIDS_INDEX_ENV,
+    _get_bids_index,
+    _get_entity_vals_cached,
+    _get_mf_bids_fpaths,
+    _share_bids_index,
+    get_mf_cal_fname,
+    get_mf_ctc_fname,
+)
+
+
+@pytest.fixture()
+def bids_root(tmp_path):
+    """Create a BIDS dataset with empty files."""
+    root = tmp_path / "bids"
+    fnames = [
+        "participants.tsv",
+        "task-rest_meg.json",
+        "sub-01/sub-01_scans.tsv",
+        "sub-01/ses-a/meg/sub-01_ses-a_task-aud_run-01_meg.fif",
+        "sub-01/ses-a/meg/sub-01_ses-a_task-aud_run-02_meg.fif",
+        "sub-01/ses-b/meg/sub-01_ses-b_task-rest_meg.fif",
+        "sub-01/ses-b/eeg/sub-01_ses-b_task-vis_run-03_eeg.fif",
+        "sub-02/ses-a/meg/sub-02_ses-a_task-aud_run-05_meg.fif",
+        "sub-02/ses-a/meg/sub-02_ses-a_task-aud_run-05_channels.tsv",
+        "sub-02/derivatives/sub-02_ses-a_task-aud_run-06_meg.fif",
+        "sub-02/.hidden/sub-02_ses-a_task-aud_run-07_meg.fif",
+        "sub-emptyroom/ses-20200101/meg/sub-emptyroom_ses-20200101_task-noise_meg.fif",
+        "derivatives/sub-03/sub-03_ses-c_task-x_run-08_meg.fif",
+        "sourcedata/sub-04/sub-04_task-y_meg.fif",
+    ]
+    for fname in fnames:
+        (root / fname).parent.mkdir(parents=True, exist_ok=True)
+        (root / fname).touch()
+    _get_bids_index.cache_clear()
+    _get_entity_vals_cached.cache_clear()
+    yield root
+    _get_bids_index.cache_clear()
+    _get_entity_vals_cached.cache_clear()
+
+
+@pytest.mark.parametrize("ignore_datatypes", [(), ("eeg",)])
+@pytest.mark.parametrize("entity_key", ["subject", "session", "task", "run"])
+def test_entity_vals(bids_root, entity_key, ignore_datatypes):
+    """Test that the entity values from the index match MNE-BIDS."""
+    got = _get_entity_vals_cached(
+        bids_root, entity_key=entity_key, ignore_datatypes=ignore_datatypes
+    )
+    want = mne_bids.get_entity_vals(
+        bids_root, entity_key=entity_key, ignore_datatypes=ignore_datatypes
+    )
+    assert got == want
+    for subject in ("01", "02"):
+        got = _get_entity_vals_cached(
+            bids_root,
+            entity_key=entity_key,
+            ignore_datatypes=ignore_datatypes,
+            subject=subject,
+        )
+        want = mne_bids.get_entity_vals(
+            bids_root / f"sub-{subject}",
+            entity_key=entity_key,
+            ignore_datatypes=ignore_datatypes,
+        )
+        assert got == want
+
+
+def test_share_bids_index(bids_root, monkeypatch):
+    """Test that workers use the BIDS index of the main process."""
+    monkeypatch.delenv(_BIDS_INDEX_ENV, raising=False)
+    _share_bids_index(bids_root)
+    fname = os.environ[_BIDS_INDEX_ENV]
+    want = _get_bids_index(bids_root)
+    # A worker does not walk the dataset, so new files are not seen
+    _get_bids_index.cache_clear()
+    (bids_root / "sub-05").mkdir()
+    (bids_root / "sub-05" / "sub-05_scans.tsv").touch()
+    assert _get_bids_index(bids_root) == want
+    # Other datasets are walked as usual
+    other_root = bids_root.parent / "other"
+    (other_root / "sub-06").mkdir(parents=True)
+    (other_root / "sub-06" / "sub-06_scans.tsv").touch()
+    assert list(_get_bids_index(other_root)) == ["", "sub-06"]
+    os.remove(fname)
+
+
+def test_mf_bids_fpaths(tmp_path):
+    """Test looking up the fine-calibration and cross-talk files once."""
+    meg_dir = tmp_path / "sub-01" / "ses-a" / "meg"
+    meg_dir.mkdir(parents=True)
+    for run in ("01", "02"):
+        (meg_dir / f"sub-01_ses-a_task-aud_run-{run}_meg.fif").touch()
+    cal_fname = meg_dir / "sub-01_ses-a_acq-calibration_meg.dat"
+    ctc_fname = meg_dir / "sub-01_ses-a_acq-crosstalk_meg.fif"
+    cal_fname.touch()
+    ctc_fname.touch()
+    config = SimpleNamespace(bids_root=tmp_path, mf_cal_fname=None, mf_ctc_fname=None)
+    _get_mf_bids_fpaths.cache_clear()
+    kwargs = dict(config=config, subject="01", session="a")
+    assert get_mf_cal_fname(**kwargs) == cal_fname
+    assert get_mf_ctc_fname(**kwargs) == ctc_fname
+    # The session directory is not searched again
+    os.remove(ctc_fname)
+    assert get_mf_ctc_fname(**kwargs) == ctc_fname
+    _get_mf_bids_fpaths.cache_clear()
+    with pytest.raises(ValueError, match="cross-talk"):
+        get_mf_ctc_fname(**kwargs)
@@ -0,0 +1,131 @@
+"""Test the creation of epochs."""
+
+import os
+import time
+from types import SimpleNamespace
+
+import mne
+import numpy as np
+import pandas as pd
+import pytest
+from mne_bids import BIDSPath
+
+from mne_bids_pipeline import _import_data
+from mne_bids_pipeline._import_data import (
+    _concatenate_epochs,
+    _read_event_index,
+    annotations_to_events,
+)
+from mne_bids_pipeline.steps.preprocessing._07_make_epochs import _get_events
+
+
+def _make_epochs_runs(*, n_runs: int) -> list[mne.Epochs]:
+    rng = np.random.default_rng(0)
+    info = mne.create_info(32, 500.0, "eeg")
+    epochs_runs = list()
+    for run in range(n_runs):
+        raw = mne.io.RawArray(rng.standard_normal((32, 20_000)), info, verbose=False)
+        events = np.zeros((50, 3), int)
+        events[:, 0] = np.arange(50) * 350 + 200
+        events[:, 2] = rng.choice([1, 2], 50)
+        metadata = pd.DataFrame(dict(run=[run] * 50))
+        epochs = mne.Epochs(
+            raw,
+            events,
+            dict(a=1, b=2),
+            tmin=-0.2,
+            tmax=0.5,
+            baseline=None,
+            metadata=metadata,
+            preload=True,
+            verbose=False,
+        )
+        # Some dropped epochs
+        epochs.drop(rng.choice(50, 5, replace=False), verbose=False)
+        epochs_runs.append(epochs)
+    return epochs_runs
+
+
+@pytest.mark.parametrize("private_api", [True, False])
+def test_concatenate_epochs(monkeypatch, private_api):
+    """Test concatenating the epochs of many runs."""
+    if not private_api:
+        monkeypatch.setattr(_import_data, "_get_mne_private_func", lambda *args: None)
+    want = mne.concatenate_epochs(_make_epochs_runs(n_runs=12), verbose=False)
+    epochs_runs = _make_epochs_runs(n_runs=12)
+    got = _concatenate_epochs(epochs_runs)
+    # The runs are released as their data are copied
+    assert epochs_runs == []
+    np.testing.assert_array_equal(got.get_data(), want.get_data())
+    np.testing.assert_array_equal(got.events, want.events)
+    np.testing.assert_array_equal(got.selection, want.selection)
+    assert got.drop_log == want.drop_log
+    assert got.event_id == want.event_id
+    pd.testing.assert_frame_equal(got.metadata, want.metadata)
+    # A single run is returned as is
+    epochs_runs = _make_epochs_runs(n_runs=1)
+    epochs = epochs_runs[0]
+    assert _concatenate_epochs(epochs_runs) is epochs
+
+
+@pytest.mark.parametrize("memory_location", [True, False])
+def test_event_index(tmp_path, monkeypatch, memory_location):
+    """Test getting the events of all runs from the event index."""
+    rng = np.random.default_rng(0)
+    info = mne.create_info(2, 100.0, "eeg")
+    raw_fnames = list()
+    raws = list()
+    for run, first_samp in zip(("01", "02", "03"), (0, 1234, 50)):
+        raw = mne.io.RawArray(
+            np.zeros((2, 3000)), info, first_samp=first_samp, verbose=False
+        )
+        onset = np.sort(rng.uniform(0, 29, 10))
+        description = rng.choice(["a/x", "a/y", "b", "BAD_blink"], 10)
+        if run == "02":
+            description[description == "b"] = "c"
+        raw.set_annotations(mne.Annotations(onset, 0.1, description))
+        raw_fname = BIDSPath(
+            subject="01",
+            task="t",
+            run=run,
+            suffix="raw",
+            extension=".fif",
+            datatype="eeg",
+            root=tmp_path / "derivatives",
+            check=False,
+        )
+        raw_fname.mkdir()
+        raw.save(raw_fname, verbose=False)
+        # Only files that were not just modified are stored in the index
+        mtime = time.time() - 10
+        os.utime(raw_fname.fpath, (mtime, mtime))
+        raw_fnames.append(raw_fname)
+        raws.append(raw)
+    exec_params = SimpleNamespace(
+        memory_location=memory_location,
+        deriv_root=tmp_path / "derivatives",
+        memory_subdir="joblib",
+    )
+    raw_concat = mne.concatenate_raws(raws)
+    want_events, want_event_id = mne.events_from_annotations(raw_concat)
+    event_id = annotations_to_events(raw_paths=raw_fnames, exec_params=exec_params)
+    assert event_id == want_event_id
+    events, event_id, sfreq, first_samp = _get_events(
+        raw_fnames=raw_fnames, exec_params=exec_params
+    )
+    np.testing.assert_array_equal(events, want_events)
+    assert event_id == want_event_id
+    assert sfreq == raw_concat.info["sfreq"]
+    assert first_samp == raw_concat.first_samp
+    index_fname = tmp_path / "derivatives" / "joblib" / "event_index" / "sub-01.json"
+    assert index_fname.exists() == memory_location
+    if not memory_location:
+        return
+    # Now the files are not read anymore
+    monkeypatch.setattr(mne.io, "read_raw_fif", None)
+    index = _read_event_index(raw_paths=raw_fnames, exec_params=exec_params)
+    assert [entry["first_samp"] for entry in index] == [0, 1234, 50]
+    # Unless they changed
+    raws[0].save(raw_fnames[0], overwrite=True, verbose=False)
+    with pytest.raises(TypeError, match="not callable"):
+        _read_event_index(raw_paths=raw_fnames, exec_params=exec_params)
@@ -0,0 +1,332 @@
+"""Test the filtering of the raw data."""
+
+from types import SimpleNamespace
+
+import mne
+import numpy as np
+import pytest
+
+from mne_bids_pipeline import _import_data
+from mne_bids_pipeline._import_data import _get_picks, _get_segments
+from mne_bids_pipeline.steps.preprocessing import _04_frequency_filter
+from mne_bids_pipeline.steps.preprocessing._04_frequency_filter import (
+    _filter_resample,
+    _filter_resample_blocks,
+    _fir_filter_inplace,
+)
+from mne_bids_pipeline.steps.preprocessing._05_regress_artifact import (
+    _regress_artifact,
+)
+
+
+def _make_raw(*, sfreq: float, n_times: int) -> mne.io.RawArray:
+    rng = np.random.default_rng(0)
+    info = mne.create_info(
+        ["EEG 001", "EEG 002", "EOG 001", "STI 014"],
+        sfreq,
+        ["eeg", "eeg", "eog", "stim"],
+    )
+    data = rng.standard_normal((4, n_times)) * 1e-5
+    times = np.arange(n_times) / sfreq
+    data[:2] += 1e-5 * np.sin(2 * np.pi * 50 * times)  # line noise
+    data[:2] += 1e-4 * times  # drift
+    data[3] = 0
+    data[3, ::500] = 1
+    raw = mne.io.RawArray(data, info, first_samp=100, verbose=False)
+    # Segments that are filtered separately
+    raw.annotations.append(onset=6.0, duration=0.5, description="bad_acq_skip")
+    return raw
+
+
+@pytest.mark.parametrize("raw_resample_sfreq", [None, 250.0])
+@pytest.mark.parametrize("block_duration", [0.3, 2.5, 100.0])
+def test_filter_resample_blocks(tmp_path, raw_resample_sfreq, block_duration):
+    """Test that filtering in blocks matches filtering all data at once."""
+    cfg = SimpleNamespace(
+        l_freq=1.0,
+        h_freq=40.0,
+        l_trans_bandwidth="auto",
+        h_trans_bandwidth="auto",
+        notch_freq=[50.0, 100.0, 150.0],
+        notch_trans_bandwidth=1.0,
+        notch_widths=None,
+        raw_resample_sfreq=raw_resample_sfreq,
+        raw_resample_method="polyphase",
+        raw_resample_before_filter=False,
+        raw_filter_block_duration=block_duration,
+        raw_filter_single_pass=False,
+    )
+    # raw.resample() derives the polyphase ratio from the number of samples, so
+    # use a multiple of the decimation factor to get the same filter
+    raw = _make_raw(sfreq=1000.0, n_times=10_000)
+    want = raw.copy()
+    want.notch_filter(cfg.notch_freq, verbose="error")
+    want.filter(cfg.l_freq, cfg.h_freq, verbose="error")
+    if raw_resample_sfreq is not None:
+        want.resample(raw_resample_sfreq, method="polyphase", verbose="error")
+    got = _filter_resample_blocks(
+        cfg=cfg,
+        raw=raw,
+        sfreq=cfg.raw_resample_sfreq,
+        picks=None,
+        run_type="experimental",
+        tmp_dir=tmp_path,
+    )
+    assert got.info["sfreq"] == want.info["sfreq"]
+    assert got.info["lowpass"] == want.info["lowpass"]
+    assert got.info["highpass"] == want.info["highpass"]
+    assert got.first_samp == want.first_samp
+    np.testing.assert_array_equal(got.annotations.onset, want.annotations.onset)
+    np.testing.assert_allclose(
+        got.get_data(), want.get_data(), rtol=0, atol=1e-12 * np.abs(raw._data).max()
+    )
+
+
+def test_filter_resample_blocks_bad_ratio(tmp_path):
+    """Test that polyphase resampling requires a simple ratio."""
+    cfg = SimpleNamespace(
+        l_freq=None,
+        h_freq=None,
+        notch_freq=None,
+        raw_resample_sfreq=250.0,
+        raw_resample_method="polyphase",
+        raw_resample_before_filter=False,
+        raw_filter_block_duration=None,
+        raw_filter_single_pass=False,
+    )
+    raw = _make_raw(sfreq=1017.2529, n_times=1000)
+    with pytest.raises(ValueError, match="not a simple fraction"):
+        _filter_resample_blocks(
+            cfg=cfg,
+            raw=raw,
+            sfreq=cfg.raw_resample_sfreq,
+            picks=None,
+            run_type="experimental",
+            tmp_dir=tmp_path,
+        )
+
+
+@pytest.mark.parametrize(
+    "method, block_duration",
+    [("fft", None), ("polyphase", None), ("polyphase", 7.0)],
+)
+def test_resample_before_filter(tmp_path, method, block_duration):
+    """Test that resampling before filtering gives equivalent results."""
+    sfreq = 1000.0
+    times = np.arange(120_000) / sfreq
+    rng = np.random.default_rng(0)
+    signal = np.sin(2 * np.pi * 10 * times) + 0.5 * np.sin(2 * np.pi * 23 * times + 1)
+    data = np.array([signal, signal[::-1]])
+    line_freqs = np.arange(50.0, 450.0, 50.0)  # 8 harmonics
+    for freq in line_freqs:
+        data += np.sin(2 * np.pi * freq * times)
+    data += 0.1 * rng.standard_normal(data.shape)
+    info = mne.create_info(["EEG 001", "EEG 002"], sfreq, "eeg")
+    raw = mne.io.RawArray(data * 1e-5, info, verbose=False)
+    cfg = SimpleNamespace(
+        l_freq=1.0,
+        h_freq=40.0,
+        l_trans_bandwidth="auto",
+        h_trans_bandwidth="auto",
+        notch_freq=line_freqs,
+        notch_trans_bandwidth=1.0,
+        notch_widths=None,
+        raw_resample_sfreq=200.0,
+        raw_resample_method=method,
+        raw_resample_before_filter=True,
+        raw_filter_block_duration=block_duration,
+        raw_filter_single_pass=False,
+    )
+    # What the MNE methods give when filtering first
+    want = raw.copy()
+    want.notch_filter(line_freqs, verbose="error")
+    want.filter(cfg.l_freq, cfg.h_freq, verbose="error")
+    want.resample(cfg.raw_resample_sfreq, method=method, verbose="error")
+    want = want.get_data()
+    got = _filter_resample(
+        cfg=cfg,
+        raw=raw.copy(),
+        subject="01",
+        session=None,
+        run="01",
+        task=None,
+        picks=None,
+        run_type="experimental",
+        tmp_dir=tmp_path,
+    ).get_data()
+    assert got.shape == want.shape
+    # The filters are designed for different sampling frequencies and the edges
+    # are padded differently, so compare away from the edges
+    inner = slice(1000, -1000)  # 5 s
+    rel_err = np.linalg.norm(got[:, inner] - want[:, inner]) / np.linalg.norm(
+        want[:, inner]
+    )
+    assert rel_err < 1e-3
+    if method == "polyphase":
+        # Also the same as the block engine when filtering first
+        cfg.raw_resample_before_filter = False
+        want = _filter_resample_blocks(
+            cfg=cfg,
+            raw=raw,
+            sfreq=cfg.raw_resample_sfreq,
+            picks=None,
+            run_type="experimental",
+            tmp_dir=tmp_path,
+        ).get_data()
+        rel_err = np.linalg.norm(got[:, inner] - want[:, inner]) / np.linalg.norm(
+            want[:, inner]
+        )
+        assert rel_err < 1e-3
+
+
+def test_filter_single_pass(tmp_path):
+    """Test applying the notch and band-pass filters as a single filter."""
+    line_freqs = np.arange(50.0, 450.0, 50.0)  # 8 harmonics
+    cfg = SimpleNamespace(
+        l_freq=1.0,
+        h_freq=40.0,
+        l_trans_bandwidth="auto",
+        h_trans_bandwidth="auto",
+        notch_freq=line_freqs,
+        notch_trans_bandwidth=1.0,
+        notch_widths=None,
+        raw_resample_sfreq=None,
+        raw_resample_method="fft",
+        raw_resample_before_filter=False,
+        raw_filter_block_duration=None,
+        raw_filter_single_pass=True,
+    )
+    raw = _make_raw(sfreq=1000.0, n_times=30_000)
+    want = raw.copy()
+    want.notch_filter(line_freqs, verbose="error")
+    want.filter(cfg.l_freq, cfg.h_freq, verbose="error")
+    got = raw.copy()
+    data = got._data
+    _fir_filter_inplace(cfg=cfg, raw=got, picks=None)
+    assert got._data is data
+    assert got.info["highpass"] == want.info["highpass"]
+    assert got.info["lowpass"] == want.info["lowpass"]
+    # Only the padding at the segment edges differs
+    n_edge = 5_000  # half the length of the combined filter
+    segments = [(0, 6000), (6500, 30_000)]
+    atol = 1e-10 * np.abs(raw._data).max()
+    for start, stop in segments:
+        inner = slice(start + n_edge, stop - n_edge)
+        if inner.start < inner.stop:
+            np.testing.assert_allclose(
+                got.get_data()[:, inner], want.get_data()[:, inner], atol=atol
+            )
+
+
+def test_filter_resample_fallback(tmp_path, monkeypatch):
+    """Test filtering without the private MNE functions."""
+    cfg = SimpleNamespace(
+        l_freq=1.0,
+        h_freq=40.0,
+        l_trans_bandwidth="auto",
+        h_trans_bandwidth="auto",
+        notch_freq=[50.0, 100.0],
+        notch_trans_bandwidth=2.0,
+        notch_widths=None,
+        raw_resample_sfreq=250.0,
+        raw_resample_method="polyphase",
+        raw_resample_before_filter=False,
+        raw_filter_block_duration=2.0,
+        raw_filter_single_pass=True,
+    )
+    raw = _make_raw(sfreq=1000.0, n_times=10_000)
+    want = raw.copy()
+    want.notch_filter(cfg.notch_freq, trans_bandwidth=2.0, verbose="error")
+    want.filter(cfg.l_freq, cfg.h_freq, verbose="error")
+    want.resample(cfg.raw_resample_sfreq, method="polyphase", verbose="error")
+    # Pretend that a private function changed
+    monkeypatch.setitem(
+        _04_frequency_filter._MNE_FILTER_PRIVATE_API, "_smart_pad", ("y", "n_pad")
+    )
+    got = _filter_resample(
+        cfg=cfg,
+        raw=raw,
+        subject="01",
+        session=None,
+        run="01",
+        task=None,
+        picks=None,
+        run_type="experimental",
+        tmp_dir=tmp_path,
+    )
+    assert not list(tmp_path.iterdir())
+    assert got.info["sfreq"] == want.info["sfreq"]
+    np.testing.assert_allclose(got.get_data(), want.get_data())
+
+
+@pytest.mark.parametrize("meas_date", [None, 1e9])
+def test_segments_picks_fallback(monkeypatch, meas_date):
+    """Test getting the segments and picks without the private MNE functions."""
+    raws = [_make_raw(sfreq=1000.0, n_times=n_times) for n_times in (8_000, 7_000)]
+    for raw in raws:
+        raw.set_meas_date(meas_date)
+        raw.info["bads"] = ["EEG 002"]
+    raw = mne.concatenate_raws(raws)  # adds an "EDGE boundary" without duration
+    raw.annotations.append(
+        onset=raw.first_time + np.array([1.0, 1.2, 3.0, 5.0]),
+        duration=[0.5, 0.5, 0.0, 0.2],
+        description=["BAD_ACQ_SKIP", "bad_acq_skip", "edge", "bad_blink"],
+    )
+    picks = [
+        dict(picks=None, none="data_or_ica", exclude=()),
+        dict(picks=None, none="data"),
+        dict(picks="eog", none="data"),
+        dict(picks=[0, 2], none="data", exclude=()),
+    ]
+    want_segments = _get_segments(raw)
+    assert len(want_segments) == 6
+    want_picks = [_get_picks(raw.info, **kwargs) for kwargs in picks]
+    monkeypatch.setattr(_import_data, "_get_mne_private_func", lambda *args: None)
+    assert _get_segments(raw) == want_segments
+    for kwargs, want in zip(picks, want_picks):
+        np.testing.assert_array_equal(_get_picks(raw.info, **kwargs), want)
+
+
+def test_fuse_regression(tmp_path):
+    """Test regressing out artifacts together with the filtering."""
+    raw = _make_raw(sfreq=1000.0, n_times=10_000)
+    raw.set_annotations(None)  # would be zeroed when saving
+    raw.set_eeg_reference("average", verbose=False)
+    raw._data[:2] += 0.5 * raw._data[2]  # EOG artifacts
+    cfg = SimpleNamespace(
+        l_freq=1.0,
+        h_freq=40.0,
+        l_trans_bandwidth="auto",
+        h_trans_bandwidth="auto",
+        notch_freq=50.0,
+        notch_trans_bandwidth=2.0,
+        notch_widths=None,
+        raw_resample_sfreq=None,
+        raw_resample_method="fft",
+        raw_resample_before_filter=False,
+        raw_filter_block_duration=None,
+        raw_filter_single_pass=False,
+        regress_artifact=dict(picks="eeg", picks_artifact=["EOG 001"]),
+    )
+    raw = _filter_resample(
+        cfg=cfg,
+        raw=raw,
+        subject="01",
+        session=None,
+        run="01",
+        task=None,
+        picks=None,
+        run_type="experimental",
+        tmp_dir=tmp_path,
+    )
+    # Without fusing, the regression step reads back the saved filtered data
+    fname = tmp_path / "sub-01_proc-filt_raw.fif"
+    raw.save(fname)
+    want = mne.io.read_raw_fif(fname, verbose=False).load_data()
+    want_model, want_ch_types = _regress_artifact(cfg=cfg, raw=want)
+    got_model, got_ch_types = _regress_artifact(cfg=cfg, raw=raw)
+    assert got_ch_types == want_ch_types == {"eeg"}
+    np.testing.assert_allclose(got_model.coef_, want_model.coef_, rtol=1e-5)
+    picks = mne.pick_types(raw.info, eeg=True)
+    atol = 1e-6 * np.abs(want.get_data(picks)).max()
+    np.testing.assert_allclose(raw.get_data(picks), want.get_data(picks), atol=atol)
@@ -2,10 +2,29 @@
 
 import ast
 import inspect
+import os
+from types import SimpleNamespace
 
+import pandas as pd
 import pytest
+from mne_bids import BIDSPath
 
+from mne_bids_pipeline import _run
 from mne_bids_pipeline._config_utils import _get_step_modules
+from mne_bids_pipeline._main import _group_step_modules
+from mne_bids_pipeline._parallel import (
+    _run_not_skipped,
+    _set_n_threads,
+    get_max_parallel_tasks,
+)
+from mne_bids_pipeline._run import (
+    _FileHashIndex,
+    _prep_out_files,
+    _update_for_splits,
+    failsafe_run,
+    hash_file_path,
+)
+from mne_bids_pipeline._telemetry import _read_telemetry, _write_telemetry
 
 # mne_bids_pipeline.init._01_init_derivatives_dir: <module>
 FLAT_MODULES = {x.__name__: x for x in sum(_get_step_modules().values(), ())}
@@ -62,3 +81,350 @@ def test_all_functions_return(module_name):
             assert (
                 isinstance(r, ast.Call) and r.func.id == "_prep_out_files"
             ), f"Function does _prep_out_files: {what}"
+
+
+def test_step_groups():
+    """Test that group-level steps act as barriers between per-subject steps."""
+    step_modules = list(_get_step_modules()["all"])
+    step_groups = _group_step_modules(step_modules)
+    assert sum((modules for _, modules in step_groups), []) == step_modules
+    per_subject = [
+        module.__name__.split(".")[-1]
+        for this_per_subject, modules in step_groups
+        for module in modules
+        if this_per_subject
+    ]
+    assert "_01_data_quality" in per_subject
+    assert "_06_make_cov" in per_subject
+    assert "_99_group_average" not in per_subject
+    assert "_01_init_derivatives_dir" not in per_subject
+    # alternating
+    for (a, _), (b, _) in zip(step_groups[:-1], step_groups[1:]):
+        assert a != b
+
+
+def _make_exec_params(deriv_root, **kwargs):
+    exec_params = dict(
+        deriv_root=deriv_root,
+        memory_location=True,
+        memory_subdir="joblib",
+        memory_verbose=0,
+        memory_file_method="hash",
+        memory_content_store=False,
+        on_error="abort",
+    )
+    exec_params.update(kwargs)
+    return SimpleNamespace(**exec_params)
+
+
+def _get_input_fnames_copy(*, cfg, subject, **kwargs):
+    return dict(in_path=cfg.in_path)
+
+
+@failsafe_run(get_input_fnames=_get_input_fnames_copy)
+def _copy_file(*, cfg, exec_params, subject, in_files):
+    out_path = exec_params.deriv_root / f"sub-{subject}.fif"
+    out_path.write_text(in_files.pop("in_path").read_text())
+    return _prep_out_files(
+        exec_params=exec_params, out_files=dict(out_path=out_path), bids_only=False
+    )
+
+
+def test_skip_cached_tasks(tmp_path):
+    """Test that cached tasks are not dispatched."""
+    in_path = tmp_path / "in.txt"
+    in_path.write_text("data")
+    exec_params = _make_exec_params(tmp_path)
+    all_kwargs = [
+        dict(cfg=SimpleNamespace(in_path=in_path), exec_params=exec_params, subject=s)
+        for s in ("01", "02")
+    ]
+    assert _copy_file.check_skip(**all_kwargs[0]) is None
+    assert _copy_file(**all_kwargs[0])["success"]
+    assert _copy_file.check_skip(**all_kwargs[0])["success"]
+
+    dispatched = list()
+
+    def parallel(tasks):
+        out = list()
+        for func, args, kwargs in tasks:
+            dispatched.append(kwargs["subject"])
+            out.append(func(*args, **kwargs))
+        return out
+
+    tasks = [(_copy_file, (), kwargs) for kwargs in all_kwargs]
+    logs = _run_not_skipped(tasks, parallel=parallel, check_skip=_copy_file.check_skip)
+    assert dispatched == ["02"]
+    assert [log["subject"] for log in logs] == ["01", "02"]
+    assert all(log["success"] for log in logs)
+    # Changed inputs are dispatched again
+    in_path.write_text("new data")
+    dispatched.clear()
+    _run_not_skipped(tasks, parallel=parallel, check_skip=_copy_file.check_skip)
+    assert dispatched == ["01", "02"]
+
+
+@pytest.mark.parametrize("memory_file_method", ["mtime", "hash"])
+def test_content_store(tmp_path, monkeypatch, memory_file_method):
+    """Test that identical outputs share their data on disk."""
+    in_path = tmp_path / "in.txt"
+    in_path.write_text("data")
+    exec_params = _make_exec_params(
+        tmp_path, memory_file_method=memory_file_method, memory_content_store=True
+    )
+    cfg = SimpleNamespace(in_path=in_path)
+    # Remember the hashes of the new files
+    monkeypatch.setattr(_run, "_HASH_INDEX_MIN_AGE", 0.0)
+    hashed = list()
+    orig_hash_file_path = _run.hash_file_path
+    monkeypatch.setattr(
+        _run,
+        "hash_file_path",
+        lambda path: hashed.append(path.name) or orig_hash_file_path(path),
+    )
+    for subject in ("01", "02"):
+        _copy_file(cfg=cfg, exec_params=exec_params, subject=subject)
+    # Each output is only read once
+    assert sorted(name for name in hashed if name != "in.txt") == [
+        "sub-01.fif",
+        "sub-02.fif",
+    ]
+    out_1, out_2 = tmp_path / "sub-01.fif", tmp_path / "sub-02.fif"
+    assert out_1.stat().st_ino == out_2.stat().st_ino
+    assert out_1.stat().st_nlink == 3  # and the blob
+    assert out_1.stat().st_mode & 0o200  # still writable
+    # Re-running a task must not modify the outputs of the other task
+    in_path.write_text("new data")
+    _copy_file(cfg=cfg, exec_params=exec_params, subject="01")
+    assert out_1.read_text() == "new data"
+    assert out_2.read_text() == "data"
+    store = _run._get_content_store(exec_params)
+    assert store.gc() == (0, 0)
+    _copy_file(cfg=cfg, exec_params=exec_params, subject="02")
+    assert out_1.stat().st_ino == out_2.stat().st_ino
+    assert store.gc() == (1, 4)  # the old "data" blob
+    # Nor when caching is disabled
+    no_cache_exec_params = _make_exec_params(tmp_path, memory_location=False)
+    in_path.write_text("data")
+    _copy_file(cfg=cfg, exec_params=no_cache_exec_params, subject="01")
+    assert out_1.read_text() == "data"
+    assert out_2.read_text() == "new data"
+    # Blobs that do not match their name anymore are not linked to
+    blob = next(store.root.glob("??/*"))
+    blob.write_text("bad data")
+    for subject in ("03", "04"):
+        _copy_file(cfg=cfg, exec_params=exec_params, subject=subject)
+    out_3, out_4 = tmp_path / "sub-03.fif", tmp_path / "sub-04.fif"
+    assert out_3.read_text() == out_4.read_text() == "data"
+    assert out_3.stat().st_ino == out_4.stat().st_ino != out_1.stat().st_ino
+
+
+def test_file_hash_index(tmp_path, monkeypatch):
+    """Test that file hashes are reused while the file metadata is unchanged."""
+    path = tmp_path / "data.fif"
+    path.write_bytes(b"a" * 100)
+    os.utime(path, ns=(10**18, 10**18))
+    index = _FileHashIndex(tmp_path / "cache" / "file_hashes.json")
+    orig_hash = index.get_hash(path)
+    assert orig_hash == hash_file_path(path)
+    # New hashes are only written when flushing
+    assert not (tmp_path / "cache" / "file_hashes.json").exists()
+    index.flush()
+    assert (tmp_path / "cache" / "file_hashes.json").is_file()
+    # Same metadata: the stored hash is used, even by a new index instance
+    with open(path, "r+b") as fid:
+        fid.write(b"b")
+    os.utime(path, ns=(10**18, 10**18))
+    index = _FileHashIndex(tmp_path / "cache" / "file_hashes.json")
+    assert index.get_hash(path) == orig_hash
+    # Different metadata: the file is hashed again
+    os.utime(path, ns=(2 * 10**18, 2 * 10**18))
+    assert index.get_hash(path) == hash_file_path(path) != orig_hash
+
+    # The index file is read once and written once per flush
+    paths = [tmp_path / f"data_{ii}.fif" for ii in range(5)]
+    for path in paths:
+        path.write_bytes(path.name.encode())
+        os.utime(path, ns=(10**18, 10**18))
+    calls = list()
+    orig_read = index._read
+    monkeypatch.setattr(index, "_read", lambda: calls.append("read") or orig_read())
+    orig_write = _run._write_json_atomic
+    monkeypatch.setattr(
+        _run,
+        "_write_json_atomic",
+        lambda *args: calls.append("write") or orig_write(*args),
+    )
+    _run._map_threaded(index.get_hash, paths)
+    index.flush()
+    index.flush()
+    assert calls == ["read", "write"]
+    index = _FileHashIndex(tmp_path / "cache" / "file_hashes.json")
+    assert set(index._read()) == {str(path) for path in [tmp_path / "data.fif", *paths]}
+
+
+def test_file_hash_memoized(tmp_path, monkeypatch):
+    """Test that files are only hashed once per process."""
+    paths = [tmp_path / f"data_{ii}.fif" for ii in range(4)]
+    for path in paths:
+        path.write_bytes(path.name.encode())
+        os.utime(path, ns=(10**18, 10**18))
+    hashed = list()
+
+    def _hash_file_path(path):
+        hashed.append(path)
+        return hash_file_path(path)
+
+    monkeypatch.setattr(_run, "hash_file_path", _hash_file_path)
+    want = [hash_file_path(path) for path in paths]
+    for _ in range(2):
+        got = _run._map_threaded(
+            lambda path: _run._get_file_hash(path, hash_index=None), paths
+        )
+        assert got == want
+    assert sorted(hashed) == paths
+
+
+def test_update_for_splits(tmp_path, monkeypatch):
+    """Test finding split files with a single directory listing."""
+    bids_path = BIDSPath(
+        subject="01",
+        task="a",
+        run="01",
+        suffix="raw",
+        extension=".fif",
+        datatype="meg",
+        root=tmp_path,
+        check=False,
+    )
+    bids_path.mkdir()
+    for split in ("01", "02", "03"):
+        bids_path.copy().update(split=split).fpath.touch()
+    bids_path.copy().update(task="b", run=None).fpath.touch()
+    listed = list()
+    orig_listdir = os.listdir
+
+    def _listdir(path):
+        listed.append(path)
+        return orig_listdir(path)
+
+    monkeypatch.setattr(os, "listdir", _listdir)
+    files = dict(raw=bids_path.copy(), other=bids_path.copy().update(task="b"))
+    _update_for_splits(files, "raw")
+    assert list(files) == ["raw", "other", "raw_split-02", "raw_split-03"]
+    assert [files[key].split for key in files if key != "other"] == ["01", "02", "03"]
+    assert _update_for_splits(files, "other").run is None
+    assert len(listed) == 2
+    # Only the first split is needed
+    files = dict(raw=bids_path.copy())
+    _update_for_splits(files, "raw", single=True)
+    assert list(files) == ["raw"] and files["raw"].split == "01"
+    # Missing files
+    files = dict(raw=bids_path.copy().update(task="c"))
+    with pytest.raises(AssertionError, match="Missing file"):
+        _update_for_splits(files, "raw")
+    got = _update_for_splits(files, "raw", allow_missing=True)
+    assert got.split is None
+    missing_dir = bids_path.copy().update(subject="02")
+    assert _update_for_splits(missing_dir, None, allow_missing=True) == missing_dir
+    assert len(listed) == 6
+
+
+def test_plan(tmp_path, monkeypatch):
+    """Test planning which tasks would be computed."""
+    monkeypatch.setattr(_run, "_plan", SimpleNamespace(rows=[], dirty_subjects=set()))
+    in_path = tmp_path / "in.txt"
+    in_path.write_text("data")
+    exec_params = _make_exec_params(tmp_path)
+    plan_exec_params = SimpleNamespace(**vars(exec_params), plan=True)
+    cfg = SimpleNamespace(in_path=in_path)
+    _copy_file(cfg=cfg, exec_params=exec_params, subject="01")
+    for subject in ("01", "02"):
+        _copy_file(cfg=cfg, exec_params=plan_exec_params, subject=subject)
+    # Nothing was run
+    assert not (tmp_path / "sub-02.fif").exists()
+    rows = _run._plan.rows
+    assert [row["subject"] for row in rows] == ["01", "02"]
+    assert [row["result"] for row in rows] == ["hit", "miss"]
+    assert "cached" in rows[0]["reason"]
+    assert rows[0]["step"] == "tests/test_functions"
+    # Downstream tasks of subjects with changes will be computed as well
+    _copy_file(cfg=cfg, exec_params=plan_exec_params, subject="02")
+    assert rows[-1]["result"] == "miss"
+    _run._plan.dirty_subjects.add("01")
+    _copy_file(cfg=cfg, exec_params=plan_exec_params, subject="01")
+    assert rows[-1]["result"] == "miss"
+    assert "upstream" in rows[-1]["reason"]
+
+
+def test_telemetry(tmp_path):
+    """Test recording and exporting the per-task telemetry."""
+    in_path = tmp_path / "in.txt"
+    in_path.write_text("data")
+    exec_params = _make_exec_params(tmp_path, memory_file_method="mtime")
+    config = SimpleNamespace(deriv_root=tmp_path, task="a", exec_params=exec_params)
+    cfg = SimpleNamespace(in_path=in_path)
+    # Nothing to record
+    _write_telemetry(config=config, step="tests/test_functions", logs=[])
+    assert not list(tmp_path.glob("*.jsonl"))
+    # An empty log file still has all columns
+    (tmp_path / "task-a_log.jsonl").touch()
+    assert _read_telemetry(config=config).empty
+    assert "cache" in _read_telemetry(config=config).columns
+    (tmp_path / "task-a_log.jsonl").unlink()
+    for _ in range(2):
+        logs = [
+            _copy_file(cfg=cfg, exec_params=exec_params, subject=subject)
+            for subject in ("01", "02")
+        ]
+        _write_telemetry(config=config, step="tests/test_functions", logs=logs)
+    df = _read_telemetry(config=config)
+    assert len(df) == 4
+    assert list(df["cache"]) == ["computed", "computed", "hit", "hit"]
+    assert (df["peak_rss"] > 0).all()
+    assert (df["cpu_time"] >= 0).all()
+    assert "cfg" not in df.columns
+    fname = _run._export_logs(config=config)
+    sheets = pd.read_excel(fname, sheet_name=None)
+    assert set(sheets) == {"config", "tests-test_functions"}
+    # Only the most recent entry of each task
+    assert list(sheets["tests-test_functions"]["cache"]) == ["hit", "hit"]
+
+
+def test_max_parallel_tasks(tmp_path):
+    """Test limiting the number of parallel tasks to the memory budget."""
+    exec_params = SimpleNamespace(
+        deriv_root=tmp_path,
+        n_jobs=8,
+        parallel_backend="loky",
+        parallel_memory_budget="4G",
+    )
+    config = SimpleNamespace(deriv_root=tmp_path, task="a", exec_params=exec_params)
+    steps = ["tests/test_functions"]
+    # Nothing known about the step yet
+    assert get_max_parallel_tasks(exec_params=exec_params, steps=steps) == 8
+    (tmp_path / "task-a_log.jsonl").touch()
+    assert get_max_parallel_tasks(exec_params=exec_params, steps=steps) == 8
+    logs = [
+        pd.Series(dict(subject="01", peak_rss=2**30, cache="computed")),
+        pd.Series(dict(subject="02", peak_rss=2**29, cache="computed")),
+        pd.Series(dict(subject="03", peak_rss=2**32, cache="hit")),
+    ]
+    _write_telemetry(config=config, step=steps[0], logs=logs)
+    assert get_max_parallel_tasks(exec_params=exec_params, steps=steps) == 4
+    assert get_max_parallel_tasks(exec_params=exec_params, steps=["other"]) == 8
+    exec_params.parallel_memory_budget = "100M"
+    assert get_max_parallel_tasks(exec_params=exec_params, steps=steps) == 1
+    exec_params.parallel_memory_budget = None
+    assert get_max_parallel_tasks(exec_params=exec_params, steps=steps) == 8
+
+
+def test_set_n_threads():
+    """Test sharing idle cores among the tasks of a step."""
+    exec_params = SimpleNamespace(n_jobs=8)
+    assert _set_n_threads(exec_params=exec_params, n_tasks=1).n_threads == 8
+    assert _set_n_threads(exec_params=exec_params, n_tasks=3).n_threads == 2
+    assert _set_n_threads(exec_params=exec_params, n_tasks=20).n_threads == 1
+    assert not hasattr(exec_params, "n_threads")
+    exec_params.n_jobs = 1
+    assert _set_n_threads(exec_params=exec_params, n_tasks=1).n_threads == 1
@@ -0,0 +1,316 @@
+"""Test the Maxwell filtering of the raw data."""
+
+import contextlib
+from types import SimpleNamespace
+
+import mne
+import numpy as np
+import pytest
+from mne.io.constants import FIFF
+from mne_bids import BIDSPath
+
+from mne_bids_pipeline._import_data import (
+    _fit_mf_head_origin_cached,
+    _get_mf_head_origin,
+    _read_mf_calibration,
+)
+from mne_bids_pipeline.steps.preprocessing import _02_head_pos, _03_maxfilter
+from mne_bids_pipeline.steps.preprocessing._02_head_pos import (
+    _compute_chpi_amplitudes_snr,
+)
+from mne_bids_pipeline.steps.preprocessing._03_maxfilter import (
+    _maxwell_filter_chunks,
+)
+
+
+def _make_raw(*, sfreq: float, n_times: int) -> mne.io.RawArray:
+    # Point magnetometers on a hemisphere, pointing outwards
+    n_channels = 60
+    z = (np.arange(n_channels) + 0.5) / n_channels
+    phi = np.pi * (1 + np.sqrt(5)) * np.arange(n_channels)
+    r = np.sqrt(1 - z**2)
+    pos = 0.12 * np.c_[r * np.cos(phi), r * np.sin(phi), z]
+    info = mne.create_info([f"MEG{ii:04d}" for ii in range(n_channels)], sfreq, "mag")
+    for ch, ch_pos in zip(info["chs"], pos):
+        ez = ch_pos / np.linalg.norm(ch_pos)
+        ex = np.cross([0.0, 1.0, 0.0], ez)
+        ex /= np.linalg.norm(ex)
+        ch["loc"][:] = np.concatenate([ch_pos, ex, np.cross(ez, ex), ez])
+        ch["coil_type"] = FIFF.FIFFV_COIL_POINT_MAGNETOMETER
+    with info._unlock():
+        info["dev_head_t"] = mne.transforms.Transform("meg", "head")
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((n_channels, n_times)) * 1e-12
+    raw = mne.io.RawArray(data, info, first_samp=123, verbose=False)
+    # Segments that are filtered separately
+    raw.annotations.append(onset=13.0, duration=0.5, description="bad_acq_skip")
+    return raw
+
+
+def _add_chpi(raw: mne.io.BaseRaw) -> None:
+    freqs = (83.0, 143.0, 203.0, 263.0)
+    # Coils 1 and 2 are off for a while
+    stim_data = np.full((1, len(raw.times)), 15.0)
+    stim_data[0, 1000:1300] = 12.0
+    stim = mne.io.RawArray(
+        stim_data,
+        mne.create_info(["STI201"], raw.info["sfreq"], "stim"),
+        first_samp=raw.first_samp,
+        verbose=False,
+    )
+    raw.add_channels([stim], force_update_info=True)
+    with raw.info._unlock():
+        raw.info["hpi_meas"] = [
+            dict(
+                hpi_coils=[
+                    dict(number=ii + 1, coil_freq=freq) for ii, freq in enumerate(freqs)
+                ]
+            )
+        ]
+        raw.info["hpi_subsystem"] = dict(
+            event_channel="STI201",
+            hpi_coils=[dict(event_bits=np.array([2**ii])) for ii in range(len(freqs))],
+        )
+        raw.info["line_freq"] = 50.0
+    rng = np.random.default_rng(2)
+    picks = mne.pick_types(raw.info, meg=True)
+    amplitudes = rng.standard_normal((len(freqs), len(picks))) * 1e-11
+    phases = 2 * np.pi * rng.random(len(freqs))
+    # Large offsets, as in data that are not high-pass filtered
+    raw._data[picks] += rng.standard_normal((len(picks), 1)) * 1e-9
+    for amplitude, freq, phase in zip(amplitudes, freqs, phases):
+        raw._data[picks] += np.outer(
+            amplitude, np.sin(2 * np.pi * freq * raw.times + phase)
+        )
+
+
+def _make_head_pos(raw: mne.io.BaseRaw) -> np.ndarray:
+    times = raw.first_time + np.arange(0.35, raw.times[-1], 0.7)
+    head_pos = np.zeros((len(times), 10))
+    head_pos[:, 0] = times
+    head_pos[:, 4:7] = np.random.default_rng(1).normal(0, 0.002, (len(times), 3))
+    head_pos[:, 7] = 0.99  # goodness of fit
+    return head_pos
+
+
+@pytest.mark.parametrize(
+    "st_duration, mc, chunk_duration, n_threads",
+    [
+        (None, False, 3.0, 1),
+        (None, True, 7.1, 2),
+        (2.0, False, 7.1, 2),
+        (2.0, True, 3.0, 1),
+    ],
+)
+def test_maxwell_filter_chunks(st_duration, mc, chunk_duration, n_threads):
+    """Test that Maxwell filtering in chunks matches filtering all data at once."""
+    raw = _make_raw(sfreq=200.0, n_times=6000)
+    mf_kws = dict(
+        origin=(0.0, 0.0, 0.04),
+        int_order=5,
+        st_duration=st_duration,
+        coord_frame="head",
+        head_pos=_make_head_pos(raw) if mc else None,
+    )
+    want = mne.preprocessing.maxwell_filter(raw, verbose=False, **mf_kws)
+    got = _maxwell_filter_chunks(
+        raw, chunk_duration=chunk_duration, n_threads=n_threads, mf_kws=mf_kws
+    )
+    assert got.ch_names == want.ch_names
+    assert got.first_samp == want.first_samp
+    np.testing.assert_allclose(got.get_data("mag"), want.get_data("mag"), atol=1e-26)
+    assert got.annotations == want.annotations
+    assert got.info["dev_head_t"] == want.info["dev_head_t"]
+
+
+@pytest.mark.parametrize("batched", [False, True])
+def test_chpi_amplitudes_snr(batched):
+    """Test estimating the cHPI amplitudes and SNR in one pass."""
+    raw = _make_raw(sfreq=1000.0, n_times=5000)
+    _add_chpi(raw)
+    kwargs = dict(t_step_min=0.05, t_window=0.2, verbose=False)
+    want_amplitudes = mne.chpi.compute_chpi_amplitudes(raw, **kwargs)
+    want_snr = mne.chpi.compute_chpi_snr(raw, **kwargs)
+    del kwargs["verbose"]
+    got_amplitudes, got_snr = _compute_chpi_amplitudes_snr(
+        raw, batched=batched, **kwargs
+    )
+    assert got_amplitudes.keys() == want_amplitudes.keys()
+    assert got_amplitudes["proj"] == want_amplitudes["proj"]
+    np.testing.assert_allclose(got_amplitudes["times"], want_amplitudes["times"])
+    got_slopes = got_amplitudes["slopes"]
+    want_slopes = want_amplitudes["slopes"]
+    # The windows during which only two coils are on are skipped
+    skipped = np.isnan(want_slopes).all(axis=(1, 2))
+    assert 0 < skipped.sum() < len(skipped) - 2
+    # The sign of the amplitudes is arbitrary
+    signs = np.sign(np.sum(got_slopes * want_slopes, axis=-1, keepdims=True))
+    np.testing.assert_allclose(
+        np.where(skipped[:, None, None], got_slopes, got_slopes * signs),
+        want_slopes,
+        rtol=1e-7,
+    )
+    assert got_snr.keys() == want_snr.keys()
+    for key in want_snr:
+        np.testing.assert_allclose(got_snr[key], want_snr[key], err_msg=key)
+    assert (got_snr["mag_snr"][~skipped] > 10).all()
+
+
+def test_chpi_amplitudes_snr_fallback(monkeypatch):
+    """Test estimating the cHPI amplitudes and SNR without private MNE API."""
+    raw = _make_raw(sfreq=1000.0, n_times=2000)
+    _add_chpi(raw)
+    kwargs = dict(t_step_min=0.05, t_window=0.2)
+    want_amplitudes = mne.chpi.compute_chpi_amplitudes(raw, **kwargs, verbose=False)
+    want_snr = mne.chpi.compute_chpi_snr(raw, **kwargs, verbose=False)
+    monkeypatch.setattr(_02_head_pos, "_setup_chpi_fit", lambda raw, t_window: None)
+    got_amplitudes, got_snr = _02_head_pos._compute_chpi_amplitudes_snr(
+        raw, batched=True, **kwargs
+    )
+    np.testing.assert_array_equal(got_amplitudes["slopes"], want_amplitudes["slopes"])
+    for key in want_snr:
+        np.testing.assert_array_equal(got_snr[key], want_snr[key], err_msg=key)
+
+
+def test_recompute_chpi_amplitudes(tmp_path, monkeypatch):
+    """Test that recomputing the cHPI amplitudes overwrites the outputs."""
+    raw = _make_raw(sfreq=1000.0, n_times=2000)
+    _add_chpi(raw)
+    bids_path = BIDSPath(
+        subject="01",
+        task="a",
+        run="01",
+        suffix="meg",
+        extension=".fif",
+        datatype="meg",
+        root=tmp_path / "bids",
+        check=False,
+    )
+    in_key = "raw_task-a_run-01"
+    monkeypatch.setattr(
+        _02_head_pos, "_get_run_rest_noise_path", lambda **kwargs: {in_key: bids_path}
+    )
+    monkeypatch.setattr(
+        _02_head_pos, "import_experimental_data", lambda **kwargs: raw.copy()
+    )
+    monkeypatch.setattr(
+        _02_head_pos,
+        "_open_report",
+        lambda **kwargs: contextlib.nullcontext(mne.Report()),
+    )
+    exec_params = SimpleNamespace(
+        deriv_root=tmp_path,
+        memory_location=False,
+        memory_file_method="mtime",
+        memory_content_store=False,
+        on_error="abort",
+    )
+    cfg = SimpleNamespace(
+        deriv_root=tmp_path,
+        mf_reference_run="01",
+        mf_mc_t_step_min=0.1,
+        mf_mc_batched_fit=False,
+    )
+    chpi_paths = _02_head_pos._get_chpi_paths(cfg=cfg, bids_path_in=bids_path)
+    chpi_paths["info"].fpath.parent.mkdir(parents=True)
+    for t_window in (0.2, 0.3):
+        cfg.mf_mc_t_window = t_window
+        log_info = _02_head_pos.run_chpi_amplitudes(
+            cfg=cfg,
+            exec_params=exec_params,
+            subject="01",
+            session=None,
+            run="01",
+            task="a",
+        )
+        assert log_info["success"]
+        info = mne.io.read_info(chpi_paths["info"], verbose=False)
+        assert info["ch_names"] == raw.ch_names
+
+
+def test_recompute_ref_info(tmp_path, monkeypatch):
+    """Test that rewriting the reference run info overwrites the output."""
+    raw = _make_raw(sfreq=1000.0, n_times=100)
+    bids_path = BIDSPath(
+        subject="01",
+        task="a",
+        run="01",
+        suffix="meg",
+        extension=".fif",
+        datatype="meg",
+        root=tmp_path / "bids",
+        check=False,
+    )
+    monkeypatch.setattr(
+        _03_maxfilter,
+        "_get_mf_reference_run_path",
+        lambda **kwargs: dict(raw_ref_run=bids_path),
+    )
+    monkeypatch.setattr(_03_maxfilter, "read_raw_bids", lambda **kwargs: raw.copy())
+    exec_params = SimpleNamespace(
+        deriv_root=tmp_path,
+        memory_location=False,
+        memory_file_method="mtime",
+        memory_content_store=False,
+        on_error="abort",
+    )
+    cfg = SimpleNamespace(
+        deriv_root=tmp_path,
+        mf_reference_run="01",
+        reader_extra_params=dict(),
+        read_raw_bids_verbose="error",
+    )
+    fname = _03_maxfilter._get_ref_info_path(cfg=cfg, bids_path_ref_in=bids_path)
+    fname.fpath.parent.mkdir(parents=True)
+    for bads in ([], ["MEG0001"]):
+        raw.info["bads"] = bads
+        log_info = _03_maxfilter.write_ref_info(
+            cfg=cfg, exec_params=exec_params, subject="01", session=None
+        )
+        assert log_info["success"]
+        assert mne.io.read_info(fname, verbose=False)["bads"] == bads
+
+
+def test_read_mf_calibration(tmp_path, monkeypatch):
+    """Test reading a fine-calibration file once."""
+    info = _make_raw(sfreq=200.0, n_times=1).info
+    calibration = dict(
+        ch_names=info["ch_names"],
+        locs=np.array([ch["loc"] for ch in info["chs"]]),
+        imb_cals=np.ones((len(info["ch_names"]), 1)),
+    )
+    fname = tmp_path / "sss_cal.dat"
+    mne.preprocessing.write_fine_calibration(fname, calibration)
+    assert _read_mf_calibration(None) is None
+    want = mne.preprocessing.read_fine_calibration(fname)
+    got = _read_mf_calibration(fname)
+    np.testing.assert_allclose(got["locs"], want["locs"])
+    # Changes do not affect the next call, which does not read the file
+    got["locs"][:] = 0
+    monkeypatch.setattr(mne.preprocessing, "read_fine_calibration", None)
+    np.testing.assert_allclose(_read_mf_calibration(fname)["locs"], want["locs"])
+
+
+def test_get_mf_head_origin(monkeypatch):
+    """Test fitting the head origin once."""
+    info = mne.create_info(1, 1000.0)
+    origin = np.array([0.0, 0.0, 0.04])
+    assert _get_mf_head_origin(origin, info) is origin
+    # Without digitization, MNE has to raise the error
+    assert _get_mf_head_origin("auto", info) == "auto"
+    montage = mne.channels.make_standard_montage("biosemi64")
+    info = mne.create_info(montage.ch_names, 1000.0, "eeg")
+    info.set_montage(montage)
+    want = mne.bem.fit_sphere_to_headshape(info, units="m", verbose=False)[1]
+    np.testing.assert_allclose(_get_mf_head_origin("auto", info), want)
+    monkeypatch.setattr(mne.bem, "fit_sphere_to_headshape", None)
+    np.testing.assert_allclose(_get_mf_head_origin("auto", info.copy()), want)
+    # Only the most recently used head origins are kept
+    monkeypatch.undo()
+    for shift in range(5):
+        info_shifted = info.copy()
+        for d in info_shifted["dig"]:
+            d["r"][2] += 0.001 * (shift + 1)
+        got = _get_mf_head_origin("auto", info_shifted)
+        np.testing.assert_allclose(got, want + [0, 0, 0.001 * (shift + 1)], atol=1e-9)
+    assert _fit_mf_head_origin_cached.cache_info().currsize <= 4
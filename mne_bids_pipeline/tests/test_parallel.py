@@ -0,0 +1,26 @@
+"""Test the parallelization."""
+
+from types import SimpleNamespace
+
+from mne_bids_pipeline import _parallel
+
+
+def test_worker_reuse(monkeypatch):
+    """Test detecting whether the worker processes are reused."""
+    monkeypatch.setattr(
+        _parallel, "_worker_pool", SimpleNamespace(pids=frozenset(), n_reused=0)
+    )
+    backend_kwargs = dict(n_jobs=2, inner_max_num_threads=1, idle_worker_timeout=60)
+    _parallel._warm_up_workers(backend_kwargs=backend_kwargs)
+    pids = _parallel._worker_pool.pids
+    assert pids
+    assert _parallel._worker_pool.n_reused == 0
+    for n_reused in (1, 2):
+        _parallel._warm_up_workers(backend_kwargs=backend_kwargs)
+        assert _parallel._worker_pool.n_reused == n_reused
+        assert _parallel._worker_pool.pids == pids
+    # Different arguments make joblib start new workers
+    backend_kwargs["idle_worker_timeout"] = 30
+    _parallel._warm_up_workers(backend_kwargs=backend_kwargs)
+    assert _parallel._worker_pool.n_reused == 2
+    assert _parallel._worker_pool.pids != pids